@@ -3,6 +3,7 @@ import time
 import json
 import requests
 import hashlib
+import threading
 
 import torch
 from PIL import Image
@@ -14,7 +15,14 @@ import numpy as np
 import skimage
 from utils import set_running_statistics
 from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
+from ofa.stereo_matching.networks.freeze import freeze_for_inference
 from translator import translate, get_word_result
+from model_cache import model_cache, make_cache_key
+from inference_server import MicroBatchServer, class_transform
+
+CLASS_SUBNET = {'ks': 7, 'e': 6, 'd': 4}
+STEREO_SUBNET = {'ks': 7, 'e': 8, 'd': 4, 's': 4}
+
 def is_image_file(filename):
 
     return any(filename.endswith(extension) for extension in ['.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG'])
@@ -44,10 +52,7 @@ def images_to_tensors(folder):
     img_tensors = img_tensors[1:, :, :, :]
     return img_tensors
 
-def detect_class(filename, model=None, ckpt=None):
-
-    print(model, ckpt)
-    model = model.lower()
+def build_class_net(model, ckpt=None, subnet_config=None):
 
     if 'resnet' in model:
         net = models.resnet101(pretrained=True)
@@ -58,44 +63,62 @@ def detect_class(filename, model=None, ckpt=None):
         model_dict = init['state_dict']
         net.load_state_dict(model_dict)
     
-        net.set_active_subnet(ks=7, e=6, d=4)
+        net.set_active_subnet(**subnet_config)
+        net = net.get_active_subnet(preserve_weight=True)
         #net.sample_active_subnet()
-        #subnet = net.get_active_subnet(preserve_weight=True)
         #img_tensors = images_to_tensors('data/class_samples')
         #set_running_statistics(net, img_tensors)
-    
-    net.eval()
+    else:
+        raise ValueError('unrecognized type of model: %s' % model)
+
+    return freeze_for_inference(net, inplace=True)
+
+def get_class_net(model, ckpt=None, subnet_config=CLASS_SUBNET):
+
+    if 'ofa' in model:
+        key = make_cache_key(ckpt, model, subnet_config)
+    else:
+        # pretrained torchvision weights, the checkpoint is not used
+        key = make_cache_key(None, model)
+        ckpt = None
+    return model_cache.get(key, lambda: build_class_net(model, ckpt, subnet_config))
+
+_class_servers = {}
+_class_servers_lock = threading.Lock()
+
+def get_class_server(model, ckpt=None, subnet_config=CLASS_SUBNET, **kwargs):
+    """Started micro-batching server of a class net, shared by all callers of the same model
+
+    The net is looked up in `model_cache` for every batch, so a checkpoint overwritten in place is
+    reloaded. kwargs are passed to `MicroBatchServer` when the server is created.
+    """
+    key = (model, None if ckpt is None else os.path.abspath(ckpt), make_cache_key(None, model, subnet_config))
+    with _class_servers_lock:
+        if key not in _class_servers:
+            _class_servers[key] = MicroBatchServer(lambda: get_class_net(model, ckpt, subnet_config), **kwargs).start()
+        return _class_servers[key]
+
+def detect_class(filename, model=None, ckpt=None):
+
+    print(model, ckpt)
+    model = model.lower()
 
-    transform = transforms.Compose([
-                        transforms.Resize(256),
-                        transforms.CenterCrop(224),
-                        transforms.ToTensor(),
-                        transforms.Normalize(
-                        mean=[0.485, 0.456, 0.406],
-                        std=[0.229, 0.224, 0.225]
-                        )])
     img = Image.open(filename).convert('RGB')
-    batch_t = torch.unsqueeze(transform(img), 0)
-    
-    output = net(batch_t)
-    
-    print(output.size())
-    
+    # concurrent sessions are batched together by the server
+    top = get_class_server(model, ckpt).classify(class_transform(img))
+
     with open('imagenet_classes.txt') as f:
         classes = [line.strip() for line in f.readlines()]
-    
-    prob = torch.nn.functional.softmax(output, dim=1)[0] * 100
-    _, indices = torch.sort(output, descending=True)
 
-    result_classes = [classes[idx].split()[-1].replace('_', ' ') for idx in indices[0][:5]]
+    result_classes = [classes[idx].split()[-1].replace('_', ' ') for idx, _ in top]
     print(result_classes)
     #result_classes = [get_word_result(translate(rc)) for rc in result_classes]
     #print(result_classes)
-    result_probs = [prob[idx].item() for idx in indices[0][:5]]
+    result_probs = [prob for _, prob in top]
     return [(rc, rp) for rc, rp in zip(result_classes, result_probs)]
     #return [(classes[idx], prob[idx].item()) for idx in indices[0][:5]]
 
-def detect_stereo(img_left, img_right, model=None, ckpt=None):
+def build_stereo_net(ckpt, subnet_config):
 
     ofa_network = OFAAANet(ks_list=[3,5,7], expand_ratio_list=[2,4,6,8], depth_list=[2,3,4], scale_list=[2,3,4])
     
@@ -104,18 +127,22 @@ def detect_stereo(img_left, img_right, model=None, ckpt=None):
     model_dict = init['state_dict']
     ofa_network.load_state_dict(model_dict)
     
-    d = 4
-    e = 8
-    ks = 7
-    s = 4
-    ofa_network.set_active_subnet(ks=ks, d=d, e=e, s=s)
+    ofa_network.set_active_subnet(**subnet_config)
     subnet = ofa_network.get_active_subnet(preserve_weight=True)
     #save_path = "checkpoints/aanet_D%d_E%d_K%d_S%d" % (d, e, ks, s)
     #torch.save(subnet.state_dict(), save_path)
     #subnet.load_bn_stats('checkpoints/test_bn_stats.npy')
     
-    net = subnet
-    net.eval()
+    return freeze_for_inference(subnet, inplace=True)
+
+def get_stereo_net(ckpt, subnet_config=STEREO_SUBNET):
+
+    key = make_cache_key(ckpt, 'ofa_aanet', subnet_config)
+    return model_cache.get(key, lambda: build_stereo_net(ckpt, subnet_config))
+
+def detect_stereo(img_left, img_right, model=None, ckpt=None):
+
+    net = get_stereo_net(ckpt)
     
     transform = transforms.Compose([
                         transforms.Resize([576, 960]),
@@ -0,0 +1,295 @@
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torchvision import transforms
+
+# number of most recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+
+class_transform = transforms.Compose([
+    transforms.Resize(256),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+])
+
+
+def preprocess_image(data):
+    """Encoded image bytes (or a file object) -> normalized [3, 224, 224] tensor"""
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    return class_transform(Image.open(data).convert('RGB'))
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if len(sorted_values) == 0:
+        return 0.
+    rank = int(round(p / 100. * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+class ServerBusy(RuntimeError):
+    """Raised by `MicroBatchServer.submit` when the request queue is full"""
+    pass
+
+
+class _Request(object):
+    __slots__ = ('tensor', 'future', 'enqueue_time')
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueue_time = time.time()
+
+
+class MicroBatchServer(object):
+    """In-process classification server that coalesces concurrent requests into micro-batches
+
+    A single worker thread takes the oldest request, then waits at most `max_wait_ms` from its
+    arrival for more, up to `max_batch_size`, and runs them as one batch. The queue is bounded,
+    `submit` raises `ServerBusy` instead of queueing without limit (or waits if `block=True`).
+
+    Args:
+        net: eval mode classifier, or a callable returning it, called for every batch so that a
+            `model_cache` lookup picks up reloaded checkpoints
+        max_batch_size: largest batch run at once
+        max_wait_ms: longest time the oldest request waits for others to join its batch
+        max_queue: number of requests waiting before new ones are rejected
+        topk: number of (index, probability) pairs returned per request
+        device: device to run the net on
+    """
+
+    def __init__(self, net, max_batch_size=8, max_wait_ms=5., max_queue=64, topk=5, device='cpu'):
+        self._net = net
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.topk = topk
+        self.device = torch.device(device)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = 0
+        self._latency = deque(maxlen=LATENCY_WINDOW)  # enqueue to result, s
+        self._batch_time = deque(maxlen=LATENCY_WINDOW)  # forward time per batch, s
+
+    @property
+    def net(self):
+        if isinstance(self._net, torch.nn.Module):
+            return self._net
+        return self._net()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='micro-batch-server', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop after the requests already queued are served"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, tensor, block=False, timeout=None):
+        """Queue a normalized [3, H, W] image, returns a Future of [(class index, probability %)] * topk"""
+        request = _Request(tensor)
+        try:
+            self._queue.put(request, block=block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise ServerBusy('%d requests queued' % self._queue.maxsize)
+        return request.future
+
+    def classify(self, tensor, timeout=None):
+        return self.submit(tensor, block=True, timeout=timeout).result(timeout)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first.enqueue_time + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                # past the deadline only what is already queued joins the batch
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # serve this batch first, then stop
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if len(batch) > 0:
+                self._process(batch)
+
+    def _process(self, batch):
+        # requests of different image sizes can not share a batch
+        groups = {}
+        for request in batch:
+            groups.setdefault(tuple(request.tensor.shape), []).append(request)
+
+        for requests in groups.values():
+            try:
+                start = time.time()
+                images = torch.stack([r.tensor for r in requests]).to(self.device)
+                with torch.no_grad():
+                    prob = F.softmax(self.net(images), dim=1) * 100
+                    top_prob, top_idx = prob.topk(self.topk, dim=1)
+                top_prob, top_idx = top_prob.cpu().tolist(), top_idx.cpu().tolist()
+                batch_time = time.time() - start
+            except Exception as e:
+                with self._lock:
+                    self.errors += len(requests)
+                for r in requests:
+                    r.future.set_exception(e)
+                continue
+
+            end = time.time()
+            with self._lock:
+                self.batches += 1
+                self.requests += len(requests)
+                self._batch_time.append(batch_time)
+                self._latency.extend(end - r.enqueue_time for r in requests)
+            for r, idx, p in zip(requests, top_idx, top_prob):
+                r.future.set_result(list(zip(idx, p)))
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = self.rejected = self.batches = self.errors = 0
+            self._latency.clear()
+            self._batch_time.clear()
+
+    def stats(self):
+        with self._lock:
+            latency = sorted(self._latency)
+            batch_time = sorted(self._batch_time)
+            return {
+                'requests': self.requests,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'batches': self.batches,
+                'avg_batch_size': self.requests / self.batches if self.batches > 0 else 0.,
+                'queued': self._queue.qsize(),
+                'p50_ms': percentile(latency, 50) * 1000,
+                'p95_ms': percentile(latency, 95) * 1000,
+                'p99_ms': percentile(latency, 99) * 1000,
+                'batch_p50_ms': percentile(batch_time, 50) * 1000,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'MANTA-inference'
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, self.server.batch_server.stats())
+        else:
+            self._reply(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/classify':
+            self._reply(404, {'error': 'unknown path %s' % self.path})
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            tensor = preprocess_image(data)
+        except Exception as e:
+            self._reply(400, {'error': 'bad image: %s' % e})
+            return
+        try:
+            top = self.server.batch_server.submit(tensor).result()
+        except ServerBusy as e:
+            self._reply(503, {'error': str(e)})
+            return
+        except Exception as e:
+            # e.g. the model failed on the batch, the client still gets a reply
+            self._reply(500, {'error': str(e)})
+            return
+        classes = self.server.classes
+        self._reply(200, {'top': [[classes[i] if classes is not None else i, p] for i, p in top]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(batch_server, host='127.0.0.1', port=0, classes=None):
+    """Expose a started `MicroBatchServer` over HTTP in a background thread
+
+    POST /classify with the encoded image as body, GET /metrics for `stats()`.
+    Port 0 picks a free port, read it from `httpd.server_address`. Stop with `httpd.shutdown()`.
+    """
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.daemon_threads = True
+    httpd.batch_server = batch_server
+    httpd.classes = classes
+    threading.Thread(target=httpd.serve_forever, name='inference-http', daemon=True).start()
+    return httpd
+
+
+class LoopbackClient(object):
+    """HTTP client of `serve_http`, one connection per client, not thread-safe"""
+
+    def __init__(self, port, host='127.0.0.1', timeout=60):
+        self.conn = HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, body=None):
+        self.conn.request(method, path, body=body)
+        response = self.conn.getresponse()
+        result = json.loads(response.read())
+        if response.status == 503:
+            raise ServerBusy(result['error'])
+        if response.status != 200:
+            raise RuntimeError('%d: %s' % (response.status, result['error']))
+        return result
+
+    def classify(self, image_bytes):
+        """[(label or class index, probability %)] * topk"""
+        return [tuple(t) for t in self._request('POST', '/classify', image_bytes)['top']]
+
+    def metrics(self):
+        return self._request('GET', '/metrics')
+
+    def close(self):
+        self.conn.close()
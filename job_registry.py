@@ -0,0 +1,125 @@
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+import psutil
+
+# process create times are rounded differently by psutil and the OS, allow some slack when matching them
+CREATE_TIME_SLACK = 1.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    jtype TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    create_time REAL,
+    hosts TEXT,
+    num_nodes INTEGER,
+    cmd TEXT,
+    log_file TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    exit_status INTEGER
+)
+'''
+
+
+class JobRegistry(object):
+    """On-disk (SQLite) record of the training jobs launched by trainer.py
+
+    A job is registered with the PID of its launcher process (mpirun) when it starts and finished with
+    its exit status when it ends. Status queries read the table and check the liveness of the unfinished
+    jobs with psutil, without scanning the process table. The PID is matched with the process create
+    time, so a PID reused by another process does not make a job look running. Jobs whose process is
+    gone without a recorded exit status (e.g. the launching server was restarted) are finished with
+    exit_status NULL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_type_end ON jobs (jtype, end_time)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one connection per call: the registry is used from Streamlit script threads and JobThreads
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def register(self, name, jtype, pid, hosts=None, num_nodes=None, cmd=None, log_file=None):
+        """Record a launched job, returns its id"""
+        try:
+            create_time = psutil.Process(pid).create_time()
+        except psutil.Error:
+            create_time = None
+        with self._connect() as conn:
+            cur = conn.execute(
+                'INSERT INTO jobs (name, jtype, pid, create_time, hosts, num_nodes, cmd, log_file, start_time) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, jtype, pid, create_time, hosts, num_nodes, None if cmd is None else json.dumps(cmd),
+                 log_file, time.time()))
+            return cur.lastrowid
+
+    def finish(self, job_id, exit_status=None):
+        """Record the exit of a job, an unknown (None) status can be completed later by the launcher"""
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET end_time = COALESCE(end_time, ?), exit_status = ? '
+                         'WHERE id = ? AND exit_status IS NULL', (time.time(), exit_status, job_id))
+
+    def get(self, job_id):
+        """The current row of a job, None if it is not recorded"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return None if row is None else dict(row)
+
+    @staticmethod
+    def is_alive(job):
+        try:
+            proc = psutil.Process(job['pid'])
+            if job['create_time'] is not None and abs(proc.create_time() - job['create_time']) > CREATE_TIME_SLACK:
+                return False
+            return proc.status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+
+    def running(self, jtype=None):
+        """Unfinished jobs whose process is alive, oldest first; the others are marked finished"""
+        query = 'SELECT * FROM jobs WHERE end_time IS NULL'
+        args = ()
+        if jtype is not None:
+            query += ' AND jtype = ?'
+            args = (jtype,)
+        with self._connect() as conn:
+            jobs = [dict(row) for row in conn.execute(query + ' ORDER BY id', args)]
+        alive = []
+        for job in jobs:
+            if self.is_alive(job):
+                alive.append(job)
+            else:
+                self.finish(job['id'])
+        return alive
+
+    def jobs(self, jtype=None, name=None):
+        """All the recorded jobs, oldest first"""
+        query = 'SELECT * FROM jobs'
+        conds, args = [], []
+        if jtype is not None:
+            conds.append('jtype = ?')
+            args.append(jtype)
+        if name is not None:
+            conds.append('name = ?')
+            args.append(name)
+        if conds:
+            query += ' WHERE ' + ' AND '.join(conds)
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query + ' ORDER BY id', args)]
@@ -0,0 +1,234 @@
+import glob
+import json
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+from log_tail import iter_new_lines
+
+# tables of the index and their float64 columns, NaN where a line does not have the value
+TABLES = {
+    # one row per tqdm progress line of the job stdout; phase 0 train, 1 validation
+    'iters': ['phase', 'epoch', 'step', 'total', 'subnet', 'loss', 'epe', 'd1', 'thres1', 'thres2', 'thres3',
+              'top1', 'top5', 'lr', 'data_time', 'img_size'],
+    # one row per `Valid [e/n] ...` line of run_manager.write_log; val_metric is epe or top-1, see meta
+    'epochs': ['epoch', 'n_epochs', 'val_loss', 'val_metric', 'best_metric', 'train_metric', 'train_loss'],
+    # one row per subnet validated at the end of an epoch
+    'subnets': ['epoch', 'subnet', 'value'],
+}
+PHASES = ['train', 'valid']
+
+_NUM = r'(?:[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?|nan|-?inf)'
+_TQDM_RE = re.compile(r'(Train|Validate) Epoch #(\d+) ?(.*?): *\d+%\|[^|]*\| *(\d+)/(\d+)')
+_POSTFIX_RE = re.compile(r'(?:, |\[)(loss|epe|d1|thres1|thres2|thres3|top1|top5|lr|data_time|R|img_size)'
+                         r'=(%s)(?=[,\]])' % _NUM)
+_VALID_RE = re.compile(r'Valid \[(\d+)/(\d+)\] loss=(%s), (epe|top-1)=(%s) \((%s)\)'
+                       r'(?:, Train (?:epe|top-1) (%s), Train loss (%s))?' % ((_NUM,) * 5))
+_SUBNET_RE = re.compile(r'(\S+) \((%s)\), ' % _NUM)
+
+
+class LogIndex(object):
+    """Append-only columnar index of the metrics in training logs, one directory per job
+
+    Each table of TABLES is a directory of `<column>.f64` files (raw float64, appended to) and
+    `meta.json` holds the row counts, the subnet names and the byte offset reached in every source
+    log, so `update` only parses the lines appended since the last call. The row counts are written
+    after the columns: rows of an interrupted update are cut off on the next open and re-parsed.
+    Queries read only the requested columns. One writer at a time.
+
+    Sources are the stdout logs of trainer.train_class / train_stereo (`logs/<job>_<type>.log`, tqdm
+    progress lines) and the `valid_console.txt` written by run_manager.write_log.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def jobs(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(job for job in os.listdir(self.root) if os.path.isfile(self._meta_path(job)))
+
+    def _meta_path(self, job):
+        return os.path.join(self.root, job, 'meta.json')
+
+    def meta(self, job):
+        path = self._meta_path(job)
+        if not os.path.isfile(path):
+            return {'rows': {table: 0 for table in TABLES}, 'sources': {}, 'subnets': [], 'val_metric': None}
+        with open(path, 'r') as fin:
+            return json.load(fin)
+
+    def _write_meta(self, job, meta):
+        path = self._meta_path(job)
+        tmp = '%s.tmp.%d' % (path, os.getpid())
+        with open(tmp, 'w') as fout:
+            json.dump(meta, fout)
+        os.replace(tmp, path)
+
+    def _column_path(self, job, table, column):
+        return os.path.join(self.root, job, table, '%s.f64' % column)
+
+    def update(self, job, sources):
+        """Parse what was appended to the `sources` log files of `job`, returns the number of new rows"""
+        with self._lock:
+            meta = self.meta(job)
+            for table in TABLES:
+                os.makedirs(os.path.join(self.root, job, table), exist_ok=True)
+                # cut off the rows of an interrupted update
+                for column in TABLES[table]:
+                    path = self._column_path(job, table, column)
+                    if not os.path.exists(path):
+                        open(path, 'wb').close()
+                    if os.path.getsize(path) != meta['rows'][table] * 8:
+                        with open(path, 'r+b') as f:
+                            f.truncate(meta['rows'][table] * 8)
+
+            n_rows = 0
+            for path in sources:
+                if not os.path.isfile(path):
+                    continue
+                st = os.stat(path)
+                source = meta['sources'].get(path)
+                if source is None or source['ino'] != st.st_ino or st.st_size < source['offset']:
+                    # new, replaced or truncated log
+                    source = {'ino': st.st_ino, 'offset': 0}
+                for lines, offset in iter_new_lines(path, source['offset']):
+                    rows = {table: [] for table in TABLES}
+                    for line in lines:
+                        self._parse_line(line, rows, meta)
+                    n_rows += self._append(job, rows, meta)
+                    source['offset'] = offset
+                    meta['sources'][path] = source
+                    self._write_meta(job, meta)
+                meta['sources'][path] = source
+            self._write_meta(job, meta)
+            return n_rows
+
+    @staticmethod
+    def _subnet_id(meta, name):
+        if not name:
+            return np.nan
+        if name not in meta['subnets']:
+            meta['subnets'].append(name)
+        return meta['subnets'].index(name)
+
+    def _parse_line(self, line, rows, meta):
+        match = _TQDM_RE.search(line)
+        if match is not None:
+            values = dict(_POSTFIX_RE.findall(line[match.end():]))
+            if not values:
+                return
+            row = dict.fromkeys(TABLES['iters'], np.nan)
+            row.update(phase=PHASES.index('train' if match.group(1) == 'Train' else 'valid'),
+                       epoch=int(match.group(2)), subnet=self._subnet_id(meta, match.group(3).strip()),
+                       step=int(match.group(4)), total=int(match.group(5)))
+            # tqdm prints the last step again when it is closed
+            key = [row['phase'], row['epoch'], None if np.isnan(row['subnet']) else row['subnet'], row['step']]
+            if key == meta.get('last_iter'):
+                return
+            meta['last_iter'] = key
+            for name, val in values.items():
+                row['img_size' if name == 'R' else name] = float(val)
+            rows['iters'].append(row)
+            return
+
+        match = _VALID_RE.search(line)
+        if match is not None:
+            epoch = int(match.group(1))
+            meta['val_metric'] = match.group(4)
+            train_metric, train_loss = match.group(7), match.group(8)
+            rows['epochs'].append({
+                'epoch': epoch, 'n_epochs': int(match.group(2)), 'val_loss': float(match.group(3)),
+                'val_metric': float(match.group(5)), 'best_metric': float(match.group(6)),
+                'train_metric': np.nan if train_metric is None else float(train_metric),
+                'train_loss': np.nan if train_loss is None else float(train_loss),
+            })
+            for name, value in _SUBNET_RE.findall(line[match.end():]):
+                rows['subnets'].append({'epoch': epoch, 'subnet': self._subnet_id(meta, name), 'value': float(value)})
+
+    def _append(self, job, rows, meta):
+        n_rows = 0
+        for table, table_rows in rows.items():
+            if not table_rows:
+                continue
+            for column in TABLES[table]:
+                values = np.array([row[column] for row in table_rows], dtype=np.float64)
+                with open(self._column_path(job, table, column), 'ab') as f:
+                    values.tofile(f)
+            meta['rows'][table] += len(table_rows)
+            n_rows += len(table_rows)
+        return n_rows
+
+    def query(self, job, table='iters', columns=None, phase=None, epoch=None, subnet=None):
+        """Columns of `table` for `job` as numpy arrays, optionally filtered
+
+        Args:
+            columns: names from TABLES[table], plus 'global_step' ((epoch - 1) * total + step) for iters
+            phase: 'train' or 'valid' (iters)
+            epoch: an epoch or a (first, last) range, inclusive
+            subnet: subnet name (iters of a subnet validation, subnets)
+        Returns:
+            dict of column name -> float64 array
+        """
+        meta = self.meta(job)
+        n = meta['rows'][table]
+        columns = list(TABLES[table] if columns is None else columns)
+        needed = set(c for c in columns if c != 'global_step')
+        if 'global_step' in columns:
+            needed.update(['epoch', 'total', 'step'])
+        if phase is not None:
+            needed.add('phase')
+        if epoch is not None:
+            needed.add('epoch')
+        if subnet is not None:
+            needed.add('subnet')
+        data = {c: np.fromfile(self._column_path(job, table, c), dtype=np.float64, count=n) if n > 0 else
+                np.zeros(0) for c in needed}
+
+        mask = np.ones(n, dtype=bool)
+        if phase is not None:
+            mask &= data['phase'] == PHASES.index(phase)
+        if epoch is not None:
+            first, last = (epoch, epoch) if np.isscalar(epoch) else epoch
+            mask &= (data['epoch'] >= first) & (data['epoch'] <= last)
+        if subnet is not None:
+            sid = meta['subnets'].index(subnet) if subnet in meta['subnets'] else -1
+            mask &= data['subnet'] == sid
+        if 'global_step' in columns:
+            data['global_step'] = (data['epoch'] - 1) * data['total'] + data['step']
+        if mask.all():
+            return {c: data[c] for c in columns}
+        return {c: data[c][mask] for c in columns}
+
+    def subnet_names(self, job):
+        return list(self.meta(job)['subnets'])
+
+    def drop(self, job):
+        """Remove the rows of `job`, e.g. before its log is started again from scratch"""
+        with self._lock:
+            shutil.rmtree(os.path.join(self.root, job), ignore_errors=True)
+
+
+def discover_sources(log_root='logs', run_paths=None):
+    """{job: [log files]} of the trainer stdout logs in `log_root` (`<job>_class.log`, `<job>_stereo.log`)
+
+    Args:
+        run_paths: optional {job: run_manager path}, adds `<path>/logs/valid_console.txt`
+    """
+    sources = {}
+    for path in sorted(glob.glob(os.path.join(log_root, '*_class.log')) +
+                       glob.glob(os.path.join(log_root, '*_stereo.log'))):
+        job = os.path.basename(path)[:-len('.log')]
+        sources.setdefault(job, []).append(path)
+    for job, run_path in (run_paths or {}).items():
+        sources.setdefault(job, []).append(os.path.join(run_path, 'logs', 'valid_console.txt'))
+    return sources
+
+
+def update_all(index, log_root='logs', run_paths=None):
+    """Update `index` with every discovered log, returns the number of new rows"""
+    return sum(index.update(job, paths) for job, paths in discover_sources(log_root, run_paths).items())
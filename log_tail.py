@@ -0,0 +1,178 @@
+import os
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+# bytes read per seek when tailing backwards, and per chunk of a download
+TAIL_BLOCK_SIZE = 64 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _split_lines(data):
+    """Split `data` (bytes) into complete lines and the trailing incomplete one
+
+    Lines end with '\\n', '\\r\\n' or '\\r', as for files read in text mode (tqdm progress bars rewrite
+    their line with '\\r'). A trailing '\\r' stays incomplete, it may be the start of '\\r\\n'.
+    """
+    lines = data.splitlines(True)
+    if lines and not lines[-1].endswith(b'\n'):
+        return lines[:-1], lines[-1]
+    return lines, b''
+
+
+def _decode(lines):
+    return [line.rstrip(b'\r\n').decode('utf-8', errors='replace') for line in lines]
+
+
+def _read_tail(f, size, n, block_size=TAIL_BLOCK_SIZE):
+    """Bytes of the last `n` lines before offset `size` of the binary file `f`, reading backwards"""
+    pos = size
+    data = b''
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        data = f.read(step) + data
+        # n lines after the first one, which may be cut, and before the last one, which may be incomplete
+        if len(data.splitlines()) > n + 1:
+            break
+    if pos > 0:
+        # drop the first line, it may start before the data read
+        lines = data.splitlines(True)
+        data = b''.join(lines[1:])
+    return data
+
+
+def tail_lines(path, n=20):
+    """The last `n` lines of the file at `path`, without the line ends, reading O(n) bytes from its end"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        lines, partial = _split_lines(_read_tail(f, size, n))
+    lines = _decode(lines) + (_decode([partial]) if partial else [])
+    return lines[-n:]
+
+
+def iter_new_lines(path, offset=0, block_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield (lines, end_offset) for the complete lines of `path` after byte `offset`, a block at a time
+
+    `end_offset` follows the last complete line of the block; an incomplete last line of the file is
+    left for a later call.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        partial = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            lines, partial = _split_lines(partial + block)
+            offset += sum(len(line) for line in lines)
+            if lines:
+                yield _decode(lines), offset
+
+
+def iter_chunks(path, chunk_size=DOWNLOAD_CHUNK_SIZE, size=None):
+    """Yield the file at `path` in chunks of `chunk_size` bytes, up to `size` bytes (its size when opened)"""
+    with open(path, 'rb') as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        remaining = size
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class _FileState(object):
+
+    def __init__(self, ino, offset, lines, partial):
+        self.ino = ino
+        self.offset = offset
+        self.lines = lines
+        self.partial = partial
+
+
+class LogFollower(object):
+    """Keeps the last lines of followed log files, reading only the bytes appended since the last call
+
+    The first call for a file tails it backwards from its end. Later calls read from the stored offset
+    to the current end of file. A file that was replaced (new inode) or truncated is tailed again.
+    Thread-safe, so one follower can be shared by all the sessions of a Streamlit app.
+
+    Args:
+        max_lines: number of lines kept per file
+    """
+
+    def __init__(self, max_lines=20):
+        self.max_lines = max_lines
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def tail(self, path, n=None):
+        """The last `n` (at most `max_lines`) lines of the file at `path`, without the line ends"""
+        n = self.max_lines if n is None else min(n, self.max_lines)
+        with self._lock:
+            state = self._update(path)
+            lines = list(state.lines) + (_decode([state.partial]) if state.partial else [])
+        return lines[-n:]
+
+    def _update(self, path):
+        # read what was appended to `path` since the last call
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            state = self._files.get(path)
+            if state is None or state.ino != st.st_ino or st.st_size < state.offset:
+                lines, partial = _split_lines(_read_tail(f, st.st_size, self.max_lines))
+                state = _FileState(st.st_ino, st.st_size, deque(_decode(lines), maxlen=self.max_lines), partial)
+                self._files[path] = state
+            elif st.st_size > state.offset:
+                f.seek(state.offset)
+                data = state.partial + f.read(st.st_size - state.offset)
+                lines, state.partial = _split_lines(data)
+                state.lines.extend(_decode(lines))
+                state.offset = st.st_size
+        return state
+
+    def forget(self, path):
+        with self._lock:
+            self._files.pop(path, None)
+
+
+class _LogHandler(BaseHTTPRequestHandler):
+    server_version = 'MANTA-logs'
+
+    def do_GET(self):
+        name = os.path.basename(unquote(self.path.split('?')[0]))
+        path = os.path.join(self.server.root, name)
+        if not name.endswith('.log') or not os.path.isfile(path):
+            self.send_error(404, 'unknown log file %s' % name)
+            return
+        # the log may still grow, send what it holds now
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(size))
+        self.send_header('Content-Disposition', 'attachment; filename="%s"' % name)
+        self.end_headers()
+        for chunk in iter_chunks(path, size=size):
+            self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_logs(root, host='127.0.0.1', port=0):
+    """Serve the log files directly inside `root` over HTTP in a background thread, streamed in chunks
+
+    GET /<file name>.log, without authentication: only bind `host` to an interface the readers of the
+    logs may reach. Port 0 picks a free port, read it from `httpd.server_address`. Stop with
+    `httpd.shutdown()`.
+    """
+    httpd = ThreadingHTTPServer((host, port), _LogHandler)
+    httpd.daemon_threads = True
+    httpd.root = root
+    threading.Thread(target=httpd.serve_forever, name='log-http', daemon=True).start()
+    return httpd
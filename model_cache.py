@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+
+# default memory budget of the process-wide model cache, in bytes
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def model_nbytes(net):
+    """Bytes held by the parameters and buffers of a model"""
+    nbytes = 0
+    for t in list(net.parameters()) + list(net.buffers()):
+        nbytes += t.numel() * t.element_size()
+    return nbytes
+
+
+def make_cache_key(ckpt, model_type, subnet_config=None):
+    """Build a cache key from the checkpoint file state, the model type and the active subnet
+
+    The file mtime and size are part of the key so that a checkpoint overwritten in place
+    (e.g. by a running training job) is reloaded instead of served stale.
+    """
+    if ckpt is None:
+        ckpt_key = (None, 0, 0)
+    else:
+        st = os.stat(ckpt)
+        ckpt_key = (os.path.abspath(ckpt), st.st_mtime_ns, st.st_size)
+    if subnet_config is None:
+        subnet_key = None
+    else:
+        subnet_key = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in subnet_config.items()))
+    return ckpt_key + (model_type, subnet_key)
+
+
+class ModelCache(object):
+    """Thread-safe LRU cache of ready-to-run (eval mode) models, bounded by a memory budget"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.cur_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._models = OrderedDict()  # key -> (net, nbytes), least recently used first
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock, so that a model is built only once under concurrent requests
+
+    def get(self, key, build_fn):
+        """Return the model cached under `key`, building it with `build_fn()` on a miss"""
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # another thread may have finished building the same model while we were waiting
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key][0]
+                self.misses += 1
+
+            try:
+                net = build_fn()
+                net.eval()
+                self._insert(key, net)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return net
+
+    def _insert(self, key, net):
+        nbytes = model_nbytes(net)
+        with self._lock:
+            if nbytes > self.max_bytes:
+                # never fits, serve it uncached
+                return
+            while self._models and self.cur_bytes + nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._models.popitem(last=False)
+                self.cur_bytes -= evicted_bytes
+                self.evictions += 1
+            self._models[key] = (net, nbytes)
+            self.cur_bytes += nbytes
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.cur_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'models': len(self._models),
+                'bytes': self.cur_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self._models)
+
+
+model_cache = ModelCache()
@@ -24,4 +24,10 @@ MPI_PREFIX = ['%s/bin/mpirun' % MPI_HOME, '--prefix', MPI_HOME, \
                  '-mca', 'btl_openib_allow_ib', '1', \
                  '-mca', 'btl_tcp_if_include', 'bond1']
 
+# GPU nodes for training jobs and their number of slots (GPUs, one MPI process each)
+GPU_NODES = {'host1': 2, 'host2': 2}
+
+# collectives of the training jobs: 'horovod' (mpirun), or 'gloo' / 'nccl' (torch.distributed, torchrun on one node)
+DIST_BACKEND = 'horovod'
+
 from .settings_dev import *
@@ -13,3 +13,8 @@ MPI_PREFIX = ['%s/bin/mpirun' % MPI_HOME, '--allow-run-as-root', '--prefix', MPI
                  '-mca', 'btl_openib_allow_ib', '0', \
                  '-mca', 'btl_tcp_if_include', 'eth0']
 
+# GPU nodes for training jobs and their number of slots (GPUs, one MPI process each)
+GPU_NODES = {'host1': 2, 'host2': 2}
+
+# collectives of the training jobs: 'horovod' (mpirun), or 'gloo' / 'nccl' (torch.distributed, torchrun on one node)
+DIST_BACKEND = 'horovod'
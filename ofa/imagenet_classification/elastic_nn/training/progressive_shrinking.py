@@ -8,13 +8,11 @@ import time
 import torch
 import torch.nn.functional as F
 from tqdm import tqdm
-import horovod.torch as hvd
 
 from ofa.utils import AverageMeter, cross_entropy_loss_with_soft_target
 from ofa.utils import DistributedMetric, list_mean, subset_mean, val2list, MyRandomResizedCrop
 from ofa.imagenet_classification.run_manager import DistributedRunManager
-
-import wandb
+from ofa.imagenet_classification.run_manager.metrics import MetricAccumulator, sync_step
 
 __all__ = [
     'validate', 'train_one_epoch', 'train', 'load_models',
@@ -92,7 +90,8 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
     nBatch = len(run_manager.run_config.train_loader)
 
     data_time = AverageMeter()
-    losses = DistributedMetric('train_loss') if distributed else AverageMeter()
+    losses = MetricAccumulator(['loss'], allreduce=run_manager.backend.allreduce if distributed else None,
+                               name='train_loss', device=run_manager.device)
     metric_dict = run_manager.get_metric_dict()
 
     with tqdm(total=nBatch,
@@ -114,7 +113,7 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
                     run_manager.optimizer, epoch - warmup_epochs, i, nBatch
                 )
 
-            images, labels = images.cuda(), labels.cuda()
+            images, labels = images.to(run_manager.device), labels.to(run_manager.device)
             target = labels
 
             # soft target
@@ -160,9 +159,12 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
 
             losses.update(list_mean(loss_of_subnets), images.size(0))
 
+            # the loss and metrics stay on the GPU between two syncs
+            sync = sync_step(i, nBatch, run_manager.run_config.print_frequency)
+            loss_vals = losses.values(sync)
             t.set_postfix({
-                'loss': losses.avg.item(),
-                **run_manager.get_metric_vals(metric_dict, return_dict=True),
+                'loss': loss_vals['loss'],
+                **run_manager.get_metric_vals(metric_dict, return_dict=True, sync=sync),
                 'R': images.size(2),
                 'lr': new_lr,
                 'loss_type': loss_type,
@@ -172,11 +174,13 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
             })
             t.update(1)
             end = time.time()
-            wdlog = {}
-            wdlog["train_loss_iters"] = losses.avg.item()
-            if hvd.rank() == 0:
-                wandb.log(wdlog)
-    return losses.avg.item(), run_manager.get_metric_vals(metric_dict)
+            if sync:
+                wdlog = {}
+                wdlog["train_loss_iters"] = loss_vals['loss']
+                if distributed:
+                    run_manager.log_metrics(wdlog)
+    # synced at the last step
+    return losses.avg, run_manager.get_metric_vals(metric_dict, sync=False)
 
 
 def train(run_manager, args, validate_func=None):
@@ -222,8 +226,12 @@ def train(run_manager, args, validate_func=None):
                     'state_dict': run_manager.network.state_dict(),
                 }, is_best=is_best, model_name = '%s_class' % run_manager.name)
 
-        if hvd.rank() == 0:
-            wandb.log(wdlog)
+        if distributed:
+            run_manager.log_metrics(wdlog)
+
+    if distributed:
+        # the metrics are written in the background
+        run_manager.flush_metrics()
 
 def load_models(run_manager, dynamic_net, model_path=None):
     # specify init path
@@ -5,3 +5,6 @@
 from .run_config import *
 from .run_manager import *
 from .distributed_run_manager import *
+from .metrics import *
+from .metrics_sink import *
+from .dist_backend import *
@@ -0,0 +1,265 @@
+import os
+
+import torch
+
+__all__ = ['DistributedBackend', 'HorovodBackend', 'TorchDistributedBackend', 'build_dist_backend',
+           'DIST_BACKEND_ENV']
+
+# backend of build_dist_backend('auto'): horovod, gloo or nccl
+DIST_BACKEND_ENV = 'MANTA_DIST_BACKEND'
+
+
+class DistributedBackend(object):
+    """Collectives used by the distributed run managers and progressive shrinking
+
+    allreduce averages across workers, as hvd.allreduce; the tensors of the collectives live on
+    `device`, where the run manager puts the network.
+    """
+    name = None
+
+    def init(self):
+        return self
+
+    def rank(self):
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+    def local_rank(self):
+        raise NotImplementedError
+
+    @property
+    def device(self):
+        if torch.cuda.is_available():
+            return torch.device('cuda', self.local_rank())
+        return torch.device('cpu')
+
+    def allreduce(self, tensor, name=None):
+        raise NotImplementedError
+
+    def broadcast(self, tensor, root_rank, name=None):
+        raise NotImplementedError
+
+    def broadcast_parameters(self, state_dict, root_rank):
+        raise NotImplementedError
+
+    def broadcast_optimizer_state(self, optimizer, root_rank):
+        raise NotImplementedError
+
+    def distributed_optimizer(self, optimizer, named_parameters, compression=None, backward_passes_per_step=1):
+        raise NotImplementedError
+
+    def DistributedMetric(self, name):
+        return DistributedMetric(name, self)
+
+
+class DistributedMetric(object):
+    """Average of a metric across workers, as ofa.utils.DistributedMetric with the collective of `backend`"""
+
+    def __init__(self, name, backend):
+        self.name = name
+        self.backend = backend
+        self.sum = torch.zeros(1)[0]
+        self.count = torch.zeros(1)[0]
+
+    def update(self, val, delta_n=1):
+        val = val.detach() * delta_n
+        self.sum += self.backend.allreduce(val.to(self.backend.device), name=self.name).cpu()
+        self.count += delta_n
+
+    @property
+    def avg(self):
+        return self.sum / self.count
+
+
+class HorovodBackend(DistributedBackend):
+    """horovod.torch, launched by mpirun (trainer.build_train_cmd)"""
+    name = 'horovod'
+
+    def __init__(self):
+        import horovod.torch as hvd
+        self.hvd = hvd
+
+    def init(self):
+        self.hvd.init()
+        if torch.cuda.is_available():
+            torch.cuda.set_device(self.hvd.local_rank())
+        return self
+
+    def rank(self):
+        return self.hvd.rank()
+
+    def size(self):
+        return self.hvd.size()
+
+    def local_rank(self):
+        return self.hvd.local_rank()
+
+    def allreduce(self, tensor, name=None):
+        return self.hvd.allreduce(tensor, name=name)
+
+    def broadcast(self, tensor, root_rank, name=None):
+        return self.hvd.broadcast(tensor, root_rank, name=name)
+
+    def broadcast_parameters(self, state_dict, root_rank):
+        self.hvd.broadcast_parameters(state_dict, root_rank)
+
+    def broadcast_optimizer_state(self, optimizer, root_rank):
+        self.hvd.broadcast_optimizer_state(optimizer, root_rank)
+
+    def distributed_optimizer(self, optimizer, named_parameters, compression=None, backward_passes_per_step=1):
+        if compression is None or isinstance(compression, str):
+            compression = self.hvd.Compression.fp16 if compression == 'fp16' else self.hvd.Compression.none
+        return self.hvd.DistributedOptimizer(optimizer, named_parameters=named_parameters, compression=compression,
+                                             backward_passes_per_step=backward_passes_per_step)
+
+
+def _to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.cpu()
+    if isinstance(obj, dict):
+        return {key: _to_cpu(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(val) for val in obj)
+    return obj
+
+
+def _is_fp16(compression):
+    # 'fp16', or hvd.Compression.fp16 passed by a Horovod launch script
+    return compression == 'fp16' or getattr(compression, '__name__', '') == 'FP16Compressor'
+
+
+class _DistributedOptimizer(object):
+    """Averages the gradients across workers before each step of `optimizer`, as hvd.DistributedOptimizer
+
+    The gradients are flattened into one buffer per dtype and device, reduced with one all_reduce each
+    (in fp16 with fp16 compression). backward_passes_per_step only matters for Horovod, which reduces
+    during backward: here the gradients accumulated by the backward passes are reduced once, at step.
+    """
+
+    def __init__(self, optimizer, named_parameters, backend, compression=None):
+        self.optimizer = optimizer
+        self.params = [p for _, p in named_parameters]
+        self.backend = backend
+        self.fp16 = _is_fp16(compression)
+
+    def __getattr__(self, name):
+        # param_groups, state, zero_grad, state_dict, load_state_dict, ... of the wrapped optimizer
+        return getattr(self.__dict__['optimizer'], name)
+
+    def synchronize(self):
+        import torch.distributed as dist
+        from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+        size = self.backend.size()
+        buckets = {}
+        for p in self.params:
+            if p.grad is not None:
+                buckets.setdefault((p.grad.dtype, p.grad.device), []).append(p.grad)
+        for grads in buckets.values():
+            flat = _flatten_dense_tensors(grads)
+            buf = flat.half() if self.fp16 and flat.is_floating_point() else flat
+            dist.all_reduce(buf)
+            if buf is not flat:
+                flat.copy_(buf)
+            flat.div_(size)
+            for grad, reduced in zip(grads, _unflatten_dense_tensors(flat, grads)):
+                grad.copy_(reduced)
+
+    def step(self, closure=None):
+        self.synchronize()
+        return self.optimizer.step(closure)
+
+
+class TorchDistributedBackend(DistributedBackend):
+    """torch.distributed with Gloo (CPU, or GPU tensors copied) or NCCL (GPU), e.g. launched by torchrun
+
+    The process group is initialized from the environment (MASTER_ADDR, MASTER_PORT, RANK, WORLD_SIZE,
+    LOCAL_RANK, set by torchrun) unless it already is.
+    """
+
+    def __init__(self, backend='gloo'):
+        self.name = backend
+
+    def init(self):
+        import torch.distributed as dist
+        if not dist.is_initialized():
+            dist.init_process_group(self.name, init_method='env://')
+        if self.name == 'nccl':
+            torch.cuda.set_device(self.local_rank())
+        return self
+
+    def rank(self):
+        import torch.distributed as dist
+        return dist.get_rank()
+
+    def size(self):
+        import torch.distributed as dist
+        return dist.get_world_size()
+
+    def local_rank(self):
+        return int(os.environ.get('LOCAL_RANK', 0))
+
+    @property
+    def device(self):
+        if self.name == 'nccl':
+            return torch.device('cuda', self.local_rank())
+        return torch.device('cpu')
+
+    def allreduce(self, tensor, name=None):
+        import torch.distributed as dist
+        out = tensor.detach().to(self.device, copy=True)
+        dist.all_reduce(out)
+        if out.is_floating_point():
+            out.div_(self.size())
+        else:
+            out = torch.div(out, self.size(), rounding_mode='floor')
+        return out.to(tensor.device)
+
+    def broadcast(self, tensor, root_rank, name=None):
+        import torch.distributed as dist
+        out = tensor.detach().to(self.device, copy=True)
+        dist.broadcast(out, root_rank)
+        return out.to(tensor.device)
+
+    def broadcast_parameters(self, state_dict, root_rank):
+        import torch.distributed as dist
+        for tensor in state_dict.values():
+            if tensor.device == self.device:
+                dist.broadcast(tensor, root_rank)
+            else:
+                tensor.copy_(self.broadcast(tensor, root_rank))
+
+    def broadcast_optimizer_state(self, optimizer, root_rank):
+        import torch.distributed as dist
+        state = [_to_cpu(optimizer.state_dict()) if self.rank() == root_rank else None]
+        dist.broadcast_object_list(state, src=root_rank)
+        if self.rank() != root_rank:
+            optimizer.load_state_dict(state[0])
+
+    def distributed_optimizer(self, optimizer, named_parameters, compression=None, backward_passes_per_step=1):
+        return _DistributedOptimizer(optimizer, named_parameters, self, compression)
+
+
+def build_dist_backend(backend='auto'):
+    """An initialized DistributedBackend
+
+    Args:
+        backend: 'horovod', 'gloo', 'nccl', a DistributedBackend, or 'auto': $MANTA_DIST_BACKEND if set,
+            otherwise torch.distributed under torchrun (NCCL with GPUs, Gloo without) and Horovod under mpirun
+    """
+    if isinstance(backend, DistributedBackend):
+        return backend.init()
+    if backend is None or backend == 'auto':
+        backend = os.environ.get(DIST_BACKEND_ENV)
+    if backend is None:
+        if 'TORCHELASTIC_RUN_ID' in os.environ or ('RANK' in os.environ and 'MASTER_ADDR' in os.environ):
+            backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+        else:
+            backend = 'horovod'
+    if backend == 'horovod':
+        return HorovodBackend().init()
+    if backend in ('gloo', 'nccl'):
+        return TorchDistributedBackend(backend).init()
+    raise ValueError('unknown distributed backend %s' % backend)
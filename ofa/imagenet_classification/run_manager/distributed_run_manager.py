@@ -11,25 +11,31 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
 from tqdm import tqdm
-import horovod.torch as hvd
-import wandb
 
 from ofa.utils import cross_entropy_with_label_smoothing, cross_entropy_loss_with_soft_target, write_log, init_models
 from ofa.utils import DistributedMetric, list_mean, get_net_info, accuracy, AverageMeter, mix_labels, mix_images
 from ofa.utils import MyRandomResizedCrop
+from .metrics import MetricAccumulator, sync_step
+from .metrics_sink import build_metrics_sink
+from .dist_backend import build_dist_backend
 
 __all__ = ['DistributedRunManager']
 
 
 class DistributedRunManager:
 
-    def __init__(self, path, net, run_config, hvd_compression, name, backward_steps=1, is_root=False, init=True):
-        import horovod.torch as hvd
+    def __init__(self, path, net, run_config, hvd_compression, name, backward_steps=1, is_root=False, init=True,
+                 metrics_backends='wandb', dist_backend='auto'):
 
         self.path = path
         self.net = net
         self.run_config = run_config
         self.is_root = is_root
+        # see build_metrics_sink, e.g. 'wandb', 'jsonl,csv' or 'none'
+        self.metrics_backends = metrics_backends
+        # collectives of Horovod or torch.distributed, see build_dist_backend
+        self.backend = build_dist_backend(dist_backend)
+        self.device = self.backend.device
 
         self.best_acc = 0.0
         self.start_epoch = 0
@@ -37,8 +43,9 @@ class DistributedRunManager:
 
         os.makedirs(self.path, exist_ok=True)
 
-        self.net.cuda()
-        cudnn.benchmark = True
+        self.net.to(self.device)
+        if self.device.type == 'cuda':
+            cudnn.benchmark = True
         if init and self.is_root:
             init_models(self.net, self.run_config.model_init)
         if self.is_root:
@@ -81,7 +88,7 @@ class DistributedRunManager:
                     if param.requires_grad:
                         net_params.append(param)
         self.optimizer = self.run_config.build_optimizer(net_params)
-        self.optimizer = hvd.DistributedOptimizer(
+        self.optimizer = self.backend.distributed_optimizer(
             self.optimizer, named_parameters=self.net.named_parameters(), compression=hvd_compression,
             backward_passes_per_step=backward_steps,
         )
@@ -112,6 +119,23 @@ class DistributedRunManager:
     def network(self, new_val):
         self.net = new_val
 
+    @property
+    def metrics_sink(self):
+        if self.__dict__.get('_metrics_sink', None) is None:
+            # only the root worker logs metrics, as write_log
+            spec = self.metrics_backends if self.is_root else 'none'
+            self.__dict__['_metrics_sink'] = build_metrics_sink(spec, log_dir=self.logs_path)
+        return self.__dict__['_metrics_sink']
+
+    def log_metrics(self, metrics, step=None):
+        # queued for the metrics sink thread, does not wait for the backends
+        if self.is_root:
+            self.metrics_sink.log(metrics, step=step)
+
+    def flush_metrics(self):
+        if self.__dict__.get('_metrics_sink', None) is not None:
+            self.metrics_sink.flush()
+
     def write_log(self, log_str, prefix='valid', should_print=True, mode='a'):
         if self.is_root:
             write_log(self.logs_path, log_str, prefix, should_print, mode)
@@ -189,32 +213,25 @@ class DistributedRunManager:
 
     # noinspection PyArgumentList
     def broadcast(self):
-        import horovod.torch as hvd
-        self.start_epoch = hvd.broadcast(torch.LongTensor(1).fill_(self.start_epoch)[0], 0, name='start_epoch').item()
-        self.best_acc = hvd.broadcast(torch.Tensor(1).fill_(self.best_acc)[0], 0, name='best_acc').item()
-        hvd.broadcast_parameters(self.net.state_dict(), 0)
-        hvd.broadcast_optimizer_state(self.optimizer, 0)
+        self.start_epoch = self.backend.broadcast(
+            torch.LongTensor(1).fill_(self.start_epoch)[0], 0, name='start_epoch').item()
+        self.best_acc = self.backend.broadcast(torch.Tensor(1).fill_(self.best_acc)[0], 0, name='best_acc').item()
+        self.backend.broadcast_parameters(self.net.state_dict(), 0)
+        self.backend.broadcast_optimizer_state(self.optimizer, 0)
 
     """ metric related """
 
     def get_metric_dict(self):
-        return {
-            'top1': DistributedMetric('top1'),
-            'top5': DistributedMetric('top5'),
-        }
+        return MetricAccumulator(['top1', 'top5'], allreduce=self.backend.allreduce, name='accuracy',
+                                 device=self.device)
 
     def update_metric(self, metric_dict, output, labels):
-        acc1, acc5 = accuracy(output, labels, topk=(1, 5))
-        metric_dict['top1'].update(acc1[0], output.size(0))
-        metric_dict['top5'].update(acc5[0], output.size(0))
-
-    def get_metric_vals(self, metric_dict, return_dict=False):
-        if return_dict:
-            return {
-                key: metric_dict[key].avg.item() for key in metric_dict
-            }
-        else:
-            return [metric_dict[key].avg.item() for key in metric_dict]
+        acc1, acc5 = accuracy(output.detach(), labels, topk=(1, 5))
+        metric_dict.update(torch.cat([acc1, acc5]), output.size(0))
+
+    def get_metric_vals(self, metric_dict, return_dict=False, sync=True):
+        # sync=False returns the values of the last sync, without reducing the sums
+        return metric_dict.values(sync=sync, return_dict=return_dict)
 
     def get_metric_names(self):
         return 'top1', 'top5'
@@ -232,34 +249,40 @@ class DistributedRunManager:
 
         net.eval()
 
-        losses = DistributedMetric('val_loss')
+        losses = MetricAccumulator(['loss'], allreduce=self.backend.allreduce, name='val_loss',
+                                   device=self.device)
         metric_dict = self.get_metric_dict()
+        n_batch = len(data_loader)
 
         with torch.no_grad():
-            with tqdm(total=len(data_loader),
+            with tqdm(total=n_batch,
                       desc='Validate Epoch #{} {}'.format(epoch + 1, run_str),
                       disable=no_logs or not self.is_root) as t:
                 for i, (images, labels) in enumerate(data_loader):
 
 
-                    images, labels = images.cuda(), labels.cuda()
+                    images, labels = images.to(self.device), labels.to(self.device)
                     # compute output
                     output = net(images)
                     loss = self.test_criterion(output, labels)
                     # measure accuracy and record loss
                     losses.update(loss, images.size(0))
                     self.update_metric(metric_dict, output, labels)
+                    # the loss and metrics stay on the device between two syncs
+                    sync = sync_step(i, n_batch, self.run_config.print_frequency)
+                    loss_vals = losses.values(sync)
                     t.set_postfix({
-                        'loss': losses.avg.item(),
-                        **self.get_metric_vals(metric_dict, return_dict=True),
+                        'loss': loss_vals['loss'],
+                        **self.get_metric_vals(metric_dict, return_dict=True, sync=sync),
                         'img_size': images.size(2),
                     })
                     t.update(1)
-                    wdlog = {}
-                    wdlog["valid_loss_iters"] = losses.avg.item()
-                    if hvd.rank() == 0:
-                        wandb.log(wdlog)
-        return losses.avg.item(), self.get_metric_vals(metric_dict)
+                    if sync:
+                        wdlog = {}
+                        wdlog["valid_loss_iters"] = loss_vals['loss']
+                        self.log_metrics(wdlog)
+        # synced at the last step
+        return losses.avg, self.get_metric_vals(metric_dict, sync=False)
 
     def validate_all_resolution(self, epoch=0, is_test=False, net=None):
         if net is None:
@@ -286,7 +309,8 @@ class DistributedRunManager:
 
         nBatch = len(self.run_config.train_loader)
 
-        losses = DistributedMetric('train_loss')
+        losses = MetricAccumulator(['loss'], allreduce=self.backend.allreduce, name='train_loss',
+                                   device=self.device)
         metric_dict = self.get_metric_dict()
         data_time = AverageMeter()
 
@@ -304,7 +328,7 @@ class DistributedRunManager:
                 else:
                     new_lr = self.run_config.adjust_learning_rate(self.optimizer, epoch - warmup_epochs, i, nBatch)
 
-                images, labels = images.cuda(), labels.cuda()
+                images, labels = images.to(self.device), labels.to(self.device)
                 target = labels
                 if isinstance(self.run_config.mixup_alpha, float):
                     # transform data
@@ -345,9 +369,12 @@ class DistributedRunManager:
                 losses.update(loss, images.size(0))
                 self.update_metric(metric_dict, output, target)
 
+                # the loss and metrics stay on the device between two syncs
+                sync = sync_step(i, nBatch, self.run_config.print_frequency)
+                loss_vals = losses.values(sync)
                 t.set_postfix({
-                    'loss': losses.avg.item(),
-                    **self.get_metric_vals(metric_dict, return_dict=True),
+                    'loss': loss_vals['loss'],
+                    **self.get_metric_vals(metric_dict, return_dict=True, sync=sync),
                     'img_size': images.size(2),
                     'lr': new_lr,
                     'loss_type': loss_type,
@@ -356,7 +383,8 @@ class DistributedRunManager:
                 t.update(1)
                 end = time.time()
 
-        return losses.avg.item(), self.get_metric_vals(metric_dict)
+        # synced at the last step
+        return losses.avg, self.get_metric_vals(metric_dict, sync=False)
 
     def train(self, args, warmup_epochs=5, warmup_lr=0):
         for epoch in range(self.start_epoch, self.run_config.n_epochs + warmup_epochs):
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+import torch
+
+__all__ = ['MetricAccumulator', 'sync_step']
+
+
+class MetricAccumulator(object):
+    """Weighted running averages of several metrics, accumulated on the device of the values
+
+    `update` only queues device operations, nothing is read back. `values(sync=True)` reduces the sums
+    across workers with `allreduce` (one collective for all the metrics) and reads them back in one
+    transfer; `values(sync=False)` returns the averages of the last sync, e.g. for progress bars between
+    two syncs. With `allreduce`, every worker has to sync at the same steps.
+
+    Args:
+        names: metric names, in the order of the values passed to `update`
+        allreduce: optional callable averaging a tensor across workers, called as allreduce(tensor, name=name),
+            e.g. hvd.allreduce or DistributedBackend.allreduce
+        name: name of the collective
+        device: device of the sums of a worker that syncs before any update, where `allreduce` expects them
+    """
+
+    def __init__(self, names, allreduce=None, name='metrics', device=None):
+        self.names = list(names)
+        self.allreduce = allreduce
+        self.name = name
+        self.device = device
+        # weighted sums of the metrics followed by the total weight
+        self.sum = None
+        self._dirty = False
+        self._avg = OrderedDict((key, 0.) for key in self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def update(self, vals, n=1):
+        """Add `vals` ([len(names)] tensor, or a number for a single metric) with weight `n`"""
+        if torch.is_tensor(vals):
+            vals = vals.detach().reshape(-1)
+        else:
+            vals = torch.as_tensor(vals, dtype=torch.float64,
+                                   device=None if self.sum is None else self.sum.device).reshape(-1)
+        if self.sum is None:
+            self.sum = torch.zeros(len(self.names) + 1, dtype=torch.float64, device=vals.device)
+        self.sum[:-1].add_(vals.to(self.sum.device, self.sum.dtype), alpha=n)
+        self.sum[-1].add_(n)
+        self._dirty = True
+
+    def values(self, sync=True, return_dict=True):
+        if sync and (self._dirty or self.allreduce is not None):
+            total = self.sum if self.sum is not None else \
+                torch.zeros(len(self.names) + 1, dtype=torch.float64, device=self.device)
+            if self.allreduce is not None:
+                total = self.allreduce(total, name=self.name)
+            total = total.tolist()
+            if total[-1] > 0:
+                self._avg = OrderedDict((key, val / total[-1]) for key, val in zip(self.names, total[:-1]))
+            self._dirty = False
+        if return_dict:
+            return dict(self._avg)
+        return list(self._avg.values())
+
+    @property
+    def avg(self):
+        """Average of a single metric (e.g. the loss) at the last sync, reads nothing back"""
+        return self._avg[self.names[0]]
+
+
+def sync_step(i, n_batch, frequency):
+    """Whether step `i` of `n_batch` syncs the metrics: every `frequency` steps and at the last one"""
+    return (i + 1) % max(frequency, 1) == 0 or i + 1 == n_batch
@@ -0,0 +1,235 @@
+import atexit
+import collections
+import csv
+import json
+import os
+import threading
+import time
+import warnings
+
+__all__ = ['MetricsSink', 'NullBackend', 'JSONLBackend', 'CSVBackend', 'WandbBackend', 'build_metrics_sink']
+
+
+class NullBackend(object):
+    """Drops every record"""
+
+    def write(self, records):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _to_float(val):
+    if hasattr(val, 'item'):
+        # tensors and numpy scalars
+        return val.item()
+    return val
+
+
+class JSONLBackend(NullBackend):
+    """Appends one JSON object per record to `path`: {"time": ..., "step": ..., <metric>: <value>, ...}"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def write(self, records):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, 'a')
+        for timestamp, step, metrics in records:
+            row = {'time': timestamp, 'step': step}
+            row.update((key, _to_float(val)) for key, val in metrics.items())
+            self._file.write(json.dumps(row) + '\n')
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CSVBackend(JSONLBackend):
+    """Appends one `time,step,key,value` row per metric to `path`
+
+    The long format keeps the columns fixed while the logged metrics change, e.g. the per-epoch
+    validation metrics next to the per-iteration loss.
+    """
+
+    def write(self, records):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, 'a', newline='')
+            self._writer = csv.writer(self._file)
+            if new_file:
+                self._writer.writerow(['time', 'step', 'key', 'value'])
+        for timestamp, step, metrics in records:
+            for key, val in metrics.items():
+                self._writer.writerow([timestamp, '' if step is None else step, key, _to_float(val)])
+
+
+class WandbBackend(NullBackend):
+    """Logs the records with wandb.log, wandb is imported by the flusher thread on the first write
+
+    Args:
+        init_kwargs: arguments of wandb.init, if no run is active yet; None to log to the active run
+    """
+
+    def __init__(self, **init_kwargs):
+        self.init_kwargs = init_kwargs
+        self._wandb = None
+
+    def write(self, records):
+        if self._wandb is None:
+            import wandb
+            if wandb.run is None and self.init_kwargs:
+                wandb.init(**self.init_kwargs)
+            self._wandb = wandb
+        for _, step, metrics in records:
+            metrics = {key: _to_float(val) for key, val in metrics.items()}
+            if step is None:
+                self._wandb.log(metrics)
+            else:
+                self._wandb.log(metrics, step=step)
+
+
+class MetricsSink(object):
+    """Non-blocking metrics logging: `log` appends to a ring buffer, a background thread writes the backends
+
+    The flusher thread writes up to `batch_size` records per backend call, as soon as a batch is full or
+    `flush_interval` seconds after the first pending record. When `capacity` records are pending, `log`
+    drops a record instead of waiting: the oldest pending one with `overflow='drop_oldest'`, the new one
+    with `overflow='drop_newest'`; `dropped` counts them. Errors of a backend are reported once with a
+    warning and the backend is disabled, they never reach the training loop.
+
+    Args:
+        backends: objects with write(records), flush() and close(); a record is (time, step, metrics)
+    """
+
+    def __init__(self, backends, capacity=10000, batch_size=100, flush_interval=1., overflow='drop_oldest'):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError('do not support overflow policy: %s' % overflow)
+        self.backends = list(backends)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+
+        self._buffer = collections.deque()
+        self._cond = threading.Condition()
+        # number of records logged, and written (or dropped) by the flusher thread
+        self._logged = 0
+        self._done = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='metrics-sink', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, metrics, step=None):
+        """Queue a dict of metrics, never blocks on the backends"""
+        record = (time.time(), step, dict(metrics))
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+                if self.overflow == 'drop_newest':
+                    return
+                self._buffer.popleft()
+                self._done += 1
+            self._buffer.append(record)
+            self._logged += 1
+            # wake the flusher thread for the first record (to start the flush_interval) and for full batches
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self, timeout=None):
+        """Wait until the records logged so far are written and the backends flushed
+
+        Returns:
+            False if `timeout` (seconds) expired first
+        """
+        with self._cond:
+            target = self._logged
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._done >= target and not self._flush_requested or
+                                       not self._thread.is_alive(), timeout)
+
+    def close(self, timeout=None):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed and not self._flush_requested:
+                    self._cond.wait()
+                # give the batch some time to fill up
+                self._cond.wait_for(lambda: len(self._buffer) >= self.batch_size or self._closed or
+                                    self._flush_requested, self.flush_interval)
+                n = min(len(self._buffer), self.batch_size)
+                records = [self._buffer.popleft() for _ in range(n)]
+                flush = self._flush_requested and len(self._buffer) == 0
+                closed = self._closed and len(self._buffer) == 0
+
+            if records:
+                self._call('write', records)
+            if flush or closed:
+                self._call('flush')
+            if closed:
+                self._call('close')
+
+            with self._cond:
+                self._done += len(records)
+                if flush:
+                    self._flush_requested = False
+                self._cond.notify_all()
+            if closed:
+                return
+
+    def _call(self, method, *args):
+        for i, backend in enumerate(self.backends):
+            if type(backend) is NullBackend:
+                continue
+            try:
+                getattr(backend, method)(*args)
+            except Exception as e:
+                warnings.warn('metrics backend %s failed, disabled: %r' % (type(backend).__name__, e))
+                self.backends[i] = NullBackend()
+
+
+def build_metrics_sink(spec, log_dir='.', **kwargs):
+    """Build a MetricsSink from a comma separated list of backends
+
+    `wandb`, `jsonl[:path]`, `csv[:path]` or `none`; the files default to metrics.jsonl / metrics.csv in
+    `log_dir`. Further arguments are passed to MetricsSink.
+    """
+    backends = []
+    for item in (spec or 'none').split(','):
+        name, _, path = item.strip().partition(':')
+        if name == 'wandb':
+            backends.append(WandbBackend())
+        elif name == 'jsonl':
+            backends.append(JSONLBackend(path or os.path.join(log_dir, 'metrics.jsonl')))
+        elif name == 'csv':
+            backends.append(CSVBackend(path or os.path.join(log_dir, 'metrics.csv')))
+        elif name in ('none', ''):
+            backends.append(NullBackend())
+        else:
+            raise ValueError('do not support metrics backend: %s' % name)
+    return MetricsSink(backends, **kwargs)
@@ -17,6 +17,7 @@ from tqdm import tqdm
 from ofa.utils import get_net_info, cross_entropy_loss_with_soft_target, cross_entropy_with_label_smoothing
 from ofa.utils import AverageMeter, accuracy, write_log, mix_images, mix_labels, init_models
 from ofa.utils import MyRandomResizedCrop
+from .metrics import MetricAccumulator, sync_step
 
 __all__ = ['RunManager']
 
@@ -187,23 +188,15 @@ class RunManager:
     """ metric related """
 
     def get_metric_dict(self):
-        return {
-            'top1': AverageMeter(),
-            'top5': AverageMeter(),
-        }
+        return MetricAccumulator(['top1', 'top5'])
 
     def update_metric(self, metric_dict, output, labels):
-        acc1, acc5 = accuracy(output, labels, topk=(1, 5))
-        metric_dict['top1'].update(acc1[0].item(), output.size(0))
-        metric_dict['top5'].update(acc5[0].item(), output.size(0))
-
-    def get_metric_vals(self, metric_dict, return_dict=False):
-        if return_dict:
-            return {
-                key: metric_dict[key].avg for key in metric_dict
-            }
-        else:
-            return [metric_dict[key].avg for key in metric_dict]
+        acc1, acc5 = accuracy(output.detach(), labels, topk=(1, 5))
+        metric_dict.update(torch.cat([acc1, acc5]), output.size(0))
+
+    def get_metric_vals(self, metric_dict, return_dict=False, sync=True):
+        # sync=False returns the values of the last sync, without reading back the sums
+        return metric_dict.values(sync=sync, return_dict=return_dict)
 
     def get_metric_names(self):
         return 'top1', 'top5'
@@ -224,11 +217,12 @@ class RunManager:
         else:
             net.eval()
 
-        losses = AverageMeter()
+        losses = MetricAccumulator(['loss'])
         metric_dict = self.get_metric_dict()
+        n_batch = len(data_loader)
 
         with torch.no_grad():
-            with tqdm(total=len(data_loader),
+            with tqdm(total=n_batch,
                       desc='Validate Epoch #{} {}'.format(epoch + 1, run_str), disable=no_logs) as t:
                 for i, (images, labels) in enumerate(data_loader):
                     images, labels = images.to(self.device), labels.to(self.device)
@@ -238,10 +232,12 @@ class RunManager:
                     # measure accuracy and record loss
                     self.update_metric(metric_dict, output, labels)
 
-                    losses.update(loss.item(), images.size(0))
+                    losses.update(loss, images.size(0))
+                    # the loss and metrics stay on the device between two syncs
+                    sync = sync_step(i, n_batch, self.run_config.print_frequency)
                     t.set_postfix({
-                        'loss': losses.avg,
-                        **self.get_metric_vals(metric_dict, return_dict=True),
+                        'loss': losses.values(sync)['loss'],
+                        **self.get_metric_vals(metric_dict, return_dict=True, sync=sync),
                         'img_size': images.size(2),
                     })
                     t.update(1)
@@ -272,7 +268,7 @@ class RunManager:
 
         nBatch = len(self.run_config.train_loader)
 
-        losses = AverageMeter()
+        losses = MetricAccumulator(['loss'])
         metric_dict = self.get_metric_dict()
         data_time = AverageMeter()
 
@@ -326,12 +322,14 @@ class RunManager:
                 self.optimizer.step()
 
                 # measure accuracy and record loss
-                losses.update(loss.item(), images.size(0))
+                losses.update(loss, images.size(0))
                 self.update_metric(metric_dict, output, target)
 
+                # the loss and metrics stay on the device between two syncs
+                sync = sync_step(i, nBatch, self.run_config.print_frequency)
                 t.set_postfix({
-                    'loss': losses.avg,
-                    **self.get_metric_vals(metric_dict, return_dict=True),
+                    'loss': losses.values(sync)['loss'],
+                    **self.get_metric_vals(metric_dict, return_dict=True, sync=sync),
                     'img_size': images.size(2),
                     'lr': new_lr,
                     'loss_type': loss_type,
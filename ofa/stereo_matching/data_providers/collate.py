@@ -0,0 +1,124 @@
+import sys
+
+import torch
+from torch.utils.data import get_worker_info
+from torch.utils.data.dataloader import default_collate
+
+__all__ = ['PadCollate', 'crop_padded']
+
+IMAGE_KEYS = ['left', 'right']
+DISP_KEYS = ['disp', 'pseudo_disp']
+
+
+class PadCollate(object):
+    """Collate stereo samples of different sizes, padding each one on the top and left while it is copied into
+    the batch
+
+    Replaces the per-sample `np.pad` of KITTI datasets created with `pad=False`: every image and disparity
+    is written once, into the bottom-right corner of a batch tensor, and only the padding border is
+    filled. `ori_size` [B, 2] holds the (height, width) of each sample, see `crop_padded`.
+
+    In DataLoader workers the batch tensors are allocated in shared memory, as by `default_collate`. In
+    the main process (num_workers=0) the batch tensors of `reuse` are kept and refilled by a later call
+    once neither they nor a view of them (e.g. `batch['left'][0]`) is referenced.
+
+    Args:
+        height, width: minimum batch size, e.g. 384, 1296 for KITTI; None to pad to the largest sample
+        image_fill: value of the padded image pixels, a scalar or one value per channel; the padding of
+            StereoDataset is applied before normalization, i.e. -mean / std of normalized images
+        reuse: reuse the batch tensors in the main process
+    """
+
+    def __init__(self, height=None, width=None, image_fill=0., reuse=True):
+        self.height = height
+        self.width = width
+        self.image_fill = image_fill
+        self.reuse = reuse
+        self._buffers = {}
+
+    def __getstate__(self):
+        # do not pickle the buffers into DataLoader workers
+        state = self.__dict__.copy()
+        state['_buffers'] = {}
+        return state
+
+    def buffer(self, key, shape, like):
+        if get_worker_info() is not None:
+            numel = 1
+            for n in shape:
+                numel *= n
+            storage = like._typed_storage()._new_shared(numel, device=like.device)
+            return like.new(storage).resize_(shape)
+        if not self.reuse:
+            return like.new_empty(shape)
+        # a loop still holds the previous batch while the next one is collated, so keep two per key
+        pool = self._buffers.setdefault(key, [])
+        for buf in pool:
+            # free if only referenced by the pool, buf and the argument of getrefcount, and no view of it
+            # is alive: views hold the storage, not the tensor
+            if buf.shape == shape and buf.dtype == like.dtype and sys.getrefcount(buf) <= 3 and \
+                    _storage_users(buf) <= 1:
+                return buf
+        buf = like.new_empty(shape)
+        pool.append(buf)
+        if len(pool) > 2:
+            pool.pop(0)
+        return buf
+
+    def pad_stack(self, key, values, height, width, fill):
+        batch = self.buffer(key, (len(values),) + tuple(values[0].shape[:-2]) + (height, width), values[0])
+        if torch.is_tensor(fill):
+            fill = fill.to(batch.dtype).view(-1, 1, 1)
+        for out, value in zip(batch, values):
+            h, w = value.shape[-2:]
+            top, left = height - h, width - w
+            if top > 0:
+                _fill(out[..., :top, :], fill)
+            if left > 0:
+                _fill(out[..., top:, :left], fill)
+            out[..., top:, left:].copy_(value)
+        return batch
+
+    def __call__(self, samples):
+        samples = [{key: torch.from_numpy(value) if key in IMAGE_KEYS + DISP_KEYS and not torch.is_tensor(value)
+                    else value for key, value in sample.items()} for sample in samples]
+        sizes = [tuple(sample['left'].shape[-2:]) for sample in samples]
+        height = max([h for h, _ in sizes] + [self.height or 0])
+        width = max([w for _, w in sizes] + [self.width or 0])
+        image_fill = self.image_fill
+        if isinstance(image_fill, (list, tuple)):
+            image_fill = torch.tensor(image_fill)
+
+        batch = {}
+        for key in samples[0].keys():
+            values = [sample[key] for sample in samples]
+            if key in IMAGE_KEYS:
+                batch[key] = self.pad_stack(key, values, height, width, image_fill)
+            elif key in DISP_KEYS:
+                batch[key] = self.pad_stack(key, values, height, width, 0)
+            else:
+                batch[key] = default_collate(values)
+        batch['ori_size'] = torch.tensor(sizes, dtype=torch.long)
+        return batch
+
+
+def _storage_users(tensor):
+    # tensors sharing the storage of `tensor` (itself and its views), minus the storage object of the call
+    return torch._C._storage_Use_Count(tensor.untyped_storage()._cdata) - 1
+
+
+def _fill(region, fill):
+    if torch.is_tensor(fill):
+        region.copy_(fill.expand_as(region))
+    else:
+        region.fill_(fill)
+
+
+def crop_padded(batch, ori_size):
+    """Crop a padded [B, ..., H, W] batch (e.g. predicted disparities) back to the sizes of `PadCollate`
+
+    Returns:
+        list of [..., h, w] views, one per sample
+    """
+    height, width = batch.shape[-2:]
+    return [x[..., height - int(h):, width - int(w):] for x, (h, w) in zip(batch, ori_size.tolist())]
@@ -8,6 +8,19 @@ import numpy as np
 
 from ofa.utils import utils
 from ofa.utils.file_io import read_img, read_disp
+from ofa.stereo_matching.data_providers.pfm import read_pfm_disp
+from ofa.stereo_matching.data_providers.sample_index import StereoSampleIndex
+
+
+# KITTI images are padded on the top and left to this (height, width)
+KITTI_PAD_SIZE = (384, 1296)
+
+
+def load_disp(filename, subset=False):
+    # PFM disparities are memory-mapped, PNG ones (KITTI) decoded by read_disp
+    if filename.endswith('pfm'):
+        return read_pfm_disp(filename, subset=subset)
+    return read_disp(filename, subset=subset)
 
 
 class StereoDataset(Dataset):
@@ -16,7 +29,8 @@ class StereoDataset(Dataset):
                  mode='train',
                  save_filename=False,
                  load_pseudo_gt=False,
-                 transform=None):
+                 transform=None,
+                 pad=True):
         super(StereoDataset, self).__init__()
 
         self.data_dir = data_dir
@@ -24,6 +38,8 @@ class StereoDataset(Dataset):
         self.mode = mode
         self.save_filename = save_filename
         self.transform = transform
+        # pad KITTI samples here, else leave it to PadCollate and RandomCrop(pad_to=KITTI_PAD_SIZE)
+        self.pad = pad
 
         sceneflow_finalpass_dict = {
             'train': 'filenames/SceneFlow_finalpass_train.txt',
@@ -68,7 +84,9 @@ class StereoDataset(Dataset):
         assert dataset_name in dataset_name_dict.keys()
         self.dataset_name = dataset_name
 
-        self.samples = []
+        # paths relative to data_dir, one list per key; packed below so that forked DataLoader workers
+        # do not copy them (see StereoSampleIndex)
+        samples = {'left': [], 'right': [], 'disp': [], 'pseudo_disp': []}
 
         data_filenames = dataset_name_dict[dataset_name][mode]
 
@@ -80,30 +98,23 @@ class StereoDataset(Dataset):
             left_img, right_img = splits[:2]
             gt_disp = None if len(splits) == 2 else splits[2]
 
-            sample = dict()
-
-            if self.save_filename:
-                sample['left_name'] = left_img.split('/', 1)[1]
-
-            sample['left'] = os.path.join(data_dir, left_img)
-            sample['right'] = os.path.join(data_dir, right_img)
-            sample['disp'] = os.path.join(data_dir, gt_disp) if gt_disp is not None else None
+            samples['left'].append(left_img)
+            samples['right'].append(right_img)
+            samples['disp'].append(gt_disp)
 
-            if load_pseudo_gt and sample['disp'] is not None:
+            if load_pseudo_gt and gt_disp is not None:
                 # KITTI 2015
-                if 'disp_occ_0' in sample['disp']:
-                    sample['pseudo_disp'] = (sample['disp']).replace('disp_occ_0',
-                                                                     'disp_occ_0_pseudo_gt')
+                if 'disp_occ_0' in gt_disp:
+                    samples['pseudo_disp'].append(gt_disp.replace('disp_occ_0', 'disp_occ_0_pseudo_gt'))
                 # KITTI 2012
-                elif 'disp_occ' in sample['disp']:
-                    sample['pseudo_disp'] = (sample['disp']).replace('disp_occ',
-                                                                     'disp_occ_pseudo_gt')
+                elif 'disp_occ' in gt_disp:
+                    samples['pseudo_disp'].append(gt_disp.replace('disp_occ', 'disp_occ_pseudo_gt'))
                 else:
                     raise NotImplementedError
             else:
-                sample['pseudo_disp'] = None
+                samples['pseudo_disp'].append(None)
 
-            self.samples.append(sample)
+        self.samples = StereoSampleIndex(data_dir, samples, save_filename=self.save_filename)
 
     def __getitem__(self, index):
         sample = {}
@@ -118,19 +129,19 @@ class StereoDataset(Dataset):
         # GT disparity of subset if negative, finalpass and cleanpass is positive
         subset = True if 'subset' in self.dataset_name else False
         if sample_path['disp'] is not None:
-            sample['disp'] = read_disp(sample_path['disp'], subset=subset)  # [H, W]
+            sample['disp'] = load_disp(sample_path['disp'], subset=subset)  # [H, W]
 
         if sample_path['pseudo_disp'] is not None:
-            sample['pseudo_disp'] = read_disp(sample_path['pseudo_disp'], subset=subset)  # [H, W]
+            sample['pseudo_disp'] = load_disp(sample_path['pseudo_disp'], subset=subset)  # [H, W]
 
         # padding for KITTI
         h, w, _ = sample['left'].shape
-        top_pad = 384-h
-        left_pad = 1296-w
-        if self.dataset_name in ['KITTI2012', 'KITTI2015', 'KITTI']:
-            sample['left'] = np.lib.pad(sample['left'],((top_pad,0),(left_pad,0),(0,0)),mode='constant',constant_values=0)
-            sample['right'] = np.lib.pad(sample['right'],((top_pad,0),(left_pad,0),(0,0)),mode='constant',constant_values=0)
-            sample['disp'] = np.lib.pad(sample['disp'],((top_pad,0),(left_pad,0)),mode='constant',constant_values=0)
+        top_pad = KITTI_PAD_SIZE[0]-h
+        left_pad = KITTI_PAD_SIZE[1]-w
+        if self.pad and self.dataset_name in ['KITTI2012', 'KITTI2015', 'KITTI']:
+            sample['left'] = np.pad(sample['left'],((top_pad,0),(left_pad,0),(0,0)),mode='constant',constant_values=0)
+            sample['right'] = np.pad(sample['right'],((top_pad,0),(left_pad,0),(0,0)),mode='constant',constant_values=0)
+            sample['disp'] = np.pad(sample['disp'],((top_pad,0),(left_pad,0)),mode='constant',constant_values=0)
 
         if self.transform is not None:
             sample = self.transform(sample)
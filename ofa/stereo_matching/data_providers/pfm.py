@@ -0,0 +1,83 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+__all__ = ['read_pfm_header', 'read_pfm', 'read_pfm_disp', 'read_pfm_batch']
+
+# 'PF' (color) or 'Pf' (grayscale), width, height and scale, each separated by whitespace; the scale is
+# followed by exactly one whitespace character, then the payload
+_HEADER_RE = re.compile(rb'^(P[Ff])\s+(\d+)\s+(\d+)\s+([-+0-9.eE]+)\s')
+_HEADER_MAX_BYTES = 256
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def read_pfm_header(filename):
+    """Returns (shape, dtype, offset): the shape of the payload as stored, its dtype with the endianness of the
+    scale sign (negative is little endian) and the offset of the payload in bytes"""
+    with open(filename, 'rb') as fp:
+        head = fp.read(_HEADER_MAX_BYTES)
+    match = _HEADER_RE.match(head)
+    if match is None:
+        raise ValueError('not a PFM file: %s' % filename)
+    kind, width, height, scale = match.groups()
+    width, height, scale = int(width), int(height), float(scale)
+    shape = (height, width, 3) if kind == b'PF' else (height, width)
+    dtype = np.dtype('<f4' if scale < 0 else '>f4')
+    return shape, dtype, match.end()
+
+
+def read_pfm(filename, crop=None, copy=True):
+    """Read a PFM file top row first, optionally only a crop window
+
+    The payload is memory-mapped, the bottom-up rows are flipped with a view and only the requested
+    window is touched. With `copy` the window is converted to a native C-contiguous float32 array in
+    a single pass (including the byte swap of big endian files), else the read-only mapped view is
+    returned.
+
+    Args:
+        crop: (top, left, height, width) in image coordinates, None for the full map
+    """
+    shape, dtype, offset = read_pfm_header(filename)
+    data = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)[::-1]
+    if crop is not None:
+        top, left, height, width = crop
+        data = data[top:top + height, left:left + width]
+    if copy:
+        data = np.ascontiguousarray(data, dtype=np.float32)
+    return data
+
+
+def read_pfm_disp(filename, subset=False, crop=None):
+    """Disparity from a PFM file as `read_disp`, the subset of SceneFlow stores negative disparities"""
+    disp = read_pfm(filename, crop)
+    if subset:
+        np.negative(disp, out=disp)
+    return disp
+
+
+def _get_pool(num_threads):
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != num_threads:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='pfm')
+        return _pool
+
+
+def read_pfm_batch(filenames, crops=None, subset=False, num_threads=8):
+    """Read many PFM disparities with a shared thread pool, file reads release the GIL
+
+    Args:
+        crops: None, or one crop window (or None) per file
+    Returns:
+        list of float32 arrays, in the order of `filenames`
+    """
+    if crops is None:
+        crops = [None] * len(filenames)
+    pool = _get_pool(num_threads)
+    return list(pool.map(lambda args: read_pfm_disp(args[0], subset, args[1]), zip(filenames, crops)))
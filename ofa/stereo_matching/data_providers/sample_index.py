@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+
+__all__ = ['PackedStrings', 'StereoSampleIndex']
+
+
+class PackedStrings(object):
+    """Immutable list of strings stored as one utf-8 byte buffer and an offset array
+
+    Unlike a list of str, indexing does not touch any per-item Python object, so forked DataLoader
+    workers keep sharing the pages of the buffer instead of copying them on refcount updates.
+    None is stored as an empty slice with a negative start.
+    """
+
+    def __init__(self, strings):
+        encoded = [None if s is None else s.encode('utf-8') for s in strings]
+        lengths = np.array([0 if b is None else len(b) for b in encoded], dtype=np.int64)
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.is_none = np.array([b is None for b in encoded], dtype=bool)
+        self.buffer = np.frombuffer(b''.join(b for b in encoded if b is not None), dtype=np.uint8).copy()
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('index %d out of range' % index)
+        if self.is_none[index]:
+            return None
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes + self.is_none.nbytes
+
+
+class StereoSampleIndex(object):
+    """Sample paths of a `StereoDataset`, relative to `data_dir` and packed per key
+
+    Indexing returns the same dict of absolute paths as the former list of samples; it is built on
+    access, so workers only hold the numpy buffers.
+
+    Args:
+        samples: dict key -> list of paths relative to data_dir (or None)
+        save_filename: add 'left_name', the left path without its first directory
+    """
+
+    def __init__(self, data_dir, samples, save_filename=False):
+        self.data_dir = data_dir
+        self.save_filename = save_filename
+        self.keys = list(samples.keys())
+        self.paths = {key: PackedStrings(value) for key, value in samples.items()}
+        lengths = set(len(value) for value in self.paths.values())
+        assert len(lengths) <= 1, 'all keys need one path (or None) per sample'
+        self._len = lengths.pop() if lengths else 0
+
+    def __getitem__(self, index):
+        sample = {}
+        for key in self.keys:
+            path = self.paths[key][index]
+            sample[key] = os.path.join(self.data_dir, path) if path is not None else None
+        if self.save_filename:
+            sample['left_name'] = self.paths['left'][index].split('/', 1)[1]
+        return sample
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def nbytes(self):
+        return sum(value.nbytes for value in self.paths.values())
@@ -0,0 +1,209 @@
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from torch.utils.data import Dataset
+
+from ofa.utils.file_io import read_img
+from .dataset import KITTI_PAD_SIZE, load_disp
+
+__all__ = ['SHARD_FORMAT_VERSION', 'shard_dir', 'write_stereo_shards', 'ShardedStereoDataset']
+
+# bump when the layout of the shards or of the index changes
+SHARD_FORMAT_VERSION = 1
+
+# fixed-stride index, one record per sample; offsets are in bytes into the shard, -1 if absent
+INDEX_DTYPE = np.dtype([
+    ('shard', '<i4'),
+    ('height', '<i4'),
+    ('width', '<i4'),
+    ('left', '<i8'),
+    ('right', '<i8'),
+    ('disp', '<i8'),
+    ('pseudo_disp', '<i8'),
+])
+
+# planes start at multiples of this, so that every plane can be viewed in place with its dtype
+ALIGNMENT = 64
+
+KITTI_NAMES = ['KITTI2012', 'KITTI2015', 'KITTI']
+
+
+def shard_dir(root, dataset_name, mode):
+    return os.path.join(root, '%s_%s' % (dataset_name, mode))
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _decode(sample_path, subset, disp_dtype):
+    # images are decoded as float32 holding 0-255 integers, store them losslessly as uint8
+    planes = {
+        'left': read_img(sample_path['left']).astype(np.uint8),
+        'right': read_img(sample_path['right']).astype(np.uint8),
+    }
+    for key in ['disp', 'pseudo_disp']:
+        if sample_path.get(key) is not None:
+            planes[key] = load_disp(sample_path[key], subset=subset).astype(disp_dtype)
+    return planes
+
+
+def write_stereo_shards(dataset, out_dir, shard_bytes=1024 ** 3, disp_dtype=np.float32, num_threads=8,
+                        logger=None):
+    """Decode every sample of a `StereoDataset` once and pack them into memory-mappable shards
+
+    Each shard `shard_%05d.bin` is a sequence of raw C-order planes: uint8 [H, W, 3] left and right
+    images and [H, W] disparities of `disp_dtype`. `index.npy` holds one `INDEX_DTYPE` record per
+    sample, `meta.json` the dataset info and the sample names. KITTI padding is not applied here,
+    `ShardedStereoDataset` pads like `StereoDataset`.
+
+    Args:
+        dataset: StereoDataset, only its sample paths are used
+        shard_bytes: a new shard is started once a shard exceeds this size
+        disp_dtype: np.float32, or np.float16 to halve the disparity planes (0.25 px steps above 256)
+        num_threads: decoding threads
+    """
+    disp_dtype = np.dtype(disp_dtype)
+    os.makedirs(out_dir, exist_ok=True)
+    subset = 'subset' in dataset.dataset_name
+    samples = dataset.samples
+    index = np.full(len(samples), -1, dtype=INDEX_DTYPE)
+
+    shard_id, shard_size, fp = 0, 0, None
+    pool = ThreadPool(num_threads)
+    try:
+        planes_iter = pool.imap(lambda s: _decode(s, subset, disp_dtype), samples, chunksize=4)
+        for i, planes in enumerate(planes_iter):
+            if fp is None or shard_size >= shard_bytes:
+                if fp is not None:
+                    fp.close()
+                    shard_id += 1
+                fp = open(os.path.join(out_dir, 'shard_%05d.bin' % shard_id), 'wb')
+                shard_size = 0
+
+            h, w, _ = planes['left'].shape
+            index['shard'][i] = shard_id
+            index['height'][i] = h
+            index['width'][i] = w
+            for key in ['left', 'right', 'disp', 'pseudo_disp']:
+                if key not in planes:
+                    continue
+                padding = _align(shard_size) - shard_size
+                fp.write(b'\0' * padding)
+                index[key][i] = shard_size + padding
+                data = np.ascontiguousarray(planes[key]).tobytes()
+                fp.write(data)
+                shard_size += padding + len(data)
+
+            if logger is not None and (i + 1) % 1000 == 0:
+                logger('packed %d / %d samples into %d shards' % (i + 1, len(samples), shard_id + 1))
+    finally:
+        pool.close()
+        if fp is not None:
+            fp.close()
+
+    np.save(os.path.join(out_dir, 'index.npy'), index)
+    meta = {
+        'version': SHARD_FORMAT_VERSION,
+        'dataset_name': dataset.dataset_name,
+        'mode': dataset.mode,
+        'disp_dtype': disp_dtype.name,
+        'num_shards': shard_id + 1 if len(samples) > 0 else 0,
+        'left': [s['left'] for s in samples],
+        # as `left_name` of StereoDataset with save_filename
+        'left_name': [os.path.relpath(s['left'], dataset.data_dir).split('/', 1)[-1] for s in samples],
+    }
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as fp:
+        json.dump(meta, fp)
+    return index
+
+
+class ShardedStereoDataset(Dataset):
+    """Drop-in replacement of `StereoDataset` reading from shards of `write_stereo_shards`
+
+    Images are returned as uint8 [H, W, 3] views of the memory-mapped shards and disparities as
+    float32 [H, W] (views too if stored as float32), so a following `RandomCrop` only slices. The
+    shards are mapped copy-on-write, in-place transforms never modify the files. Each worker
+    process maps the shards on first use.
+    """
+
+    def __init__(self, data_dir, save_filename=False, load_pseudo_gt=False, transform=None, pad=True):
+        super(ShardedStereoDataset, self).__init__()
+
+        with open(os.path.join(data_dir, 'meta.json'), 'r') as fp:
+            meta = json.load(fp)
+        if meta.get('version') != SHARD_FORMAT_VERSION:
+            raise ValueError('shard format version %s in %s, expected %d, rebuild the shards' %
+                             (meta.get('version'), data_dir, SHARD_FORMAT_VERSION))
+
+        self.data_dir = data_dir
+        self.dataset_name = meta['dataset_name']
+        self.mode = meta['mode']
+        self.disp_dtype = np.dtype(meta['disp_dtype'])
+        self.num_shards = meta['num_shards']
+        self.left_paths = meta['left']
+        self.left_names = meta['left_name']
+        self.save_filename = save_filename
+        self.load_pseudo_gt = load_pseudo_gt
+        self.transform = transform
+        self.pad = pad
+
+        self.index = np.load(os.path.join(data_dir, 'index.npy'))
+        self._shards = {}
+
+    def __getstate__(self):
+        # do not pickle the mappings into DataLoader workers
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def shard(self, shard_id):
+        if shard_id not in self._shards:
+            fname = os.path.join(self.data_dir, 'shard_%05d.bin' % shard_id)
+            self._shards[shard_id] = np.asarray(np.memmap(fname, dtype=np.uint8, mode='c'))
+        return self._shards[shard_id]
+
+    def plane(self, record, key, dtype, shape):
+        offset = int(record[key])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self.shard(int(record['shard']))[offset:offset + nbytes].view(dtype).reshape(shape)
+
+    def __getitem__(self, index):
+        sample = {}
+        record = self.index[index]
+        h, w = int(record['height']), int(record['width'])
+
+        if self.save_filename:
+            sample['left_name'] = self.left_names[index]
+
+        sample['left'] = self.plane(record, 'left', np.dtype(np.uint8), (h, w, 3))  # [H, W, 3]
+        sample['right'] = self.plane(record, 'right', np.dtype(np.uint8), (h, w, 3))
+        for key in ['disp', 'pseudo_disp']:
+            if record[key] < 0 or (key == 'pseudo_disp' and not self.load_pseudo_gt):
+                continue
+            disp = self.plane(record, key, self.disp_dtype, (h, w))  # [H, W]
+            sample[key] = disp if disp.dtype == np.float32 else disp.astype(np.float32)
+
+        # padding for KITTI, as in StereoDataset
+        if self.pad and self.dataset_name in KITTI_NAMES:
+            top_pad = KITTI_PAD_SIZE[0] - h
+            left_pad = KITTI_PAD_SIZE[1] - w
+            sample['left'] = np.pad(sample['left'], ((top_pad, 0), (left_pad, 0), (0, 0)), mode='constant',
+                                    constant_values=0)
+            sample['right'] = np.pad(sample['right'], ((top_pad, 0), (left_pad, 0), (0, 0)), mode='constant',
+                                     constant_values=0)
+            if 'disp' in sample:
+                sample['disp'] = np.pad(sample['disp'], ((top_pad, 0), (left_pad, 0)), mode='constant',
+                                        constant_values=0)
+
+        if self.transform is not None:
+            sample = self.transform(sample)
+
+        sample['disp_name'] = self.left_paths[index]
+
+        return sample
+
+    def __len__(self):
+        return len(self.index)
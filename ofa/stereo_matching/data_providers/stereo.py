@@ -12,7 +12,9 @@ import torchvision.datasets as datasets
 
 from ofa.stereo_matching.data_providers import transforms
 from .base_provider import DataProvider
-from .dataset import StereoDataset
+from .dataset import KITTI_PAD_SIZE, StereoDataset
+from .collate import PadCollate
+from .shards import ShardedStereoDataset, shard_dir
 from ofa.utils.my_dataloader import MyDistributedSampler
 
 __all__ = ['StereoDataProvider']
@@ -23,12 +25,18 @@ class StereoDataProvider(DataProvider):
 
     def __init__(self, save_path=None, train_batch_size=16, test_batch_size=32, valid_size=None, n_worker=8,
                  dataset_name='SceneFlow',load_pseudo_gt=False,
-                 num_replicas=None, rank=None):
+                 num_replicas=None, rank=None, shard_path=None, uint8_batches=False, batch_padding=False):
 
         warnings.filterwarnings('ignore')
         self._save_path = save_path
+        # root of the shards of scripts/build_stereo_shards.py, decode the image files if None
+        self._shard_path = shard_path
         self._dataset_name = dataset_name
         self._load_pseudo_gt = load_pseudo_gt
+        # ship uint8 images out of the workers, the consumer normalizes them with `normalize_batch`
+        self._uint8_batches = uint8_batches
+        # pad KITTI samples while collating the batches (PadCollate) instead of per sample in the dataset
+        self._batch_padding = batch_padding and dataset_name in ['KITTI', 'KITTI2012', 'KITTI2015']
 
         if dataset_name == 'SceneFlow':
             self._img_height = 540
@@ -66,22 +74,23 @@ class StereoDataProvider(DataProvider):
 
             self.train = torch.utils.data.DataLoader(
                 train_dataset, batch_size=train_batch_size, sampler=train_sampler,
-                num_workers=n_worker, pin_memory=True,
+                num_workers=n_worker, pin_memory=True, collate_fn=self.build_collate(train=True),
             )
             self.valid = torch.utils.data.DataLoader(
                 valid_dataset, batch_size=test_batch_size, sampler=valid_sampler,
-                num_workers=n_worker, pin_memory=True,
+                num_workers=n_worker, pin_memory=True, collate_fn=self.build_collate(train=False),
             )
         else:
             if num_replicas is not None:
                 train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, num_replicas, rank)
                 self.train = torch.utils.data.DataLoader(
                     train_dataset, batch_size=train_batch_size, sampler=train_sampler,
-                    num_workers=n_worker, pin_memory=True
+                    num_workers=n_worker, pin_memory=True, collate_fn=self.build_collate(train=True),
                 )
             else:
                 self.train = torch.utils.data.DataLoader(
                     train_dataset, batch_size=train_batch_size, shuffle=True, num_workers=n_worker, pin_memory=True,
+                    collate_fn=self.build_collate(train=True),
                 )
             self.valid = None
 
@@ -90,10 +99,12 @@ class StereoDataProvider(DataProvider):
             test_sampler = torch.utils.data.distributed.DistributedSampler(test_dataset, num_replicas, rank)
             self.test = torch.utils.data.DataLoader(
                 test_dataset, batch_size=test_batch_size, sampler=test_sampler, num_workers=n_worker, pin_memory=True,
+                collate_fn=self.build_collate(train=False),
             )
         else:
             self.test = torch.utils.data.DataLoader(
                 test_dataset, batch_size=test_batch_size, shuffle=True, num_workers=n_worker, pin_memory=True,
+                collate_fn=self.build_collate(train=False),
             )
 
         if self.valid is None:
@@ -119,17 +130,35 @@ class StereoDataProvider(DataProvider):
     def data_url(self):
         raise ValueError('unable to download %s' % self.name())
 
+    def build_dataset(self, mode, _transforms):
+        if self._shard_path is not None:
+            return ShardedStereoDataset(shard_dir(self._shard_path, self._dataset_name, mode),
+                                        load_pseudo_gt=self._load_pseudo_gt, transform=_transforms,
+                                        pad=not self._batch_padding)
+        return StereoDataset(self.save_path, mode=mode, dataset_name=self._dataset_name, transform=_transforms,
+                             pad=not self._batch_padding)
+
+    def build_collate(self, train):
+        if not self._batch_padding:
+            return None
+        if train:
+            # the crops share one size, PadCollate only stacks them
+            return PadCollate()
+        # StereoDataset pads with zeros before normalization
+        image_fill = 0 if self._uint8_batches else [-m / s for m, s in zip(self.mean, self.std)]
+        return PadCollate(*KITTI_PAD_SIZE, image_fill=image_fill)
+
     def train_dataset(self, _transforms):
         if self._dataset_name in ['KITTI2012', 'KITTI2015', 'KITTI']:
-            return StereoDataset(self.save_path, mode='train_all', dataset_name=self._dataset_name, transform=_transforms)
+            return self.build_dataset('train_all', _transforms)
         else:
-            return StereoDataset(self.save_path, mode='train', dataset_name=self._dataset_name, transform=_transforms)
+            return self.build_dataset('train', _transforms)
 
     def test_dataset(self, _transforms):
         if self._dataset_name in ['KITTI2012', 'KITTI2015', 'KITTI']:
-            return StereoDataset(self.save_path, mode='train_all', dataset_name=self._dataset_name, transform=_transforms)
+            return self.build_dataset('train_all', _transforms)
         else:
-            return StereoDataset(self.save_path, mode='test', dataset_name=self._dataset_name, transform=_transforms)
+            return self.build_dataset('test', _transforms)
 
     @property
     def train_path(self):
@@ -139,16 +168,33 @@ class StereoDataProvider(DataProvider):
     def valid_path(self):
         return os.path.join(self.save_path, 'val')
 
+    @property
+    def mean(self):
+        return [0.485, 0.456, 0.406]
+
+    @property
+    def std(self):
+        return [0.229, 0.224, 0.225]
+
     @property
     def normalize(self):
-        return transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        return transforms.Normalize(mean=self.mean, std=self.std)
+
+    def build_to_tensor(self):
+        if self._uint8_batches:
+            return transforms.ToUint8Tensor()
+        return transforms.ToNormalizedTensor(mean=self.mean, std=self.std)
+
+    def normalize_batch(self, img):
+        """Normalize a batch of images from the loaders, a no-op unless the provider ships uint8 batches"""
+        return transforms.normalize_batch(img, self.mean, self.std)
 
     def build_train_transform(self, print_log=True):
-        train_transform_list = [transforms.RandomCrop(self._crop_height, self._crop_width),
+        pad_to = KITTI_PAD_SIZE if self._batch_padding else None
+        train_transform_list = [transforms.RandomCrop(self._crop_height, self._crop_width, pad_to=pad_to),
                                 transforms.RandomColor(),
                                 transforms.RandomVerticalFlip(),
-                                transforms.ToTensor(),
-                                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+                                self.build_to_tensor(),
                                 ]
 
         train_transforms = transforms.Compose(train_transform_list)
@@ -156,8 +202,7 @@ class StereoDataProvider(DataProvider):
 
     def build_valid_transform(self, image_size=None):
         val_transform_list = [
-                              transforms.ToTensor(),
-                              transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+                              self.build_to_tensor(),
                              ]
         val_transforms = transforms.Compose(val_transform_list)
         return val_transforms
@@ -183,10 +228,12 @@ class StereoDataProvider(DataProvider):
                 sub_sampler = torch.utils.data.sampler.SubsetRandomSampler(chosen_indexes)
             sub_data_loader = torch.utils.data.DataLoader(
                 new_train_dataset, batch_size=batch_size, sampler=sub_sampler,
-                num_workers=num_worker, pin_memory=True,
+                num_workers=num_worker, pin_memory=True, collate_fn=self.build_collate(train=True),
             )
             self.__dict__['sub_train_list'] = []
             for sample in sub_data_loader:
+                for key in ['left', 'right']:
+                    sample[key] = self.normalize_batch(sample[key])
                 self.__dict__['sub_train_list'].append(sample)
         #return self.__dict__['sub_train_%d' % self.active_img_size]
         return self.__dict__['sub_train_list']
@@ -56,14 +56,94 @@ class Normalize(object):
         return sample
 
 
+def _to_tensors(sample, keys):
+    for key in keys:
+        if key in sample.keys():
+            sample[key] = torch.from_numpy(np.ascontiguousarray(sample[key]))
+    return sample
+
+
+def normalize_images(img, mean, std, out=None):
+    """(img / 255 - mean) / std of 0-255 images in a single pass
+
+    Args:
+        img: uint8 or float tensor [..., 3, H, W] of any strides, e.g. a permuted [H, W, 3] array
+        out: optional contiguous float tensor of the same shape
+    """
+    scale = 1. / (255. * torch.tensor(std, dtype=torch.float32, device=img.device)).view(3, 1, 1)
+    bias = -torch.tensor(mean, dtype=torch.float32, device=img.device).view(3, 1, 1) * scale * 255.
+    if out is None:
+        out = torch.empty(img.shape, dtype=torch.float32, device=img.device)
+    return torch.addcmul(bias, img, scale, out=out)
+
+
+def normalize_batch(img, mean, std):
+    """Normalize a collated uint8 image batch of `ToUint8Tensor`, float batches are already normalized"""
+    if img.dtype != torch.uint8:
+        return img
+    return normalize_images(img, mean, std)
+
+
+class ToNormalizedTensor(object):
+    """ToTensor followed by Normalize, fused into one pass from [H, W, 3] arrays to normalized [3, H, W] tensors"""
+
+    def __init__(self, mean, std):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, sample):
+        for key in ['left', 'right']:
+            img = torch.from_numpy(np.asarray(sample[key])).permute(2, 0, 1)  # [3, H, W] view
+            sample[key] = normalize_images(img, self.mean, self.std)
+
+        return _to_tensors(sample, ['disp', 'pseudo_disp'])
+
+
+class ToUint8Tensor(object):
+    """Convert the images to uint8 [3, H, W] tensors, to be normalized with `normalize_batch` after collation
+
+    DataLoader workers then ship a quarter of the image bytes. The images must hold 0-255 integers,
+    as decoded or after RandomColor.
+    """
+
+    def __call__(self, sample):
+        for key in ['left', 'right']:
+            img = np.transpose(sample[key], (2, 0, 1))  # [3, H, W]
+            sample[key] = torch.from_numpy(np.ascontiguousarray(img, dtype=np.uint8))
+
+        return _to_tensors(sample, ['disp', 'pseudo_disp'])
+
+
 class RandomCrop(object):
-    def __init__(self, img_height, img_width, validate=False):
+    """Random (or center) crop
+
+    Args:
+        pad_to: (height, width) of the top and left padding skipped by datasets created with pad=False,
+            the crop window is drawn as if the images were padded and only a crop overlapping the
+            padding is padded
+    """
+
+    def __init__(self, img_height, img_width, validate=False, pad_to=None):
         self.img_height = img_height
         self.img_width = img_width
         self.validate = validate
+        self.pad_to = pad_to
+        self.top_pad = self.left_pad = 0
 
     def __call__(self, sample):
         ori_height, ori_width = sample['left'].shape[:2]
+        self.top_pad = self.left_pad = 0
+        if self.pad_to is not None:
+            self.top_pad, self.left_pad = self.pad_to[0] - ori_height, self.pad_to[1] - ori_width
+            assert self.top_pad >= 0 and self.left_pad >= 0
+            if self.img_height > self.pad_to[0] or self.img_width > self.pad_to[1]:
+                # the padded images are padded again below, pad them for real
+                for key in ['left', 'right', 'disp', 'pseudo_disp']:
+                    if key in sample.keys():
+                        pad_width = ((self.top_pad, 0), (self.left_pad, 0)) + ((0, 0),) * (sample[key].ndim - 2)
+                        sample[key] = np.pad(sample[key], pad_width, mode='constant', constant_values=0)
+                self.top_pad = self.left_pad = 0
+            ori_height, ori_width = self.pad_to
         if self.img_height > ori_height or self.img_width > ori_width:
             top_pad = self.img_height - ori_height
             right_pad = self.img_width - ori_width
@@ -118,8 +198,14 @@ class RandomCrop(object):
         return sample
 
     def crop_img(self, img):
-        return img[self.offset_y:self.offset_y + self.img_height,
-               self.offset_x:self.offset_x + self.img_width]
+        # offsets in the padded frame of pad_to, the image itself starts at (top_pad, left_pad)
+        top, left = self.offset_y - self.top_pad, self.offset_x - self.left_pad
+        if top >= 0 and left >= 0:
+            return img[top:top + self.img_height, left:left + self.img_width]
+        out = np.zeros((self.img_height, self.img_width) + img.shape[2:], dtype=img.dtype)
+        y, x = max(top, 0), max(left, 0)
+        out[y - top:, x - left:] = img[y:top + self.img_height, x:left + self.img_width]
+        return out
 
 
 class RandomVerticalFlip(object):
@@ -219,9 +305,192 @@ class RandomSaturation(object):
         return sample
 
 
+# ranges of the colour augmentations, shared by the PIL and tensor versions
+COLOR_OPS = ['contrast', 'gamma', 'brightness', 'hue', 'saturation']
+COLOR_RANGES = {
+    'contrast': (0.8, 1.2),
+    'gamma': (0.7, 1.5),  # adopted from FlowNet
+    'brightness': (0.5, 2.0),
+    'hue': (-0.1, 0.1),
+    'saturation': (0.8, 1.2),
+}
+
+
+def sample_color_params():
+    """Colour ops of one sample as `RandomColor` picks them, [(op, factor)] in application order
+
+    The random numbers are drawn in the same order as by the PIL transforms, so a seeded run picks
+    the same ops and factors with either version.
+    """
+    ops = list(COLOR_OPS)
+    if np.random.random() < 0.5:
+        # A single transform
+        ops = [random.choice(ops)]
+    else:
+        # Combination of transforms, random order
+        random.shuffle(ops)
+
+    params = []
+    for op in ops:
+        if np.random.random() < 0.5:
+            params.append((op, np.random.uniform(*COLOR_RANGES[op])))
+    return params
+
+
+def _floor(img, max_value):
+    # round down to the uint8 levels of [0, max_value]
+    if max_value == 255:
+        return img.floor_()
+    return img.mul_(255. / max_value).floor_().div_(255. / max_value)
+
+
+def _factor(factor, ndim):
+    # per-sample [N, 1, 1, 1] factors broadcast against [N, ...] tensors of ndim dims
+    if torch.is_tensor(factor):
+        return factor.view(factor.shape[:1] + (1,) * (ndim - 1))
+    return factor
+
+
+def _grayscale(img):
+    # ITU-R 601-2 luma as PIL 'L', [..., 3, H, W] -> [..., 1, H, W]
+    r, g, b = img.unbind(-3)
+    return torch.add(r, g, alpha=0.587 / 0.299).add_(b, alpha=0.114 / 0.299).mul_(0.299).unsqueeze(-3)
+
+
+def _blend(img, degenerate, factor, max_value):
+    # degenerate + factor * (img - degenerate) in one pass over the image
+    if torch.is_tensor(factor):
+        out = torch.addcmul(degenerate * (1 - factor), img, factor)
+    else:
+        out = torch.add(degenerate * (1 - factor), img, alpha=factor)
+    return out.clamp_(0, max_value)
+
+
+def _adjust_contrast(img, factor, max_value, quantize):
+    # the mean of the grayscale image from the channel means
+    r, g, b = img.mean(dim=(-2, -1), keepdim=True).unbind(-3)
+    mean = (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(-3)
+    if quantize:
+        mean = _floor(mean + 0.5 * max_value / 255., max_value)
+    return _blend(img, mean, factor, max_value)
+
+
+def _adjust_gamma(img, gamma, max_value, quantize):
+    # max_value * (img / max_value) ** gamma
+    scale = max_value ** (1 - gamma)
+    if quantize:
+        # as the lookup table of torchvision's PIL version
+        scale = scale * (256 - 1e-3) / 255.
+    return img.pow(gamma).mul_(scale)
+
+
+def _adjust_brightness(img, factor, max_value, quantize):
+    return img.mul(factor).clamp_(0, max_value)
+
+
+def _adjust_saturation(img, factor, max_value, quantize):
+    gray = _grayscale(img)
+    if quantize:
+        gray = _floor(gray + 0.5 * max_value / 255., max_value)
+    return _blend(img, gray, factor, max_value)
+
+
+def _adjust_hue(img, hue, max_value, quantize):
+    if quantize:
+        # PIL shifts the uint8 hue channel
+        hue = torch.trunc(hue * 255) / 255 if torch.is_tensor(hue) else int(hue * 255) / 255.
+    # RGB -> HSV as torchvision, hue scaled to [0, 6)
+    r, g, b = img.unbind(-3)
+    maxc = img.amax(dim=-3)
+    minc = img.amin(dim=-3)
+    cr = maxc - minc
+    h = torch.where(maxc == r, g - b, torch.where(maxc == g, (b - r).add_(cr, alpha=2), (r - g).add_(cr, alpha=4)))
+    h = h.div_(torch.where(cr == 0, torch.ones_like(cr), cr))
+    h = torch.remainder(h.add_(_factor(hue, h.dim()) * 6), 6)
+    # HSV -> RGB, channel n = V - V * S * clamp(min(k, 4 - k), 0, 1) with k = (n + 6H) mod 6, n = 5, 3, 1
+    n = torch.tensor([5., 3., 1.], dtype=img.dtype, device=img.device).view(3, 1, 1)
+    k = torch.fmod(h.unsqueeze(-3) + n, 6)
+    k = torch.min(k, 4 - k).clamp_(0, 1)
+    return torch.addcmul(maxc.unsqueeze(-3), cr.unsqueeze(-3), k, value=-1)
+
+
+COLOR_FNS = {
+    'contrast': _adjust_contrast,
+    'gamma': _adjust_gamma,
+    'brightness': _adjust_brightness,
+    'hue': _adjust_hue,
+    'saturation': _adjust_saturation,
+}
+
+
+def apply_color_params(img, params, max_value=255., quantize=True):
+    """Apply [(op, factor)] of `sample_color_params` to a float [3, H, W] image with values in [0, max_value]
+
+    With `quantize` every op rounds its result down to the 1 / 255 grid as the uint8 PIL version does.
+    """
+    for op, factor in params:
+        img = COLOR_FNS[op](img, factor, max_value, quantize)
+        if quantize:
+            img = _floor(img, max_value)
+    return img
+
+
+def apply_batch_color_params(imgs, params_list, max_value=1., quantize=False):
+    """Apply per sample [(op, factor)] lists to a float [B, 3, H, W] batch
+
+    Step k runs the k-th op of every sample, samples sharing an op at that step are processed together
+    and written back in place into a single copy of the batch.
+    """
+    num_steps = max([len(params) for params in params_list] + [0])
+    if num_steps > 0:
+        imgs = imgs.clone()
+    for step in range(num_steps):
+        for op in COLOR_OPS:
+            idx = [i for i, params in enumerate(params_list) if len(params) > step and params[step][0] == op]
+            if len(idx) == 0:
+                continue
+            factor = torch.tensor([params_list[i][step][1] for i in idx], dtype=imgs.dtype,
+                                  device=imgs.device).view(-1, 1, 1, 1)
+            if len(idx) == len(params_list):
+                imgs = COLOR_FNS[op](imgs, factor, max_value, quantize)
+                if quantize:
+                    imgs = _floor(imgs, max_value)
+                continue
+            index = torch.tensor(idx, device=imgs.device)
+            out = COLOR_FNS[op](imgs.index_select(0, index), factor, max_value, quantize)
+            if quantize:
+                out = _floor(out, max_value)
+            imgs.index_copy_(0, index, out)
+    return imgs
+
+
 class RandomColor(object):
+    """Random contrast, gamma, brightness, hue and saturation, the same for the left and right image
+
+    Args:
+        backend: 'tensor' runs the ops on float tensors viewing the [H, W, 3] arrays, 'pil' converts
+            the images to PIL and back as before; both draw the same ops and factors
+    """
+
+    def __init__(self, backend='tensor'):
+        assert backend in ['tensor', 'pil']
+        self.backend = backend
 
     def __call__(self, sample):
+        if self.backend == 'pil':
+            return self.pil_color(sample)
+
+        params = sample_color_params()
+        for key in ['left', 'right']:
+            img = np.asarray(sample[key], dtype=np.float32)
+            if len(params) > 0:
+                img = apply_color_params(torch.from_numpy(img).permute(2, 0, 1), params)
+                img = img.permute(1, 2, 0).numpy()
+            sample[key] = img
+
+        return sample
+
+    def pil_color(self, sample):
         transforms = [RandomContrast(),
                       RandomGamma(),
                       RandomBrightness(),
@@ -244,3 +513,21 @@ class RandomColor(object):
         sample = ToNumpyArray()(sample)
 
         return sample
+
+
+class BatchRandomColor(object):
+    """`RandomColor` of a collated batch of tensors, e.g. on the GPU after the data loader
+
+    Each sample draws its own ops and factors, shared by its left and right image. Use it on images
+    in [0, max_value] before `Normalize`, i.e. without RandomColor and Normalize in the dataset transforms.
+    """
+
+    def __init__(self, max_value=1., quantize=False):
+        self.max_value = max_value
+        self.quantize = quantize
+
+    def __call__(self, sample):
+        params_list = [sample_color_params() for _ in range(sample['left'].size(0))]
+        for key in ['left', 'right']:
+            sample[key] = apply_batch_color_params(sample[key].float(), params_list, self.max_value, self.quantize)
+        return sample
@@ -17,7 +17,8 @@ __all__ = ['OFAAANet']
 class OFAAANet(AANet):
 
     def __init__(self, bn_param=(0.1, 1e-5), base_stage_width=None, width_mult=1.0,
-                 ks_list=3, expand_ratio_list=6, depth_list=4, scale_list=3):
+                 ks_list=3, expand_ratio_list=6, depth_list=4, scale_list=3, siamese_batching=False,
+                 siamese_joint_bn=False):
 
 
         self.width_mult = width_mult
@@ -35,7 +36,8 @@ class OFAAANet(AANet):
         self.scale_list.sort()
         self.feature_blocks = self.ConstructFeatureNet()
 
-        super(OFAAANet, self).__init__(max_disp = 192, feature_blocks = self.feature_blocks, num_scales = max(self.scale_list))
+        super(OFAAANet, self).__init__(max_disp = 192, feature_blocks = self.feature_blocks, num_scales = max(self.scale_list),
+                                       siamese_batching=siamese_batching, siamese_joint_bn=siamese_joint_bn)
         
         # runtime_depth
         self.runtime_depth = [len(block_idx) for block_idx in self.fea_block_group_info]
@@ -272,7 +274,8 @@ class OFAAANet(AANet):
                     input_channel = stage_blocks[-1].conv.out_channels
                 blocks += stage_blocks
 
-        _subnet = AANet(max_disp = 192, feature_blocks = blocks, num_scales=self.active_scale)
+        _subnet = AANet(max_disp = 192, feature_blocks = blocks, num_scales=self.active_scale,
+                        siamese_batching=self.siamese_batching, siamese_joint_bn=self.siamese_joint_bn)
 
         # make deep copy of other modules
         _subnet.cost_volume = copy.deepcopy(self.cost_volume)
@@ -8,11 +8,10 @@ import time
 import torch
 import torch.nn.functional as F
 from tqdm import tqdm
-import wandb
-import horovod.torch as hvd
 
 from ofa.utils import AverageMeter, cross_entropy_loss_with_soft_target
 from ofa.utils import DistributedMetric, list_mean, subset_mean, val2list, MyRandomResizedCrop
+from ofa.imagenet_classification.run_manager.metrics import MetricAccumulator, sync_step
 from ofa.stereo_matching.run_manager import DistributedRunManager
 
 __all__ = [
@@ -104,6 +103,7 @@ def validate(run_manager, epoch=0, is_test=False, image_size_list=None,
 
 def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
     dynamic_net = run_manager.network
+    data_provider = run_manager.run_config.data_provider
     distributed = isinstance(run_manager, DistributedRunManager)
 
     # switch to train mode
@@ -115,7 +115,8 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
     nBatch = len(run_manager.run_config.train_loader)
 
     data_time = AverageMeter()
-    losses = DistributedMetric('train_loss') if distributed else AverageMeter()
+    losses = MetricAccumulator(['loss'], allreduce=run_manager.backend.allreduce if distributed else None,
+                               name='train_loss', device=run_manager.device)
     metric_dict = run_manager.get_metric_dict()
 
     with tqdm(total=nBatch,
@@ -135,9 +136,9 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
                     run_manager.optimizer, epoch - warmup_epochs, i, nBatch
                 )
 
-            left = sample['left'].cuda()  # [B, 3, H, W]
-            right = sample['right'].cuda()
-            gt_disp = sample['disp'].cuda()  # [B, H, W]
+            left = data_provider.normalize_batch(sample['left'].to(run_manager.device))  # [B, 3, H, W]
+            right = data_provider.normalize_batch(sample['right'].to(run_manager.device))
+            gt_disp = sample['disp'].to(run_manager.device)  # [B, H, W]
 
             dynamic_net.zero_grad()
 
@@ -183,9 +184,12 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
             loss_of_subnets = [0 if loss is None else loss for loss in loss_of_subnets]
             losses.update(list_mean(loss_of_subnets), left.size(0))
 
+            # the loss and metrics stay on the GPU between two syncs
+            sync = sync_step(i, nBatch, run_manager.run_config.print_frequency)
+            loss_vals = losses.values(sync)
             t.set_postfix({
-                'loss': losses.avg.item(),
-                **run_manager.get_metric_vals(metric_dict, return_dict=True),
+                'loss': loss_vals['loss'],
+                **run_manager.get_metric_vals(metric_dict, return_dict=True, sync=sync),
                 'R': left.size(2),
                 'lr': new_lr,
                 'loss_type': loss_type,
@@ -196,12 +200,13 @@ def train_one_epoch(run_manager, args, epoch, warmup_epochs=0, warmup_lr=0):
             t.update(1)
             end = time.time()
 
-            if i % 10 == 0:
+            if sync:
                 wdlog = {}
-                wdlog["train_loss_iters"] = losses.avg.item()
-                if hvd.rank() == 0:
-                    wandb.log(wdlog)
-    return losses.avg.item(), run_manager.get_metric_vals(metric_dict)
+                wdlog["train_loss_iters"] = loss_vals['loss']
+                if distributed:
+                    run_manager.log_metrics(wdlog)
+    # synced at the last step
+    return losses.avg, run_manager.get_metric_vals(metric_dict, sync=False)
 
 
 def train(run_manager, args, validate_func=None):
@@ -246,8 +251,15 @@ def train(run_manager, args, validate_func=None):
                     'state_dict': run_manager.network.state_dict(),
                 }, is_best=is_best, model_name=args.name)
 
+    if distributed:
+        # the checkpoints and metrics are written in the background, make sure the last ones are on disk
+        run_manager.flush_checkpoints()
+        run_manager.flush_metrics()
+
 
 def load_models(run_manager, dynamic_net, model_path=None):
+    if isinstance(run_manager, DistributedRunManager):
+        run_manager.flush_checkpoints()
     # specify init path
     init = torch.load(model_path, map_location='cpu')['state_dict']
     dynamic_net.load_state_dict(init)
@@ -18,6 +18,8 @@ def set_running_statistics(model, data_loader, distributed=False):
     bn_var = {}
 
     forward_model = copy.deepcopy(model)
+    # the patched BN layers below always use batch statistics, estimate them per view
+    forward_model.siamese_batching = False
     for name, m in forward_model.named_modules():
         if isinstance(m, nn.BatchNorm2d):
             if distributed:
@@ -0,0 +1,118 @@
+# Once for All: Train One Network and Specialize it for Efficient Deployment
+# Han Cai, Chuang Gan, Tianzhe Wang, Zhekai Zhang, Song Han
+# International Conference on Learning Representations (ICLR), 2020.
+
+import torch
+import torch.nn as nn
+
+from ofa.utils import make_divisible, val2list, get_net_device, MyNetwork
+from .latency_lookup_table import *
+from .latency_lookup_table import conv_out_size
+
+
+def count_conv_flop(out_h, out_w, in_channels, out_channels, kernel_size, groups):
+    return in_channels * out_channels * kernel_size * kernel_size * out_h * out_w / groups
+
+
+def count_tail_flops(net, image_size, scale):
+    """Multiply-accumulates of everything after feature extraction at the given active scale
+
+    Convolutions of aggregation, estimation and refinement are counted with forward hooks,
+    the correlation cost volume is counted analytically.
+    """
+    h, w = image_size
+    device = get_net_device(net)
+    flops = [0]
+
+    def conv_hook(m, x, y):
+        flops[0] += y.numel() / y.size(0) * m.in_channels / m.groups * int(torch.tensor(m.kernel_size).prod())
+
+    feature_modules = set(id(m) for m in net.feature_extractor.modules())
+    hooks = [m.register_forward_hook(conv_hook) for m in net.modules()
+             if isinstance(m, (nn.Conv2d, nn.Conv3d)) and id(m) not in feature_modules]
+
+    active_scale = net.active_scale
+    net.active_scale = scale
+    net.aggregation.set_active_scale(scale)
+    with torch.no_grad():
+        img = torch.zeros(1, 3, h, w, device=device)
+        feature = net.feature_extraction(img)
+        for s, f in enumerate(feature):
+            # correlation: C multiply-accumulates per disparity candidate and pixel
+            flops[0] += f.size(1) * (net.max_disp // 2 ** s) * f.size(2) * f.size(3)
+        cost_volume = net.cost_volume_construction(feature, feature)
+        disparity_pyramid = net.disparity_computation(net.aggregation(cost_volume))
+        net.disparity_refinement(img, img, disparity_pyramid[-1])
+    net.active_scale = active_scale
+    net.aggregation.set_active_scale(active_scale)
+
+    for hook in hooks:
+        hook.remove()
+    return flops[0]
+
+
+class AANetLatencyModel(object):
+    """Latency in ms of an OFAAANet subnet from a `AANetLatencyTable`"""
+
+    def __init__(self, latency_table, image_size):
+        if not isinstance(latency_table, AANetLatencyTable):
+            latency_table = AANetLatencyTable(latency_table)
+        self.latency_table = latency_table
+        self.image_size = image_size
+
+    def get_efficiency(self, arch_dict):
+        return self.latency_table.predict_latency(h=self.image_size[0], w=self.image_size[1], **arch_dict)
+
+
+class AANetFLOPsModel(object):
+    """MFLOPs (multiply-accumulates) of an OFAAANet subnet, both views included"""
+
+    def __init__(self, ofa_net, image_size):
+        self.image_size = image_size
+        self.stages = []
+        for block_idx in ofa_net.fea_block_group_info:
+            conv = ofa_net.feature_blocks[block_idx[0]].conv
+            self.stages.append({
+                'width': conv.active_out_channel,
+                'stride': conv.stride,
+                'use_se': conv.use_se,
+                'n_block': len(block_idx),
+            })
+        self.num_blocks = len(ofa_net.feature_blocks)
+
+        was_training = ofa_net.training
+        ofa_net.eval()
+        self.tail_flops = {s: count_tail_flops(ofa_net, image_size, s) for s in ofa_net.scale_list}
+        ofa_net.train(was_training)
+
+    def count_block_flops(self, in_h, in_w, in_c, out_c, ks, e, stride, use_se):
+        out_h, out_w = conv_out_size(in_h, stride), conv_out_size(in_w, stride)
+        mid_c = make_divisible(round(in_c * e), MyNetwork.CHANNEL_DIVISIBLE)
+        flops = count_conv_flop(in_h, in_w, in_c, mid_c, 1, 1)  # inverted bottleneck
+        flops += count_conv_flop(out_h, out_w, mid_c, mid_c, ks, mid_c)  # depth conv
+        if use_se:
+            se_c = make_divisible(mid_c // 4, MyNetwork.CHANNEL_DIVISIBLE)
+            flops += 2 * count_conv_flop(1, 1, mid_c, se_c, 1, 1)
+        flops += count_conv_flop(out_h, out_w, mid_c, out_c, 1, 1)  # point linear
+        return flops, out_h, out_w
+
+    def get_efficiency(self, arch_dict):
+        ks = val2list(arch_dict['ks'], self.num_blocks)
+        e = val2list(arch_dict['e'], self.num_blocks)
+        d = val2list(arch_dict['d'], len(self.stages))
+        s = arch_dict['s']
+
+        flops = 0
+        in_h, in_w, in_c = self.image_size[0], self.image_size[1], 3
+        block_offset = 0
+        for stage_id, stage in enumerate(self.stages[:s]):
+            for i in range(min(d[stage_id], stage['n_block'])):
+                stride = stage['stride'] if i == 0 else 1
+                block_flops, in_h, in_w = self.count_block_flops(in_h, in_w, in_c, stage['width'],
+                                                                 ks[block_offset + i], e[block_offset + i],
+                                                                 stride, stage['use_se'])
+                flops += 2 * block_flops  # left and right view
+                in_c = stage['width']
+            block_offset += stage['n_block']
+
+        return (flops + self.tail_flops[s]) / 1e6
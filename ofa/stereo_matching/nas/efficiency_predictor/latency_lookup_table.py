@@ -0,0 +1,230 @@
+# Once for All: Train One Network and Specialize it for Efficient Deployment
+# Han Cai, Chuang Gan, Tianzhe Wang, Zhekai Zhang, Song Han
+# International Conference on Learning Representations (ICLR), 2020.
+
+import json
+import platform
+import time
+
+import torch
+
+from ofa.utils import val2list, get_net_device
+
+__all__ = ['LATENCY_TABLE_VERSION', 'measure_latency', 'build_aanet_latency_table', 'AANetLatencyTable']
+
+# bump when the keys or the meaning of the measurements change, old tables are then rejected
+LATENCY_TABLE_VERSION = 1
+
+
+def conv_out_size(in_size, stride):
+    # all convs of the feature blocks use 'same' padding
+    return (in_size - 1) // stride + 1
+
+
+def repr_shape(shape):
+    return 'x'.join(str(_) for _ in shape)
+
+
+def block_key(input_shape, output_shape, expand, ks, stride):
+    return '-'.join([
+        'mbconv',
+        'input:%s' % repr_shape(input_shape),
+        'output:%s' % repr_shape(output_shape),
+        'expand:%d' % expand,
+        'kernel:%d' % ks,
+        'stride:%d' % stride,
+    ])
+
+
+def tail_key(l_type, image_size, scale=None):
+    """Key of the stages after feature extraction: `cost_volume`, `aggregation` and `refinement`"""
+    infos = [l_type, 'input:%s' % repr_shape(image_size)]
+    if scale is not None:
+        infos.append('scale:%d' % scale)
+    return '-'.join(infos)
+
+
+def measure_latency(fn, warmup=2, repeat=10):
+    """Median wall time of fn() in ms"""
+    sync = torch.cuda.synchronize if torch.cuda.is_available() else (lambda: None)
+    times = []
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn()
+        for _ in range(repeat):
+            sync()
+            start = time.time()
+            fn()
+            sync()
+            times.append((time.time() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def build_aanet_latency_table(net, resolutions, batch_size=1, warmup=2, repeat=10, logger=None):
+    """Profile an OFAAANet on the current host
+
+    Every feature block is measured for each kernel size x expand ratio at the input shape it sees
+    at each resolution, the first block of a stage (strided) and the repeated stride 1 block
+    separately. The cost volume, aggregation + disparity estimation and refinement are measured per
+    resolution and active scale. The active subnet of `net` is restored afterwards.
+
+    Args:
+        net: OFAAANet
+        resolutions: list of (H, W) input image sizes
+    Returns:
+        lut: dict, see `AANetLatencyTable`
+    """
+    device = get_net_device(net)
+    was_training = net.training
+    active_settings = [(block.conv.active_kernel_size, block.conv.active_expand_ratio) for block in net.feature_blocks]
+    runtime_depth = list(net.runtime_depth)
+    active_scale = net.active_scale
+    net.eval()
+
+    latency = {}
+    stages = []
+    for stage_id, block_idx in enumerate(net.fea_block_group_info):
+        stages.append({
+            'width': net.feature_blocks[block_idx[0]].conv.active_out_channel,
+            'stride': net.feature_blocks[block_idx[0]].conv.stride,
+            'n_block': len(block_idx),
+        })
+
+    for h, w in resolutions:
+        # feature blocks
+        in_h, in_w, in_c = h, w, 3
+        for stage, block_idx in zip(stages, net.fea_block_group_info):
+            for i, idx in enumerate(block_idx[:2]):
+                stride = stage['stride'] if i == 0 else 1
+                out_h, out_w = conv_out_size(in_h, stride), conv_out_size(in_w, stride)
+                block = net.feature_blocks[idx]
+                x = torch.randn(batch_size, in_c, in_h, in_w, device=device)
+                for ks in net.ks_list:
+                    for e in net.expand_ratio_list:
+                        key = block_key((in_h, in_w, in_c), (out_h, out_w, stage['width']), e, ks, stride)
+                        if key in latency:
+                            continue
+                        block.conv.active_kernel_size = ks
+                        block.conv.active_expand_ratio = e
+                        latency[key] = measure_latency(lambda: block(x), warmup, repeat)
+                in_h, in_w, in_c = out_h, out_w, stage['width']
+
+        # cost volume, aggregation and refinement, on the largest feature blocks of each scale
+        net.set_active_subnet(ks=max(net.ks_list), e=max(net.expand_ratio_list), d=max(net.depth_list))
+        left = torch.randn(batch_size, 3, h, w, device=device)
+        right = torch.randn(batch_size, 3, h, w, device=device)
+        for s in net.scale_list:
+            net.active_scale = s
+            with torch.no_grad():
+                left_feature, right_feature = net.feature_extraction(left), net.feature_extraction(right)
+                cost_volume = net.cost_volume_construction(left_feature, right_feature)
+            net.aggregation.set_active_scale(s)
+
+            latency[tail_key('cost_volume', (h, w), s)] = measure_latency(
+                lambda: net.cost_volume_construction(left_feature, right_feature), warmup, repeat)
+            latency[tail_key('aggregation', (h, w), s)] = measure_latency(
+                lambda: net.disparity_computation(net.aggregation(cost_volume)), warmup, repeat)
+
+        # refinement starts from the H/3 disparity, whatever the scale
+        with torch.no_grad():
+            disparity = net.disparity_computation(net.aggregation(cost_volume))[-1]
+        latency[tail_key('refinement', (h, w))] = measure_latency(
+            lambda: net.disparity_refinement(left, right, disparity), warmup, repeat)
+
+        if logger is not None:
+            logger('profiled %dx%d, %d entries' % (h, w, len(latency)))
+
+    for block, (ks, e) in zip(net.feature_blocks, active_settings):
+        block.conv.active_kernel_size = ks
+        block.conv.active_expand_ratio = e
+    net.runtime_depth = runtime_depth
+    net.active_scale = active_scale
+    net.aggregation.set_active_scale(active_scale)
+    net.train(was_training)
+
+    return {
+        'version': LATENCY_TABLE_VERSION,
+        'meta': {
+            'host': platform.node(),
+            'processor': platform.processor(),
+            'torch': torch.__version__,
+            'num_threads': torch.get_num_threads(),
+            'device': str(device),
+            'batch_size': batch_size,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'ks_list': net.ks_list,
+        'expand_ratio_list': net.expand_ratio_list,
+        'depth_list': net.depth_list,
+        'scale_list': net.scale_list,
+        'stages': stages,
+        'resolutions': [[h, w] for h, w in resolutions],
+        'latency': latency,
+    }
+
+
+class AANetLatencyTable(object):
+    """Latency lookup table of OFAAANet subnets, in ms for the batch size it was built with
+
+    Feature extraction is counted twice, once per view.
+    """
+
+    def __init__(self, fname=None, lut=None):
+        if lut is None:
+            with open(fname, 'r') as fp:
+                lut = json.load(fp)
+        if lut.get('version') != LATENCY_TABLE_VERSION:
+            raise ValueError('latency table version %s, expected %d, rebuild it' %
+                             (lut.get('version'), LATENCY_TABLE_VERSION))
+        self.lut = lut
+        self.latency = lut['latency']
+        self.stages = lut['stages']
+        self.resolutions = [tuple(r) for r in lut['resolutions']]
+        self.num_blocks = sum(stage['n_block'] for stage in self.stages)
+
+    def save(self, fname):
+        with open(fname, 'w') as fp:
+            json.dump(self.lut, fp, indent=4)
+
+    def nearest_resolution(self, h, w):
+        """Profiled resolution to use for (h, w), exact if profiled, else the closest in pixel count"""
+        if (h, w) in self.resolutions:
+            return h, w
+        return min(self.resolutions, key=lambda r: abs(r[0] * r[1] - h * w))
+
+    def predict_latency(self, ks, e, d, s, h, w):
+        """Predicted latency of the subnet in ms
+
+        Args:
+            ks, e: int or one value per feature block, as in `OFAAANet.set_active_subnet`
+            d: int or one value per stage
+            s: active scale
+            h, w: input image size, resolutions that were not profiled are scaled from the closest
+                profiled one by the pixel count
+        """
+        ph, pw = self.nearest_resolution(h, w)
+        ks = val2list(ks, self.num_blocks)
+        e = val2list(e, self.num_blocks)
+        d = val2list(d, len(self.stages))
+
+        latency = 0
+        in_h, in_w, in_c = ph, pw, 3
+        block_offset = 0
+        for stage_id, stage in enumerate(self.stages[:s]):
+            for i in range(min(d[stage_id], stage['n_block'])):
+                stride = stage['stride'] if i == 0 else 1
+                out_h, out_w = conv_out_size(in_h, stride), conv_out_size(in_w, stride)
+                idx = block_offset + i
+                latency += 2 * self.latency[block_key((in_h, in_w, in_c), (out_h, out_w, stage['width']),
+                                                      e[idx], ks[idx], stride)]
+                in_h, in_w, in_c = out_h, out_w, stage['width']
+            block_offset += stage['n_block']
+
+        latency += self.latency[tail_key('cost_volume', (ph, pw), s)]
+        latency += self.latency[tail_key('aggregation', (ph, pw), s)]
+        latency += self.latency[tail_key('refinement', (ph, pw))]
+
+        if (ph, pw) != (h, w):
+            latency *= float(h * w) / (ph * pw)
+        return latency
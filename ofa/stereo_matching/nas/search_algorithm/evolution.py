@@ -0,0 +1,311 @@
+# Once for All: Train One Network and Specialize it for Efficient Deployment
+# Han Cai, Chuang Gan, Tianzhe Wang, Zhekai Zhang, Song Han
+# International Conference on Learning Representations (ICLR), 2020.
+
+import copy
+import json
+import random
+import multiprocessing
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+
+from ofa.utils import AverageMeter
+from ofa.stereo_matching.elastic_nn.utils import set_running_statistics
+
+__all__ = ['AANetArchManager', 'SubnetEPEEvaluator', 'ParallelEvaluator', 'pareto_front', 'StereoEvolutionFinder']
+
+
+class AANetArchManager(object):
+    """Samples and mutates OFAAANet subnet configs, {'ks': [..], 'e': [..], 'd': [..], 's': int}"""
+
+    def __init__(self, ofa_net):
+        self.ks_list = list(ofa_net.ks_list)
+        self.expand_list = list(ofa_net.expand_ratio_list)
+        self.depth_list = list(ofa_net.depth_list)
+        self.scale_list = list(ofa_net.scale_list)
+        self.num_blocks = len(ofa_net.feature_blocks)
+        self.num_stages = len(ofa_net.fea_block_group_info)
+
+    def random_sample_arch(self):
+        return {
+            'ks': [random.choice(self.ks_list) for _ in range(self.num_blocks)],
+            'e': [random.choice(self.expand_list) for _ in range(self.num_blocks)],
+            'd': [random.choice(self.depth_list) for _ in range(self.num_stages)],
+            's': random.choice(self.scale_list),
+        }
+
+    def mutate_scale(self, sample, mutate_prob):
+        if random.random() < mutate_prob:
+            sample['s'] = random.choice(self.scale_list)
+
+    def mutate_arch(self, sample, mutate_prob):
+        for i in range(self.num_blocks):
+            if random.random() < mutate_prob:
+                sample['ks'][i] = random.choice(self.ks_list)
+            if random.random() < mutate_prob:
+                sample['e'][i] = random.choice(self.expand_list)
+        for i in range(self.num_stages):
+            if random.random() < mutate_prob:
+                sample['d'][i] = random.choice(self.depth_list)
+
+
+class SubnetEPEEvaluator(object):
+    """End-point error of OFAAANet subnets on a small validation subset
+
+    The running statistics of BN of each subnet are re-estimated on `calib_data` before it is
+    evaluated, the shared ones are only right for the largest network.
+
+    Args:
+        ofa_net: OFAAANet with trained weights
+        calib_data: list of samples with 'left' and 'right', e.g. `build_sub_train_loader()`
+        valid_data: list of samples with 'left', 'right' and 'disp'
+    """
+
+    def __init__(self, ofa_net, calib_data, valid_data, max_disp=192, device='cpu'):
+        self.ofa_net = ofa_net
+        self.calib_data = calib_data
+        self.valid_data = valid_data
+        self.max_disp = max_disp
+        self.device = torch.device(device)
+
+    def to(self, device):
+        self.device = torch.device(device)
+        return self
+
+    def evaluate(self, sample):
+        self.ofa_net.set_active_subnet(**sample)
+        subnet = self.ofa_net.get_active_subnet(preserve_weight=True).to(self.device)
+        set_running_statistics(subnet, self.calib_data)
+        subnet.eval()
+
+        epe = AverageMeter()
+        with torch.no_grad():
+            for batch in self.valid_data:
+                left = batch['left'].to(self.device)
+                right = batch['right'].to(self.device)
+                gt_disp = batch['disp'].to(self.device)
+                pred_disp = subnet(left, right)[-1]
+                mask = (gt_disp > 0) & (gt_disp < self.max_disp)
+                if mask.any():
+                    epe.update(F.l1_loss(gt_disp[mask], pred_disp[mask]).item(), left.size(0))
+        if epe.count == 0:
+            # no valid disparity to measure, worst rather than a perfect 0
+            return float('inf')
+        return epe.avg
+
+
+_worker_evaluator = None
+
+
+def _init_worker(evaluator, device_queue, num_threads):
+    global _worker_evaluator
+    torch.set_num_threads(num_threads)
+    if device_queue is not None:
+        evaluator.to(device_queue.get())
+    _worker_evaluator = evaluator
+
+
+def _worker_evaluate(sample):
+    return _worker_evaluator.evaluate(sample)
+
+
+class ParallelEvaluator(object):
+    """Evaluates subnets in worker processes, each holding its own copy of the network and data
+
+    Args:
+        evaluator: object with `evaluate(sample)` (and `to(device)` if devices are given)
+        n_workers: number of processes, 0 evaluates in the current process
+        devices: optional list of devices, handed out to the workers round robin
+        num_threads: torch threads per worker
+    """
+
+    def __init__(self, evaluator, n_workers=0, devices=None, num_threads=1):
+        self.evaluator = evaluator
+        self.n_workers = n_workers
+        self.pool = None
+        if n_workers > 0:
+            # CUDA can not be re-initialized in a forked child
+            use_cuda = devices is not None and any(str(d).startswith('cuda') for d in devices)
+            ctx = multiprocessing.get_context('spawn' if use_cuda else 'fork')
+            device_queue = None
+            if devices is not None:
+                device_queue = ctx.Queue()
+                for i in range(n_workers):
+                    device_queue.put(devices[i % len(devices)])
+            self.pool = ctx.Pool(n_workers, _init_worker, (evaluator, device_queue, num_threads))
+
+    def evaluate_all(self, samples):
+        if self.pool is None:
+            return [self.evaluator.evaluate(sample) for sample in samples]
+        return self.pool.map(_worker_evaluate, samples, chunksize=1)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def pareto_front(records):
+    """Non-dominated (epe, sample, efficiency) records, lower is better for both, sorted by efficiency"""
+    front = []
+    for record in sorted(records, key=lambda x: (x[2], x[0])):
+        if len(front) == 0 or record[0] < front[-1][0]:
+            front.append(record)
+    return front
+
+
+class StereoEvolutionFinder(object):
+    """Evolutionary search of OFAAANet subnets with the lowest EPE under an efficiency constraint
+
+    Unlike `ofa.nas.search_algorithm.EvolutionFinder` the accuracy is measured rather than
+    predicted, so every config is evaluated once and cached, and each generation is evaluated as a
+    batch by `accuracy_evaluator.evaluate_all`. All evaluated subnets are kept for the Pareto front.
+
+    Args:
+        efficiency_predictor: object with `get_efficiency(sample)`, e.g. `AANetLatencyModel`
+        accuracy_evaluator: object with `evaluate_all(samples)` returning EPEs, e.g. `ParallelEvaluator`
+        arch_manager: `AANetArchManager`
+    """
+
+    def __init__(self, efficiency_predictor, accuracy_evaluator, arch_manager, **kwargs):
+        self.efficiency_predictor = efficiency_predictor
+        self.accuracy_evaluator = accuracy_evaluator
+        self.arch_manager = arch_manager
+
+        # evolution hyper-parameters
+        self.arch_mutate_prob = kwargs.get('arch_mutate_prob', 0.1)
+        self.scale_mutate_prob = kwargs.get('scale_mutate_prob', 0.2)
+        self.population_size = kwargs.get('population_size', 16)
+        self.max_time_budget = kwargs.get('max_time_budget', 10)
+        self.parent_ratio = kwargs.get('parent_ratio', 0.25)
+        self.mutation_ratio = kwargs.get('mutation_ratio', 0.5)
+        self.max_trials = kwargs.get('max_trials', 10000)
+
+        # config key -> (epe, sample, efficiency)
+        self.history = {}
+
+    def update_hyper_params(self, new_param_dict):
+        self.__dict__.update(new_param_dict)
+
+    @staticmethod
+    def sample_key(sample):
+        return json.dumps(sample, sort_keys=True)
+
+    def _valid(self, new_sample_fn, constraint):
+        for _ in range(self.max_trials):
+            sample = new_sample_fn()
+            efficiency = self.efficiency_predictor.get_efficiency(sample)
+            if efficiency <= constraint:
+                return sample, efficiency
+        raise ValueError('no subnet found under the constraint %s in %d trials' % (constraint, self.max_trials))
+
+    def random_valid_sample(self, constraint):
+        return self._valid(self.arch_manager.random_sample_arch, constraint)
+
+    def mutate_sample(self, sample, constraint):
+        def new_sample_fn():
+            new_sample = copy.deepcopy(sample)
+            self.arch_manager.mutate_scale(new_sample, self.scale_mutate_prob)
+            self.arch_manager.mutate_arch(new_sample, self.arch_mutate_prob)
+            return new_sample
+        return self._valid(new_sample_fn, constraint)
+
+    def crossover_sample(self, sample1, sample2, constraint):
+        def new_sample_fn():
+            new_sample = copy.deepcopy(sample1)
+            for key in new_sample.keys():
+                if not isinstance(new_sample[key], list):
+                    new_sample[key] = random.choice([sample1[key], sample2[key]])
+                else:
+                    for i in range(len(new_sample[key])):
+                        new_sample[key][i] = random.choice([sample1[key][i], sample2[key][i]])
+            return new_sample
+        return self._valid(new_sample_fn, constraint)
+
+    def evaluate(self, samples, efficiencies):
+        """(epe, sample, efficiency) of each sample, only configs not seen before are evaluated"""
+        keys = [self.sample_key(sample) for sample in samples]
+        new_keys, new_samples = [], []
+        for key, sample in zip(keys, samples):
+            if key not in self.history and key not in new_keys:
+                new_keys.append(key)
+                new_samples.append(sample)
+        if len(new_samples) > 0:
+            epes = self.accuracy_evaluator.evaluate_all(new_samples)
+            for key, sample, epe in zip(new_keys, new_samples, epes):
+                self.history[key] = (epe, sample, self.efficiency_predictor.get_efficiency(sample))
+        return [(self.history[key][0], sample, efficiency)
+                for key, sample, efficiency in zip(keys, samples, efficiencies)]
+
+    def pareto_front(self):
+        return pareto_front(list(self.history.values()))
+
+    def run_evolution_search(self, constraint, verbose=False, **kwargs):
+        """Run a single roll-out of regularized evolution to a fixed time budget
+
+        Returns:
+            best_valids: best EPE after each generation
+            best_info: (epe, sample, efficiency) of the best subnet
+            front: Pareto front of all subnets evaluated under this constraint
+        """
+        self.update_hyper_params(kwargs)
+
+        mutation_numbers = int(round(self.mutation_ratio * self.population_size))
+        parents_size = max(int(round(self.parent_ratio * self.population_size)), 1)
+
+        best_valids = [float('inf')]
+        best_info = None
+        if verbose:
+            print('Generate random population...')
+        child_pool, efficiency_pool = [], []
+        for _ in range(self.population_size):
+            sample, efficiency = self.random_valid_sample(constraint)
+            child_pool.append(sample)
+            efficiency_pool.append(efficiency)
+        population = self.evaluate(child_pool, efficiency_pool)
+
+        if verbose:
+            print('Start Evolution...')
+        with tqdm(total=self.max_time_budget, desc='Searching with constraint (%s)' % constraint,
+                  disable=(not verbose)) as t:
+            for i in range(self.max_time_budget):
+                parents = sorted(population, key=lambda x: x[0])[:parents_size]
+                epe = parents[0][0]
+                t.set_postfix({'epe': epe})
+
+                if epe < best_valids[-1]:
+                    best_valids.append(epe)
+                    best_info = parents[0]
+                else:
+                    best_valids.append(best_valids[-1])
+
+                population = parents
+                child_pool, efficiency_pool = [], []
+                for j in range(mutation_numbers):
+                    par_sample = population[np.random.randint(parents_size)][1]
+                    new_sample, efficiency = self.mutate_sample(par_sample, constraint)
+                    child_pool.append(new_sample)
+                    efficiency_pool.append(efficiency)
+
+                for j in range(self.population_size - mutation_numbers):
+                    par_sample1 = population[np.random.randint(parents_size)][1]
+                    par_sample2 = population[np.random.randint(parents_size)][1]
+                    new_sample, efficiency = self.crossover_sample(par_sample1, par_sample2, constraint)
+                    child_pool.append(new_sample)
+                    efficiency_pool.append(efficiency)
+
+                population += self.evaluate(child_pool, efficiency_pool)
+                t.update(1)
+
+        parents = sorted(population, key=lambda x: x[0])
+        if parents[0][0] < best_valids[-1] or best_info is None:
+            # None if every subnet scored inf (no valid disparity), the best is then any of them
+            best_valids.append(parents[0][0])
+            best_info = parents[0]
+
+        front = pareto_front([record for record in self.history.values() if record[2] <= constraint])
+        return best_valids, best_info, front
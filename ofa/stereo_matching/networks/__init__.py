@@ -6,6 +6,7 @@ from .proxyless_nets import *
 from .mobilenet_v3 import *
 from .resnets import *
 from .aanet import *
+from .freeze import *
 
 
 def get_net_by_name(name):
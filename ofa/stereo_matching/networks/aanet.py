@@ -31,7 +31,9 @@ class AANet(MyNetwork):
                  refinement_type='stereodrnet',
                  no_intermediate_supervision=False,
                  num_stage_blocks=1,
-                 num_deform_blocks=3):
+                 num_deform_blocks=3,
+                 siamese_batching=False,
+                 siamese_joint_bn=False):
         super(AANet, self).__init__()
 
         self.refinement_type = refinement_type
@@ -42,6 +44,10 @@ class AANet(MyNetwork):
         self.aggregation_type = aggregation_type
         self.num_scales = num_scales
         self.active_scale = self.num_scales
+        # run left and right images through the feature extractor as one batch
+        self.siamese_batching = siamese_batching
+        # also batch them while BN uses batch statistics, which are then shared by both views
+        self.siamese_joint_bn = siamese_joint_bn
 
         # Feature extractor
         if feature_type == 'stereonet':
@@ -189,6 +195,33 @@ class AANet(MyNetwork):
                 feature = self.fpn(feature)
         return features
 
+    def bn_batch_statistics(self):
+        """Whether a BN layer of the feature extractor normalizes with batch statistics"""
+        for m in self.feature_extractor.modules():
+            if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training:
+                return True
+        return False
+
+    def use_siamese_batching(self):
+        # separate passes keep per-view BN statistics
+        return self.siamese_batching and (self.siamese_joint_bn or not self.bn_batch_statistics())
+
+    def siamese_feature_extraction(self, left_img, right_img, images=None):
+        """Feature of both views
+        Args:
+            images: left and right images concatenated along the batch dimension, built here if None
+        """
+        if not self.use_siamese_batching():
+            return self.feature_extraction(left_img), self.feature_extraction(right_img)
+
+        b = left_img.size(0)
+        if images is None:
+            images = torch.cat((left_img, right_img), dim=0)
+        feature = self.feature_extraction(images)
+        if isinstance(feature, (list, tuple)):
+            return [f[:b] for f in feature], [f[b:] for f in feature]
+        return feature[:b], feature[b:]
+
     def cost_volume_construction(self, left_feature, right_feature):
         cost_volume = self.cost_volume(left_feature, right_feature)
 
@@ -212,59 +245,58 @@ class AANet(MyNetwork):
 
         return disparity_pyramid
 
-    def disparity_refinement(self, left_img, right_img, disparity):
+    def image_pyramid(self, left_img, right_img, images=None):
+        """Left and right images at the scale of every refinement stage, computed once per forward
+        Args:
+            images: left and right images concatenated along the batch dimension, if available both views
+                are resized in one call
+        Returns:
+            pyramid: list of (left_img, right_img), [H/2, H]
+        """
+        pyramid = []
+        for i in range(self.num_downsample):
+            scale_factor = 1. / pow(2, self.num_downsample - i - 1)
+            if scale_factor == 1.0:
+                pyramid.append((left_img, right_img))
+            elif images is not None:
+                resized = F.interpolate(images, scale_factor=scale_factor, mode='bilinear', align_corners=False)
+                pyramid.append((resized[:left_img.size(0)], resized[left_img.size(0):]))
+            else:
+                pyramid.append((F.interpolate(left_img, scale_factor=scale_factor,
+                                              mode='bilinear', align_corners=False),
+                                F.interpolate(right_img, scale_factor=scale_factor,
+                                              mode='bilinear', align_corners=False)))
+        return pyramid
+
+    def disparity_refinement(self, left_img, right_img, disparity, image_pyramid=None):
         disparity_pyramid = []
         if self.refinement_type is not None and self.refinement_type != 'None':
-            if self.refinement_type == 'stereonet':
-                for i in range(self.num_downsample):
-                    # Hierarchical refinement
-                    scale_factor = 1. / pow(2, self.num_downsample - i - 1)
-                    if scale_factor == 1.0:
-                        curr_left_img = left_img
-                        curr_right_img = right_img
-                    else:
-                        curr_left_img = F.interpolate(left_img,
-                                                      scale_factor=scale_factor,
-                                                      mode='bilinear', align_corners=False)
-                        curr_right_img = F.interpolate(right_img,
-                                                       scale_factor=scale_factor,
-                                                       mode='bilinear', align_corners=False)
-                    inputs = (disparity, curr_left_img, curr_right_img)
-                    disparity = self.refinement[i](*inputs)
-                    disparity_pyramid.append(disparity)  # [H/2, H]
-
-            elif self.refinement_type in ['stereodrnet', 'hourglass']:
-                for i in range(self.num_downsample):
-                    scale_factor = 1. / pow(2, self.num_downsample - i - 1)
-
-                    if scale_factor == 1.0:
-                        curr_left_img = left_img
-                        curr_right_img = right_img
-                    else:
-                        curr_left_img = F.interpolate(left_img,
-                                                      scale_factor=scale_factor,
-                                                      mode='bilinear', align_corners=False)
-                        curr_right_img = F.interpolate(right_img,
-                                                       scale_factor=scale_factor,
-                                                       mode='bilinear', align_corners=False)
-                    inputs = (disparity, curr_left_img, curr_right_img)
-                    disparity = self.refinement[i](*inputs)
-                    disparity_pyramid.append(disparity)  # [H/2, H]
-
-            else:
+            if self.refinement_type not in ['stereonet', 'stereodrnet', 'hourglass']:
                 raise NotImplementedError
 
+            if image_pyramid is None:
+                image_pyramid = self.image_pyramid(left_img, right_img)
+
+            # Hierarchical refinement
+            for i in range(self.num_downsample):
+                curr_left_img, curr_right_img = image_pyramid[i]
+                inputs = (disparity, curr_left_img, curr_right_img)
+                disparity = self.refinement[i](*inputs)
+                disparity_pyramid.append(disparity)  # [H/2, H]
+
         return disparity_pyramid
 
     def forward(self, left_img, right_img):
-        left_feature = self.feature_extraction(left_img)
-        right_feature = self.feature_extraction(right_img)
+        # both views in one batch, shared by feature extraction and the refinement image pyramid
+        images = torch.cat((left_img, right_img), dim=0) if self.use_siamese_batching() else None
+        left_feature, right_feature = self.siamese_feature_extraction(left_img, right_img, images)
         cost_volume = self.cost_volume_construction(left_feature, right_feature)
         self.aggregation.set_active_scale(self.active_scale)
         aggregation = self.aggregation(cost_volume)
         disparity_pyramid = self.disparity_computation(aggregation)
+        image_pyramid = self.image_pyramid(left_img, right_img, images)
         disparity_pyramid += self.disparity_refinement(left_img, right_img,
-                                                       disparity_pyramid[-1])
+                                                       disparity_pyramid[-1], image_pyramid)
 
         return disparity_pyramid
 
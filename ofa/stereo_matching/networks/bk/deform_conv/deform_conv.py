@@ -6,7 +6,18 @@ from torch.autograd import Function
 from torch.autograd.function import once_differentiable
 from torch.nn.modules.utils import _pair, _single
 
-from . import deform_conv_cuda
+from .deform_conv_cpu import deform_conv_cpu_backward, deform_conv_cpu_forward
+
+deform_conv_cuda = None
+
+
+def _load_deform_conv_cuda():
+    """Import the compiled extension on first use, so that the CPU path works without the .so"""
+    global deform_conv_cuda
+    if deform_conv_cuda is None:
+        from . import deform_conv_cuda as ext
+        deform_conv_cuda = ext
+    return deform_conv_cuda
 
 
 class DeformConvFunction(Function):
@@ -35,15 +46,18 @@ class DeformConvFunction(Function):
 
         ctx.save_for_backward(input, offset, weight)
 
-        output = input.new_empty(
-            DeformConvFunction._output_size(input, weight, ctx.padding,
-                                            ctx.dilation, ctx.stride))
-
-        ctx.bufs_ = [input.new_empty(0), input.new_empty(0)]  # columns, ones
+        output_size = DeformConvFunction._output_size(input, weight, ctx.padding,
+                                                      ctx.dilation, ctx.stride)
 
         if not input.is_cuda:
-            raise NotImplementedError
+            output = deform_conv_cpu_forward(
+                input, offset, None, weight, None, ctx.stride, ctx.padding,
+                ctx.dilation, ctx.groups, ctx.deformable_groups,
+                ctx.im2col_step)
         else:
+            _load_deform_conv_cuda()
+            output = input.new_empty(output_size)
+            ctx.bufs_ = [input.new_empty(0), input.new_empty(0)]  # columns, ones
             cur_im2col_step = min(ctx.im2col_step, input.shape[0])
             assert (input.shape[0] %
                     cur_im2col_step) == 0, 'im2col step must divide batchsize'
@@ -63,7 +77,11 @@ class DeformConvFunction(Function):
         grad_input = grad_offset = grad_weight = None
 
         if not grad_output.is_cuda:
-            raise NotImplementedError
+            needs_input_grad = ctx.needs_input_grad[:2] + (False,) + ctx.needs_input_grad[2:3] + (False,)
+            grad_input, grad_offset, _, grad_weight, _ = deform_conv_cpu_backward(
+                grad_output, input, offset, None, weight, None, ctx.stride,
+                ctx.padding, ctx.dilation, ctx.groups, ctx.deformable_groups,
+                ctx.im2col_step, needs_input_grad)
         else:
             cur_im2col_step = min(ctx.im2col_step, input.shape[0])
             assert (input.shape[0] %
@@ -91,7 +109,7 @@ class DeformConvFunction(Function):
                     cur_im2col_step)
 
         return (grad_input, grad_offset, grad_weight, None, None, None, None,
-                None)
+                None, None)
 
     @staticmethod
     def _output_size(input, weight, padding, dilation, stride):
@@ -123,17 +141,26 @@ class ModulatedDeformConvFunction(Function):
                 padding=0,
                 dilation=1,
                 groups=1,
-                deformable_groups=1):
+                deformable_groups=1,
+                im2col_step=64):
         ctx.stride = stride
         ctx.padding = padding
         ctx.dilation = dilation
         ctx.groups = groups
         ctx.deformable_groups = deformable_groups
+        ctx.im2col_step = im2col_step
         ctx.with_bias = bias is not None
+        if not input.is_cuda:
+            if weight.requires_grad or mask.requires_grad or offset.requires_grad \
+                    or input.requires_grad:
+                ctx.save_for_backward(input, offset, mask, weight, bias)
+            return deform_conv_cpu_forward(
+                input, offset, mask, weight, bias, _pair(ctx.stride),
+                _pair(ctx.padding), _pair(ctx.dilation), ctx.groups,
+                ctx.deformable_groups, ctx.im2col_step)
+        _load_deform_conv_cuda()
         if not ctx.with_bias:
             bias = input.new_empty(1)  # fake tensor
-        if not input.is_cuda:
-            raise NotImplementedError
         if weight.requires_grad or mask.requires_grad or offset.requires_grad \
                 or input.requires_grad:
             ctx.save_for_backward(input, offset, mask, weight, bias)
@@ -150,9 +177,14 @@ class ModulatedDeformConvFunction(Function):
     @staticmethod
     @once_differentiable
     def backward(ctx, grad_output):
-        if not grad_output.is_cuda:
-            raise NotImplementedError
         input, offset, mask, weight, bias = ctx.saved_tensors
+        if not grad_output.is_cuda:
+            grads = deform_conv_cpu_backward(
+                grad_output, input, offset, mask, weight, bias,
+                _pair(ctx.stride), _pair(ctx.padding), _pair(ctx.dilation),
+                ctx.groups, ctx.deformable_groups, ctx.im2col_step,
+                ctx.needs_input_grad[:5])
+            return grads + (None, None, None, None, None, None)
         grad_input = torch.zeros_like(input)
         grad_offset = torch.zeros_like(offset)
         grad_mask = torch.zeros_like(mask)
@@ -168,7 +200,7 @@ class ModulatedDeformConvFunction(Function):
             grad_bias = None
 
         return (grad_input, grad_offset, grad_mask, grad_weight, grad_bias,
-                None, None, None, None, None)
+                None, None, None, None, None, None)
 
     @staticmethod
     def _infer_shape(ctx, input, weight):
@@ -198,7 +230,8 @@ class DeformConv(nn.Module):
                  dilation=1,
                  groups=1,
                  deformable_groups=1,
-                 bias=False):
+                 bias=False,
+                 im2col_step=64):
         super(DeformConv, self).__init__()
 
         assert not bias
@@ -217,6 +250,8 @@ class DeformConv(nn.Module):
         self.dilation = _pair(dilation)
         self.groups = groups
         self.deformable_groups = deformable_groups
+        # samples per im2col pass, bounds the memory of the sampled columns
+        self.im2col_step = im2col_step
         # enable compatibility with nn.Conv2d
         self.transposed = False
         self.output_padding = _single(0)
@@ -236,7 +271,8 @@ class DeformConv(nn.Module):
 
     def forward(self, x, offset):
         return deform_conv(x, offset, self.weight, self.stride, self.padding,
-                           self.dilation, self.groups, self.deformable_groups)
+                           self.dilation, self.groups, self.deformable_groups,
+                           self.im2col_step)
 
 
 class DeformConvPack(DeformConv):
@@ -277,7 +313,8 @@ class DeformConvPack(DeformConv):
     def forward(self, x):
         offset = self.conv_offset(x)
         return deform_conv(x, offset, self.weight, self.stride, self.padding,
-                           self.dilation, self.groups, self.deformable_groups)
+                           self.dilation, self.groups, self.deformable_groups,
+                           self.im2col_step)
 
     def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
                               missing_keys, unexpected_keys, error_msgs):
@@ -312,7 +349,8 @@ class ModulatedDeformConv(nn.Module):
                  dilation=1,
                  groups=1,
                  deformable_groups=1,
-                 bias=True):
+                 bias=True,
+                 im2col_step=64):
         super(ModulatedDeformConv, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -323,6 +361,8 @@ class ModulatedDeformConv(nn.Module):
         self.groups = groups
         self.deformable_groups = deformable_groups
         self.with_bias = bias
+        # samples per im2col pass of the CPU path
+        self.im2col_step = im2col_step
         # enable compatibility with nn.Conv2d
         self.transposed = False
         self.output_padding = _single(0)
@@ -348,7 +388,8 @@ class ModulatedDeformConv(nn.Module):
     def forward(self, x, offset, mask):
         return modulated_deform_conv(x, offset, mask, self.weight, self.bias,
                                      self.stride, self.padding, self.dilation,
-                                     self.groups, self.deformable_groups)
+                                     self.groups, self.deformable_groups,
+                                     self.im2col_step)
 
 
 class ModulatedDeformConvPack(ModulatedDeformConv):
@@ -393,7 +434,8 @@ class ModulatedDeformConvPack(ModulatedDeformConv):
         mask = torch.sigmoid(mask)
         return modulated_deform_conv(x, offset, mask, self.weight, self.bias,
                                      self.stride, self.padding, self.dilation,
-                                     self.groups, self.deformable_groups)
+                                     self.groups, self.deformable_groups,
+                                     self.im2col_step)
 
     def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
                               missing_keys, unexpected_keys, error_msgs):
@@ -0,0 +1,120 @@
+import torch
+import torch.nn.functional as F
+
+__all__ = ['deform_im2col', 'deform_conv_cpu_forward', 'deform_conv_cpu_backward']
+
+
+def deform_im2col(input, offset, mask, kernel_size, stride, padding, dilation, deformable_groups):
+    """Bilinearly sample the deformed kernel taps of every output pixel
+
+    Same sampling as `deformable_im2col_bilinear` in the CUDA kernel: a tap is the bilinear
+    interpolation of its 4 neighbouring pixels, where neighbours outside the image count as 0,
+    which is grid_sample with zero padding.
+
+    Args:
+        input: [N, C, H, W]
+        offset: [N, deformable_groups * 2 * kh * kw, Ho, Wo], (dy, dx) per kernel tap
+        mask: [N, deformable_groups * kh * kw, Ho, Wo] or None
+    Returns:
+        columns: [N, C * kh * kw, Ho * Wo], channel major as in the weight layout
+    """
+    n, c, h, w = input.size()
+    kh, kw = kernel_size
+    ho, wo = offset.size(2), offset.size(3)
+    k = kh * kw
+
+    # undeformed sampling position of every tap, [K, Ho, Wo]
+    base_y = (torch.arange(kh, device=input.device, dtype=input.dtype) * dilation[0]).view(kh, 1, 1, 1) + \
+        (torch.arange(ho, device=input.device, dtype=input.dtype) * stride[0] - padding[0]).view(1, 1, ho, 1)
+    base_x = (torch.arange(kw, device=input.device, dtype=input.dtype) * dilation[1]).view(1, kw, 1, 1) + \
+        (torch.arange(wo, device=input.device, dtype=input.dtype) * stride[1] - padding[1]).view(1, 1, 1, wo)
+    base_y = base_y.expand(kh, kw, ho, wo).reshape(k, ho, wo)
+    base_x = base_x.expand(kh, kw, ho, wo).reshape(k, ho, wo)
+
+    offset = offset.reshape(n * deformable_groups, k, 2, ho, wo)
+    # pixel coordinates to the [-1, 1] range of grid_sample with align_corners=False
+    grid_x = (base_x + offset[:, :, 1]) * (2. / w) + (1. / w - 1)
+    grid_y = (base_y + offset[:, :, 0]) * (2. / h) + (1. / h - 1)
+    grid = torch.stack((grid_x, grid_y), dim=-1).view(n * deformable_groups, k * ho, wo, 2)
+
+    columns = F.grid_sample(input.reshape(n * deformable_groups, c // deformable_groups, h, w), grid,
+                            mode='bilinear', padding_mode='zeros', align_corners=False)
+    columns = columns.view(n, deformable_groups, c // deformable_groups, k, ho * wo)
+    if mask is not None:
+        columns = columns * mask.view(n, deformable_groups, 1, k, ho * wo)
+    return columns.view(n, c * k, ho * wo)
+
+
+def _forward(input, offset, mask, weight, bias, stride, padding, dilation, groups, deformable_groups):
+    n, c = input.size(0), input.size(1)
+    out_channels = weight.size(0)
+    ho, wo = offset.size(2), offset.size(3)
+
+    columns = deform_im2col(input, offset, mask, weight.shape[2:4], stride, padding, dilation, deformable_groups)
+    columns = columns.view(n, groups, -1, ho * wo)
+    weight = weight.view(groups, out_channels // groups, -1)
+    output = torch.matmul(weight, columns)  # [N, g, O / g, L]
+    output = output.view(n, out_channels, ho, wo)
+    if bias is not None:
+        output = output + bias.view(1, out_channels, 1, 1)
+    return output
+
+
+def deform_conv_cpu_forward(input, offset, mask, weight, bias, stride, padding, dilation, groups,
+                            deformable_groups, im2col_step):
+    """(Modulated) deformable convolution with plain tensor ops, im2col_step samples at a time
+
+    The sampled columns are kernel_size times larger than the input, im2col_step bounds how
+    many samples have theirs alive at once.
+    """
+    output = []
+    for start in range(0, input.size(0), im2col_step):
+        end = start + im2col_step
+        output.append(_forward(input[start:end], offset[start:end], None if mask is None else mask[start:end],
+                               weight, bias, stride, padding, dilation, groups, deformable_groups))
+    return torch.cat(output, dim=0)
+
+
+def deform_conv_cpu_backward(grad_output, input, offset, mask, weight, bias, stride, padding, dilation, groups,
+                             deformable_groups, im2col_step, needs_input_grad):
+    """Gradients of `deform_conv_cpu_forward`, recomputing each chunk of im2col_step samples
+
+    Args:
+        needs_input_grad: flags for (input, offset, mask, weight, bias)
+    Returns:
+        grads: (grad_input, grad_offset, grad_mask, grad_weight, grad_bias), None where not needed
+    """
+    weight = weight.detach().requires_grad_(needs_input_grad[3])
+    if bias is not None:
+        bias = bias.detach().requires_grad_(needs_input_grad[4])
+
+    grad_input, grad_offset, grad_mask = [], [], []
+    grad_weight = grad_bias = None
+    for start in range(0, input.size(0), im2col_step):
+        end = start + im2col_step
+        chunk = [input[start:end].detach().requires_grad_(needs_input_grad[0]),
+                 offset[start:end].detach().requires_grad_(needs_input_grad[1]),
+                 None if mask is None else mask[start:end].detach().requires_grad_(needs_input_grad[2])]
+        params = [t for t, needed in zip(chunk + [weight, bias], needs_input_grad) if t is not None and needed]
+        with torch.enable_grad():
+            output = _forward(chunk[0], chunk[1], chunk[2], weight, bias, stride, padding, dilation, groups,
+                              deformable_groups)
+        grads = list(torch.autograd.grad(output, params, grad_output[start:end]))
+
+        if needs_input_grad[0]:
+            grad_input.append(grads.pop(0))
+        if needs_input_grad[1]:
+            grad_offset.append(grads.pop(0))
+        if needs_input_grad[2] and mask is not None:
+            grad_mask.append(grads.pop(0))
+        if needs_input_grad[3]:
+            g = grads.pop(0)
+            grad_weight = g if grad_weight is None else grad_weight + g
+        if needs_input_grad[4] and bias is not None:
+            g = grads.pop(0)
+            grad_bias = g if grad_bias is None else grad_bias + g
+
+    return (torch.cat(grad_input, dim=0) if grad_input else None,
+            torch.cat(grad_offset, dim=0) if grad_offset else None,
+            torch.cat(grad_mask, dim=0) if grad_mask else None,
+            grad_weight, grad_bias)
@@ -1,22 +1,36 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class CostVolume(nn.Module):
-    def __init__(self, max_disp, feature_similarity='correlation'):
+    def __init__(self, max_disp, feature_similarity='correlation', vectorized=True):
         """Construct cost volume based on different
         similarity measures
 
         Args:
             max_disp: max disparity candidate
             feature_similarity: type of similarity measure
+            vectorized: build the correlation volume with one batched matmul
+                instead of one slice per disparity candidate
         """
         super(CostVolume, self).__init__()
 
         self.max_disp = max_disp
         self.feature_similarity = feature_similarity
+        self.vectorized = vectorized
 
     def forward(self, left_feature, right_feature):
+        if self.vectorized:
+            cost_volume = self.vectorized_forward(left_feature, right_feature)
+        else:
+            cost_volume = self.loop_forward(left_feature, right_feature)
+
+        cost_volume = cost_volume.contiguous()  # [B, C, D, H, W] or [B, D, H, W]
+
+        return cost_volume
+
+    def loop_forward(self, left_feature, right_feature):
         b, c, h, w = left_feature.size()
 
         if self.feature_similarity == 'difference':
@@ -50,16 +64,54 @@ class CostVolume(nn.Module):
         else:
             raise NotImplementedError
 
-        cost_volume = cost_volume.contiguous()  # [B, C, D, H, W] or [B, D, H, W]
+        return cost_volume
+
+    def correlation(self, left_feature, right_feature):
+        """Correlation volume with one batched matmul
+
+        Columns are split into tiles of T pixels. Each tile of the left feature is multiplied with
+        the T + D - 1 right pixels it can be matched with, and the D diagonals of every
+        [T + D - 1, T] product are read out through a strided view.
+        """
+        b, c, h, w = left_feature.size()
+        tile = min(self.max_disp, w)
+        num_tiles = (w + tile - 1) // tile
+        padded_w = num_tiles * tile
+        span = tile + self.max_disp - 1
+
+        left_tiles = F.pad(left_feature, (0, padded_w - w)).view(b, c, h, num_tiles, tile)
+        left_tiles = left_tiles.permute(0, 2, 3, 1, 4)  # [B, H, N, C, T]
+        right_tiles = F.pad(right_feature, (self.max_disp - 1, padded_w - w)).unfold(3, span, tile)
+        right_tiles = right_tiles.permute(0, 2, 3, 4, 1)  # [B, H, N, T + D - 1, C]
+
+        # product[..., j, i] = right[n * T + j - (D - 1)] . left[n * T + i]
+        product = torch.matmul(right_tiles, left_tiles)  # [B, H, N, T + D - 1, T]
+        # diagonals[..., k, i] = product[..., i + k, i], i.e. disparity D - 1 - k
+        diagonals = product.as_strided((b, h, num_tiles, self.max_disp, tile),
+                                       (h * num_tiles * span * tile, num_tiles * span * tile, span * tile,
+                                        tile, tile + 1),
+                                       product.storage_offset())
+        cost_volume = diagonals.permute(0, 3, 1, 2, 4).flip(1).reshape(b, self.max_disp, h, padded_w)
+        cost_volume = cost_volume[:, :, :, :w] / c  # [B, D, H, W]
 
         return cost_volume
 
+    def vectorized_forward(self, left_feature, right_feature):
+        if self.feature_similarity == 'correlation':
+            # zero padding on the right feature already gives zero cost outside the image
+            return self.correlation(left_feature, right_feature)
+
+        # difference and concat are bound by writing the [B, C, D, H, W] volume itself, which the
+        # loop already does once per element, a bulk broadcast is not faster there
+        return self.loop_forward(left_feature, right_feature)
+
 
 class CostVolumePyramid(nn.Module):
-    def __init__(self, max_disp, feature_similarity='correlation'):
+    def __init__(self, max_disp, feature_similarity='correlation', vectorized=True):
         super(CostVolumePyramid, self).__init__()
         self.max_disp = max_disp
         self.feature_similarity = feature_similarity
+        self.vectorized = vectorized
 
     def forward(self, left_feature_pyramid, right_feature_pyramid):
         num_scales = len(left_feature_pyramid)
@@ -67,7 +119,7 @@ class CostVolumePyramid(nn.Module):
         cost_volume_pyramid = []
         for s in range(num_scales):
             max_disp = self.max_disp // (2 ** s)
-            cost_volume_module = CostVolume(max_disp, self.feature_similarity)
+            cost_volume_module = CostVolume(max_disp, self.feature_similarity, self.vectorized)
             cost_volume = cost_volume_module(left_feature_pyramid[s],
                                              right_feature_pyramid[s])
             cost_volume_pyramid.append(cost_volume)
@@ -0,0 +1,123 @@
+import copy
+import types
+
+import torch
+import torch.nn as nn
+
+from ofa.utils.layers import My2DLayer, LinearLayer
+from ofa.stereo_matching.networks.deform import SimpleBottleneck
+from ofa.stereo_matching.networks.feature import BasicConv
+
+__all__ = ['fold_conv_bn', 'freeze_for_inference']
+
+CONV_TYPES = (nn.Conv2d, nn.Conv3d, nn.ConvTranspose2d, nn.ConvTranspose3d)
+BN_TYPES = (nn.BatchNorm2d, nn.BatchNorm3d)
+# modules that do nothing in eval mode
+IDENTITY_TYPES = (nn.Identity, nn.Dropout, nn.Dropout2d, nn.Dropout3d)
+
+
+def fold_conv_bn(conv, bn):
+    """Fold an eval mode BN into the conv right before it, in place
+
+    Returns:
+        False if the pair can not be folded (BN without running statistics, grouped transposed conv,
+        channel mismatch), the conv is then left untouched
+    """
+    if not bn.track_running_stats or bn.running_mean is None:
+        return False
+    transposed = isinstance(conv, (nn.ConvTranspose2d, nn.ConvTranspose3d))
+    if transposed and conv.groups != 1:
+        return False
+    if conv.out_channels != bn.num_features:
+        return False
+
+    with torch.no_grad():
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        if bn.affine:
+            scale = scale * bn.weight
+        shape = [1] * conv.weight.dim()
+        shape[1 if transposed else 0] = -1
+        conv.weight.mul_(scale.view(shape))
+
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        bias = (bias - bn.running_mean) * scale
+        if bn.affine:
+            bias = bias + bn.bias
+        conv.bias = nn.Parameter(bias)
+    return True
+
+
+def _is_sequential(module):
+    # modules whose forward runs the children in registration order
+    return isinstance(module, (nn.Sequential, My2DLayer, LinearLayer))
+
+
+def _fold_sequential(module):
+    names = list(module._modules.keys())
+    for name, next_name in zip(names[:-1], names[1:]):
+        conv, bn = module._modules[name], module._modules[next_name]
+        if isinstance(conv, CONV_TYPES) and isinstance(bn, BN_TYPES) and fold_conv_bn(conv, bn):
+            module._modules[next_name] = nn.Identity()
+
+    # drop the no-ops, the forward of a sequential module does not refer to them by name
+    for name in names:
+        if isinstance(module._modules[name], IDENTITY_TYPES):
+            del module._modules[name]
+
+
+def _named_conv_bn_pairs(module):
+    """(conv, bn) attribute names of the conv -> BN pairs a non-sequential module applies in its forward"""
+    if isinstance(module, SimpleBottleneck) or type(module).__name__ in ['BasicBlock', 'Bottleneck']:
+        # including torchvision ResNet blocks
+        return [('conv%d' % i, 'bn%d' % i) for i in range(1, 4) if hasattr(module, 'bn%d' % i)]
+    if isinstance(module, BasicConv) and module.use_bn:
+        return [('conv', 'bn')]
+    return []
+
+
+def _fold(module):
+    for child in module.children():
+        _fold(child)
+
+    if _is_sequential(module):
+        _fold_sequential(module)
+        return
+
+    for conv_name, bn_name in _named_conv_bn_pairs(module):
+        conv, bn = getattr(module, conv_name), getattr(module, bn_name)
+        if isinstance(conv, CONV_TYPES) and isinstance(bn, BN_TYPES) and fold_conv_bn(conv, bn):
+            setattr(module, bn_name, nn.Identity())
+    if isinstance(module, BasicConv) and isinstance(module.bn, nn.Identity):
+        module.use_bn = False
+
+
+def _frozen_train(self, mode=True):
+    if mode:
+        raise RuntimeError('%s is frozen for inference, BN is folded into the convs' % type(self).__name__)
+    return nn.Module.train(self, False)
+
+
+def freeze_for_inference(net, inplace=False):
+    """Eval-only copy of a static network (e.g. from `get_active_subnet`) with BN folded into the convs
+
+    Every BN following a 2D / 3D (transposed) conv in a sequential module, a `ConvLayer` /
+    `MBConvLayer` of the OFA subnets or a `SimpleBottleneck` / `BasicConv` / ResNet block is folded
+    into the conv weights and bias, then identity and dropout modules are removed from the
+    sequential modules. The outputs match the eval mode network up to float rounding. BN running
+    statistics must be final before freezing, e.g. after `set_running_statistics`.
+
+    Args:
+        net: nn.Module
+        inplace: modify `net` instead of a copy
+    Returns:
+        the frozen network, `train()` on it raises and parameters do not require grad
+    """
+    if not inplace:
+        net = copy.deepcopy(net)
+    net.eval()
+    _fold(net)
+    for p in net.parameters():
+        p.requires_grad_(False)
+    net.train = types.MethodType(_frozen_train, net)
+    net.frozen = True
+    return net
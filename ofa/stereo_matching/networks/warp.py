@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 import torch
 import torch.nn.functional as F
 
@@ -38,6 +40,33 @@ def meshgrid(img, homogeneous=False):
     return grid
 
 
+# (H, W, dtype, device) -> normalized base grid [1, H, W, 2] and per row coverage [1, 1, H, 1], least
+# recently used first; the sizes of a training run (scales x random crops or eval sizes) fit in GRID_CACHE_SIZE
+GRID_CACHE_SIZE = 64
+_grid_cache = OrderedDict()
+
+
+def cached_base_grid(h, w, dtype, device):
+    """Meshgrid of an H x W image, already normalized as in `normalize_coords`, built once per size
+
+    Also returns how much of the bilinear footprint of each row lies inside the image, which is
+    what sampling a tensor of ones with zero padding gives along y.
+    """
+    key = (h, w, dtype, device)
+    if key in _grid_cache:
+        _grid_cache.move_to_end(key)
+    else:
+        grid = meshgrid(torch.empty(1, 1, h, w, dtype=dtype, device=device)).clone()  # [1, 2, H, W]
+        grid = normalize_coords(grid).contiguous()  # [1, H, W, 2]
+        # pixel coordinate grid_sample (align_corners=False) samples, and its in-image coverage
+        y = ((grid[:, :, :1, 1:] + 1) * h - 1) / 2  # [1, H, 1, 1]
+        row_coverage = torch.min(y + 1, h - y).clamp(0, 1).view(1, 1, h, 1)
+        _grid_cache[key] = (grid, row_coverage)
+        if len(_grid_cache) > GRID_CACHE_SIZE:
+            _grid_cache.popitem(last=False)
+    return _grid_cache[key]
+
+
 def disp_warp(img, disp, padding_mode='border'):
     """Warping by disparity
     Args:
@@ -48,20 +77,18 @@ def disp_warp(img, disp, padding_mode='border'):
         warped_img: [B, 3, H, W]
         valid_mask: [B, 3, H, W]
     """
-    disp[disp < 0] = 0.0
-    disp[torch.isnan(disp)] = 0.0
-    #print(disp.min())
-    assert disp.min() >= 0
-
-    grid = meshgrid(img)  # [B, 2, H, W] in image scale
-    # Note that -disp here
-    offset = torch.cat((-disp, torch.zeros_like(disp)), dim=1)  # [B, 2, H, W]
-    sample_grid = grid + offset
-    sample_grid = normalize_coords(sample_grid)  # [B, H, W, 2] in [-1, 1]
-    warped_img = F.grid_sample(img, sample_grid, mode='bilinear', padding_mode=padding_mode)
-
-    mask = torch.ones_like(img)
-    valid_mask = F.grid_sample(mask, sample_grid, mode='bilinear', padding_mode='zeros')
-    valid_mask[valid_mask < 0.9999] = 0
-    valid_mask[valid_mask > 0] = 1
+    b, _, h, w = img.size()
+    disp = torch.nan_to_num(disp.clamp(min=0), nan=0.0)
+
+    base_grid, row_coverage = cached_base_grid(h, w, img.dtype, img.device)
+    # Note that -disp here, only x is shifted
+    sample_x = base_grid[..., 0] - disp.squeeze(1) * (2. / (w - 1))  # [B, H, W]
+    sample_grid = torch.stack((sample_x, base_grid[..., 1].expand(b, h, w)), dim=-1)  # [B, H, W, 2] in [-1, 1]
+    warped_img = F.grid_sample(img, sample_grid, mode='bilinear', padding_mode=padding_mode,
+                               align_corners=False)
+
+    # same as grid_sample of ones with zero padding, thresholded at 0.9999
+    x = ((sample_x.detach() + 1) * w - 1) / 2
+    coverage = torch.min(x + 1, w - x).clamp(0, 1).unsqueeze(1) * row_coverage  # [B, 1, H, W]
+    valid_mask = (coverage >= 0.9999).type_as(img).expand_as(img)
     return warped_img, valid_mask
@@ -5,3 +5,5 @@
 from .run_config import *
 from .run_manager import *
 from .distributed_run_manager import *
+from .checkpoint import *
+from .metrics import *
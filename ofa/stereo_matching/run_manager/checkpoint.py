@@ -0,0 +1,188 @@
+import atexit
+import os
+import queue
+import re
+import threading
+
+import torch
+
+__all__ = ['snapshot_to_cpu', 'atomic_save', 'atomic_write_text', 'AsyncCheckpointWriter']
+
+
+def snapshot_to_cpu(obj):
+    """Copy every tensor of a (nested) checkpoint to CPU memory, so training can go on modifying the originals
+
+    CUDA tensors are copied into pinned memory without blocking and synchronized once at the end.
+    """
+    has_cuda = [False]
+
+    def copy(x):
+        if torch.is_tensor(x):
+            if x.is_cuda:
+                has_cuda[0] = True
+                out = torch.empty(x.shape, dtype=x.dtype, pin_memory=True)
+                return out.copy_(x.detach(), non_blocking=True)
+            return x.detach().clone()
+        if isinstance(x, dict):
+            return type(x)((k, copy(v)) for k, v in x.items())
+        if isinstance(x, (list, tuple)):
+            return type(x)(copy(v) for v in x)
+        return x
+
+    out = copy(obj)
+    if has_cuda[0]:
+        torch.cuda.synchronize()
+    return out
+
+
+def _tmp_path(path):
+    return '%s.tmp.%d.%d' % (path, os.getpid(), threading.get_ident())
+
+
+def _fsync_dir(path):
+    # make the rename durable, not supported on every platform
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file next to `path`, then rename it over `path`
+
+    Readers see either the previous or the new checkpoint, never a partially written one.
+    """
+    tmp = _tmp_path(path)
+    try:
+        with open(tmp, 'wb') as fp:
+            torch.save(obj, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _fsync_dir(path)
+
+
+def atomic_write_text(path, text):
+    tmp = _tmp_path(path)
+    with open(tmp, 'w') as fp:
+        fp.write(text)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp, path)
+
+
+def _atomic_link(src, dst):
+    tmp = _tmp_path(dst)
+    os.link(src, tmp)
+    os.replace(tmp, dst)
+
+
+class AsyncCheckpointWriter(object):
+    """Writes checkpoints on a background thread, the caller only waits for the CPU snapshot
+
+    Each checkpoint is written atomically (temporary file and rename), then `latest_fname` is updated to
+    point to it. The best copy is a hard link to the checkpoint file (a separate `{'state_dict'}` file
+    where links are not supported). With `keep_last` > 1, the last checkpoints are also kept as hard
+    links `<path>.<step>`. At most `max_pending` snapshots wait for the writer, further saves block.
+    Errors of the writer are raised by the next `save` or `flush`.
+
+    Args:
+        keep_last: number of checkpoint versions to keep, the current one included
+        logger: optional callable receiving a message per written checkpoint
+    """
+
+    def __init__(self, keep_last=1, max_pending=1, logger=None):
+        self.keep_last = keep_last
+        self.logger = logger
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+        # the thread is a daemon, finish the pending writes before the interpreter exits
+        atexit.register(self.close)
+
+    def save(self, checkpoint, path, latest_fname=None, best_path=None, is_best=False, step=None):
+        """Snapshot `checkpoint` to CPU and queue it for writing to `path`
+
+        Args:
+            best_path: updated if `is_best` or if it does not exist yet
+            step: suffix of the kept versions, checkpoint['epoch'] by default
+        """
+        self._raise_error()
+        if self._thread is None:
+            raise RuntimeError('the checkpoint writer is closed')
+        if step is None:
+            step = checkpoint.get('epoch') if isinstance(checkpoint, dict) else None
+        self._queue.put((snapshot_to_cpu(checkpoint), path, latest_fname, best_path, is_best, step))
+
+    def flush(self):
+        """Wait for the queued checkpoints to be written"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('writing a checkpoint failed') from error
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(*job)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, checkpoint, path, latest_fname, best_path, is_best, step):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        atomic_save(checkpoint, path)
+        if latest_fname is not None:
+            atomic_write_text(latest_fname, path + '\n')
+
+        if best_path is not None and (is_best or not os.path.exists(best_path)):
+            os.makedirs(os.path.dirname(os.path.abspath(best_path)), exist_ok=True)
+            try:
+                _atomic_link(path, best_path)
+            except OSError:
+                # e.g. another file system
+                atomic_save({'state_dict': checkpoint['state_dict']}, best_path)
+
+        if self.keep_last > 1 and step is not None:
+            _atomic_link(path, '%s.%s' % (path, step))
+            self._prune(path)
+
+        if self.logger is not None:
+            self.logger('checkpoint written to %s%s' % (path, ' (best)' if is_best else ''))
+
+    def _prune(self, path):
+        dirname, basename = os.path.split(os.path.abspath(path))
+        pattern = re.compile(r'^%s\.(\d+)$' % re.escape(basename))
+        versions = []
+        for fname in os.listdir(dirname):
+            match = pattern.match(fname)
+            if match is not None:
+                versions.append((int(match.group(1)), fname))
+        for _, fname in sorted(versions)[:-self.keep_last]:
+            os.remove(os.path.join(dirname, fname))
@@ -11,34 +11,44 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
 from tqdm import tqdm
-import wandb
-import horovod.torch as hvd
 
 from ofa.utils import cross_entropy_with_label_smoothing, cross_entropy_loss_with_soft_target, write_log, init_models, aanet_loss
 from ofa.utils import DistributedMetric, list_mean, get_net_info, accuracy, AverageMeter, mix_labels, mix_images
 from ofa.utils import MyRandomResizedCrop
-from ofa.utils import d1_metric, thres_metric
+from ofa.imagenet_classification.run_manager.metrics import MetricAccumulator, sync_step
+from ofa.imagenet_classification.run_manager.metrics_sink import build_metrics_sink
+from ofa.imagenet_classification.run_manager.dist_backend import build_dist_backend
+from .checkpoint import AsyncCheckpointWriter
+from .metrics import DISPARITY_METRICS, disparity_metrics
 
 __all__ = ['DistributedRunManager']
 
 
 class DistributedRunManager:
 
-    def __init__(self, path, net, run_config, hvd_compression, backward_steps=1, is_root=False, init=True):
-        import horovod.torch as hvd
+    def __init__(self, path, net, run_config, hvd_compression, backward_steps=1, is_root=False, init=True,
+                 keep_last_checkpoints=1, metrics_backends='wandb', dist_backend='auto'):
 
         self.path = path
         self.net = net
         self.run_config = run_config
         self.is_root = is_root
+        # versions of each checkpoint kept by the checkpoint writer
+        self.keep_last_checkpoints = keep_last_checkpoints
+        # see build_metrics_sink, e.g. 'wandb', 'jsonl,csv' or 'none'
+        self.metrics_backends = metrics_backends
+        # collectives of Horovod or torch.distributed, see build_dist_backend
+        self.backend = build_dist_backend(dist_backend)
+        self.device = self.backend.device
 
         self.best_epe = 1000.0
         self.start_epoch = 0
 
         os.makedirs(self.path, exist_ok=True)
 
-        self.net.cuda()
-        cudnn.benchmark = True
+        self.net.to(self.device)
+        if self.device.type == 'cuda':
+            cudnn.benchmark = True
         if init and self.is_root:
             init_models(self.net, self.run_config.model_init)
         if self.is_root:
@@ -75,7 +85,7 @@ class DistributedRunManager:
                     if param.requires_grad:
                         net_params.append(param)
         self.optimizer = self.run_config.build_optimizer(net_params)
-        self.optimizer = hvd.DistributedOptimizer(
+        self.optimizer = self.backend.distributed_optimizer(
             self.optimizer, named_parameters=self.net.named_parameters(), compression=hvd_compression,
             backward_passes_per_step=backward_steps,
         )
@@ -106,6 +116,29 @@ class DistributedRunManager:
     def network(self, new_val):
         self.net = new_val
 
+    @property
+    def checkpoint_writer(self):
+        if self.__dict__.get('_checkpoint_writer', None) is None:
+            self.__dict__['_checkpoint_writer'] = AsyncCheckpointWriter(keep_last=self.keep_last_checkpoints)
+        return self.__dict__['_checkpoint_writer']
+
+    @property
+    def metrics_sink(self):
+        if self.__dict__.get('_metrics_sink', None) is None:
+            # only the root worker logs metrics, as write_log
+            spec = self.metrics_backends if self.is_root else 'none'
+            self.__dict__['_metrics_sink'] = build_metrics_sink(spec, log_dir=self.logs_path)
+        return self.__dict__['_metrics_sink']
+
+    def log_metrics(self, metrics, step=None):
+        # queued for the metrics sink thread, does not wait for the backends
+        if self.is_root:
+            self.metrics_sink.log(metrics, step=step)
+
+    def flush_metrics(self):
+        if self.__dict__.get('_metrics_sink', None) is not None:
+            self.metrics_sink.flush()
+
     def write_log(self, log_str, prefix='valid', should_print=True, mode='a'):
         if self.is_root:
             write_log(self.logs_path, log_str, prefix, should_print, mode)
@@ -142,18 +175,19 @@ class DistributedRunManager:
 
             latest_fname = os.path.join(self.save_path, 'latest.txt')
             model_path = os.path.join(self.save_path, model_name)
-            with open(latest_fname, 'w') as _fout:
-                _fout.write(model_path + '\n')
-            torch.save(checkpoint, model_path)
-
             best_path = os.path.join("checkpoints/%s_stereo" % model_name)
-            if not os.path.exists("checkpoints/%s" % model_name):
-                torch.save({'state_dict': checkpoint['state_dict']}, best_path)
-            if is_best:
-                torch.save({'state_dict': checkpoint['state_dict']}, best_path)
+            # only the CPU snapshot blocks, the files are written in the background; latest.txt is updated
+            # once the checkpoint is complete and the best copy is a hard link to it
+            self.checkpoint_writer.save(checkpoint, model_path, latest_fname=latest_fname, best_path=best_path,
+                                        is_best=is_best)
+
+    def flush_checkpoints(self):
+        if self.__dict__.get('_checkpoint_writer', None) is not None:
+            self.checkpoint_writer.flush()
 
     def load_model(self, model_fname=None):
         if self.is_root:
+            self.flush_checkpoints()
             latest_fname = os.path.join(self.save_path, 'latest.txt')
             if model_fname is None and os.path.exists(latest_fname):
                 with open(latest_fname, 'r') as fin:
@@ -184,43 +218,23 @@ class DistributedRunManager:
 
     # noinspection PyArgumentList
     def broadcast(self):
-        import horovod.torch as hvd
-        self.start_epoch = hvd.broadcast(torch.LongTensor(1).fill_(self.start_epoch)[0], 0, name='start_epoch').item()
-        self.best_epe = hvd.broadcast(torch.Tensor(1).fill_(self.best_epe)[0], 0, name='best_epe').item()
-        hvd.broadcast_parameters(self.net.state_dict(), 0)
-        hvd.broadcast_optimizer_state(self.optimizer, 0)
+        self.start_epoch = self.backend.broadcast(
+            torch.LongTensor(1).fill_(self.start_epoch)[0], 0, name='start_epoch').item()
+        self.best_epe = self.backend.broadcast(torch.Tensor(1).fill_(self.best_epe)[0], 0, name='best_epe').item()
+        self.backend.broadcast_parameters(self.net.state_dict(), 0)
+        self.backend.broadcast_optimizer_state(self.optimizer, 0)
 
     """ metric related """
     def get_metric_dict(self):
-        return {
-            'epe': AverageMeter(),
-            'd1': AverageMeter(),
-            'thres1': AverageMeter(),
-            'thres2': AverageMeter(),
-            'thres3': AverageMeter(),
-        }
+        return MetricAccumulator(DISPARITY_METRICS, allreduce=self.backend.allreduce, name='disparity_metrics',
+                                 device=self.device)
 
     def update_metric(self, metric_dict, pred_disp, gt_disp, mask):
+        metric_dict.update(disparity_metrics(pred_disp, gt_disp, mask), pred_disp.size(0))
 
-        epe = F.l1_loss(gt_disp[mask], pred_disp[mask], reduction='mean')
-        d1 = d1_metric(pred_disp, gt_disp, mask)
-        thres1 = thres_metric(pred_disp, gt_disp, mask, 1.0)
-        thres2 = thres_metric(pred_disp, gt_disp, mask, 2.0)
-        thres3 = thres_metric(pred_disp, gt_disp, mask, 3.0)
-        metric_dict['epe'].update(epe.item(), pred_disp.size(0))
-        metric_dict['d1'].update(d1.item(), pred_disp.size(0))
-        metric_dict['thres1'].update(thres1.item(), pred_disp.size(0))
-        metric_dict['thres2'].update(thres2.item(), pred_disp.size(0))
-        metric_dict['thres3'].update(thres3.item(), pred_disp.size(0))
-
-
-    def get_metric_vals(self, metric_dict, return_dict=False):
-        if return_dict:
-            return {
-                key: metric_dict[key].avg for key in metric_dict
-            }
-        else:
-            return [metric_dict[key].avg for key in metric_dict]
+    def get_metric_vals(self, metric_dict, return_dict=False, sync=True):
+        # sync=False returns the values of the last sync, without reading back or reducing the sums
+        return metric_dict.values(sync=sync, return_dict=return_dict)
 
     def get_metric_names(self):
         return 'top1', 'top5'
@@ -235,21 +249,24 @@ class DistributedRunManager:
                 data_loader = self.run_config.test_loader
             else:
                 data_loader = self.run_config.valid_loader
+        data_provider = self.run_config.data_provider
 
         net.eval()
 
-        losses = DistributedMetric('val_loss')
+        losses = MetricAccumulator(['loss'], allreduce=self.backend.allreduce, name='val_loss',
+                                   device=self.device)
         metric_dict = self.get_metric_dict()
+        n_batch = len(data_loader)
 
         with torch.no_grad():
-            with tqdm(total=len(data_loader),
+            with tqdm(total=n_batch,
                       desc='Validate Epoch #{} {}'.format(epoch + 1, run_str),
                       disable=no_logs or not self.is_root) as t:
                 for i, sample in enumerate(data_loader):
 
-                    left = sample['left'].cuda()  # [B, 3, H, W]
-                    right = sample['right'].cuda()
-                    gt_disp = sample['disp'].cuda()  # [B, H, W]
+                    left = data_provider.normalize_batch(sample['left'].to(self.device))  # [B, 3, H, W]
+                    right = data_provider.normalize_batch(sample['right'].to(self.device))
+                    gt_disp = sample['disp'].to(self.device)  # [B, H, W]
 
                     # compute output
                     pred_disp_pyramid = self.net(left, right)  # list of H/12, H/6, H/3, H/2, H
@@ -261,19 +278,22 @@ class DistributedRunManager:
                     if not loss is None:
                         losses.update(loss, left.size(0))
                         self.update_metric(metric_dict, pred_disp, gt_disp, mask)
-                        t.set_postfix({
-                            'loss': losses.avg.item(),
-                            **self.get_metric_vals(metric_dict, return_dict=True),
-                            'img_size': left.size(2),
-                        })
+                    # the metrics stay on the device between two syncs
+                    sync = sync_step(i, n_batch, self.run_config.print_frequency)
+                    loss_vals = losses.values(sync)
+                    t.set_postfix({
+                        'loss': loss_vals['loss'],
+                        **self.get_metric_vals(metric_dict, return_dict=True, sync=sync),
+                        'img_size': left.size(2),
+                    })
                     t.update(1)
-                    
-                    if i % 10 == 0:
+
+                    if sync:
                         wdlog = {}
-                        wdlog["valid_loss_iters"] = losses.avg.item()
-                        if hvd.rank() == 0:
-                            wandb.log(wdlog)
-        return losses.avg.item(), self.get_metric_vals(metric_dict)
+                        wdlog["valid_loss_iters"] = loss_vals['loss']
+                        self.log_metrics(wdlog)
+        # synced at the last step
+        return losses.avg, self.get_metric_vals(metric_dict, sync=False)
 
     def validate_all_resolution(self, epoch=0, is_test=False, net=None):
         if net is None:
@@ -300,7 +320,7 @@ class DistributedRunManager:
 
         nBatch = len(self.run_config.train_loader)
 
-        losses = DistributedMetric('train_loss')
+        losses = self.backend.DistributedMetric('train_loss')
         metric_dict = self.get_metric_dict()
         data_time = AverageMeter()
 
@@ -318,7 +338,7 @@ class DistributedRunManager:
                 else:
                     new_lr = self.run_config.adjust_learning_rate(self.optimizer, epoch - warmup_epochs, i, nBatch)
 
-                images, labels = images.cuda(), labels.cuda()
+                images, labels = images.to(self.device), labels.to(self.device)
                 target = labels
                 if isinstance(self.run_config.mixup_alpha, float):
                     # transform data
@@ -0,0 +1,28 @@
+import torch
+
+__all__ = ['DISPARITY_METRICS', 'disparity_metrics']
+
+DISPARITY_METRICS = ['epe', 'd1', 'thres1', 'thres2', 'thres3']
+
+
+def disparity_metrics(pred_disp, gt_disp, mask):
+    """EPE, D1 and the 1/2/3 pixel error rates over the `mask`ed pixels, in one pass over the batch
+
+    Matches F.l1_loss(gt_disp[mask], pred_disp[mask]), d1_metric and thres_metric without indexing by the
+    mask (no device sync for its size) and without reading the values back.
+
+    Returns:
+        [5] tensor on the device of `pred_disp`, in the order of DISPARITY_METRICS
+    """
+    with torch.no_grad():
+        pred_disp = pred_disp.detach()
+        err = torch.where(mask, (gt_disp - pred_disp).abs(), torch.zeros_like(pred_disp))
+        # err is 0 outside the mask, so none of the thresholds counts those pixels
+        stats = torch.stack([
+            err.sum(),
+            ((err > 3) & (err / gt_disp > 0.05)).sum().to(err.dtype),
+            (err > 1).sum().to(err.dtype),
+            (err > 2).sum().to(err.dtype),
+            (err > 3).sum().to(err.dtype),
+        ])
+        return stats / mask.sum().to(err.dtype)
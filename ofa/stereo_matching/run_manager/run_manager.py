@@ -18,7 +18,8 @@ import skimage.io
 from ofa.utils import get_net_info, cross_entropy_loss_with_soft_target, cross_entropy_with_label_smoothing, aanet_loss
 from ofa.utils import AverageMeter, accuracy, write_log, mix_images, mix_labels, init_models
 from ofa.utils import MyRandomResizedCrop
-from ofa.utils import d1_metric, thres_metric
+from ofa.imagenet_classification.run_manager.metrics import MetricAccumulator, sync_step
+from .metrics import DISPARITY_METRICS, disparity_metrics
 
 __all__ = ['RunManager']
 
@@ -181,34 +182,14 @@ class RunManager:
     """ metric related """
 
     def get_metric_dict(self):
-        return {
-            'epe': AverageMeter(),
-            'd1': AverageMeter(),
-            'thres1': AverageMeter(),
-            'thres2': AverageMeter(),
-            'thres3': AverageMeter(),
-        }
+        return MetricAccumulator(DISPARITY_METRICS)
 
     def update_metric(self, metric_dict, pred_disp, gt_disp, mask):
+        metric_dict.update(disparity_metrics(pred_disp, gt_disp, mask), pred_disp.size(0))
 
-        epe = F.l1_loss(gt_disp[mask], pred_disp[mask], reduction='mean')
-        d1 = d1_metric(pred_disp, gt_disp, mask)
-        thres1 = thres_metric(pred_disp, gt_disp, mask, 1.0)
-        thres2 = thres_metric(pred_disp, gt_disp, mask, 2.0)
-        thres3 = thres_metric(pred_disp, gt_disp, mask, 3.0)
-        metric_dict['epe'].update(epe.item(), pred_disp.size(0))
-        metric_dict['d1'].update(d1.item(), pred_disp.size(0))
-        metric_dict['thres1'].update(thres1.item(), pred_disp.size(0))
-        metric_dict['thres2'].update(thres2.item(), pred_disp.size(0))
-        metric_dict['thres3'].update(thres3.item(), pred_disp.size(0))
-
-    def get_metric_vals(self, metric_dict, return_dict=False):
-        if return_dict:
-            return {
-                key: metric_dict[key].avg for key in metric_dict
-            }
-        else:
-            return [metric_dict[key].avg for key in metric_dict]
+    def get_metric_vals(self, metric_dict, return_dict=False, sync=True):
+        # sync=False returns the values of the last sync, without reading back the sums
+        return metric_dict.values(sync=sync, return_dict=return_dict)
 
     def get_metric_names(self):
         return 'top1', 'top5'
@@ -223,21 +204,23 @@ class RunManager:
 
         if data_loader is None:
             data_loader = self.run_config.test_loader if is_test else self.run_config.valid_loader
+        data_provider = self.run_config.data_provider
 
         if train_mode:
             net.train()
         else:
             net.eval()
 
-        losses = AverageMeter()
+        losses = MetricAccumulator(['loss'])
         metric_dict = self.get_metric_dict()
+        n_batch = len(data_loader)
 
         with torch.no_grad():
-            with tqdm(total=len(data_loader),
+            with tqdm(total=n_batch,
                       desc='Validate Epoch #{} {}'.format(epoch + 1, run_str), disable=no_logs) as t:
                 for i, sample in enumerate(data_loader):
-                    left = sample['left'].to(self.device)  # [B, 3, H, W]
-                    right = sample['right'].to(self.device)
+                    left = data_provider.normalize_batch(sample['left'].to(self.device))  # [B, 3, H, W]
+                    right = data_provider.normalize_batch(sample['right'].to(self.device))
                     gt_disp = sample['disp'].to(self.device)  # [B, H, W]
 
                     # compute output
@@ -251,11 +234,13 @@ class RunManager:
                     if not loss is None:
                         losses.update(loss, left.size(0))
                         self.update_metric(metric_dict, pred_disp, gt_disp, mask)
-                        t.set_postfix({
-                            'loss': losses.avg.item(),
-                            **self.get_metric_vals(metric_dict, return_dict=True),
-                            'img_size': left.size(2),
-                        })
+                    # the metrics stay on the device between two syncs
+                    sync = sync_step(i, n_batch, self.run_config.print_frequency)
+                    t.set_postfix({
+                        'loss': losses.values(sync)['loss'],
+                        **self.get_metric_vals(metric_dict, return_dict=True, sync=sync),
+                        'img_size': left.size(2),
+                    })
                     t.update(1)
 
         return losses.avg, self.get_metric_vals(metric_dict)
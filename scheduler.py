@@ -0,0 +1,277 @@
+import itertools
+import threading
+import time
+import traceback
+
+# exit status in Scheduler.finished of a request whose launcher raised
+LAUNCH_FAILED = 'launch failed'
+
+
+def parse_hosts(hosts):
+    """'host1:2,host2:2' -> {'host1': 2, 'host2': 2}, a host without slots counts one"""
+    allocation = {}
+    for item in (hosts or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, slots = item.partition(':')
+        allocation[host] = allocation.get(host, 0) + (int(slots) if slots else 1)
+    return allocation
+
+
+def format_hosts(allocation):
+    """{'host1': 2, 'host2': 1} -> 'host1:2,host2:1', the -H argument of mpirun"""
+    return ','.join('%s:%d' % (host, n) for host, n in allocation.items())
+
+
+class JobRequest(object):
+
+    def __init__(self, request_id, name, jtype, slots, priority=0, hosts=None, single_node=False, **kwargs):
+        self.id = request_id
+        self.name = name
+        self.jtype = jtype
+        self.slots = slots
+        self.priority = priority
+        # hosts the job may run on, None for any
+        self.hosts = hosts
+        # all the processes on one node, e.g. torchrun jobs
+        self.single_node = single_node
+        # passed to the launcher, e.g. bs and lr
+        self.kwargs = kwargs
+        self.submit_time = time.time()
+
+    def __repr__(self):
+        return 'JobRequest(%d, %s, %s, slots=%d, priority=%d)' % (self.id, self.name, self.jtype, self.slots,
+                                                                  self.priority)
+
+
+class Scheduler(object):
+    """Queues training jobs and launches them when enough GPU slots are free
+
+    The inventory maps each node to its number of slots (GPUs, one MPI process each). Queued requests
+    are considered by decreasing priority, then in submission order. A request that does not fit blocks
+    the ones behind it, unless `backfill` lets smaller requests start first (which may delay large
+    ones indefinitely). Slots are allocated by bin packing: the node with the fewest free slots that
+    fits the whole job, otherwise the fewest nodes, fullest first for the remainder. Slots are
+    released when the process of the job exits, checked by `poll` (called every `interval` seconds by
+    the thread of `start`).
+
+    Args:
+        nodes: {host: slots}, e.g. GPU_NODES of net_utils.settings
+        launcher: callable(request, hosts, num_procs) returning a process with poll(), e.g. a Popen of
+            mpirun with `-np num_procs -H hosts`; see FakeLauncher
+    """
+
+    def __init__(self, nodes, launcher, backfill=False, interval=2.):
+        self.nodes = dict(nodes)
+        self.launcher = launcher
+        self.backfill = backfill
+        self.interval = interval
+        self.free = dict(nodes)
+        self.queue = []
+        # request id -> (request, allocation, process)
+        self.running = {}
+        self.finished = []
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def submit(self, name, jtype, slots, priority=0, hosts=None, single_node=False, **kwargs):
+        """Queue a job of `slots` processes, returns its request; launched by `schedule` when it fits
+
+        With `single_node`, all the processes are placed on one node.
+        """
+        hosts = None if hosts is None else list(hosts)
+        sizes = [self.nodes[h] for h in (self.nodes if hosts is None else hosts) if h in self.nodes]
+        capacity = (max(sizes) if sizes else 0) if single_node else sum(sizes)
+        if slots <= 0 or slots > capacity:
+            raise ValueError('cannot fit %d slots on %s%s (%d slots)' % (
+                slots, 'one of ' if single_node else '', hosts or 'the nodes', capacity))
+        with self._lock:
+            request = JobRequest(next(self._ids), name, jtype, slots, priority, hosts, single_node, **kwargs)
+            self.queue.append(request)
+        self.schedule()
+        return request
+
+    def cancel(self, request_id):
+        """Remove a queued request, returns False if it is not queued (e.g. already running)"""
+        with self._lock:
+            for request in self.queue:
+                if request.id == request_id:
+                    self.queue.remove(request)
+                    return True
+        return False
+
+    def kill(self, request_id):
+        """Cancel a queued request or kill the process of a running one, its slots are released by `poll`"""
+        if self.cancel(request_id):
+            return True
+        with self._lock:
+            if request_id not in self.running:
+                return False
+            process = self.running[request_id][2]
+        process.kill()
+        return True
+
+    def adopt(self, name, allocation, process):
+        """Account for a job started outside the scheduler (e.g. before a restart) until `process` exits"""
+        with self._lock:
+            request = JobRequest(next(self._ids), name, None, sum(allocation.values()))
+            for host, n in allocation.items():
+                if host in self.free:
+                    self.free[host] -= n
+            self.running[request.id] = (request, allocation, process)
+        return request
+
+    def allocate(self, slots, hosts=None, single_node=False):
+        """{host: slots} for a job of `slots` processes on the free slots, None if it does not fit"""
+        free = {h: n for h, n in self.free.items() if n > 0 and (hosts is None or h in hosts)}
+        if sum(free.values()) < slots:
+            return None
+        # best fit on a single node
+        fits = [h for h, n in free.items() if n >= slots]
+        if fits:
+            host = min(fits, key=lambda h: (free[h], h))
+            return {host: slots}
+        if single_node:
+            return None
+        # fewest nodes: the emptiest nodes first, the remainder on the node that fits it most tightly
+        allocation = {}
+        remaining = slots
+        for host in sorted(free, key=lambda h: (-free[h], h)):
+            if remaining <= 0:
+                break
+            fits = [h for h in free if h not in allocation and free[h] >= remaining]
+            if fits:
+                allocation[min(fits, key=lambda h: (free[h], h))] = remaining
+                remaining = 0
+            else:
+                allocation[host] = free[host]
+                remaining -= free[host]
+        return allocation
+
+    def schedule(self):
+        """Launch the queued requests that fit, returns them"""
+        launched = []
+        with self._lock:
+            for request in sorted(self.queue, key=lambda r: (-r.priority, r.id)):
+                allocation = self.allocate(request.slots, request.hosts, request.single_node)
+                if allocation is None:
+                    if self.backfill:
+                        continue
+                    break
+                self.queue.remove(request)
+                try:
+                    process = self.launcher(request, format_hosts(allocation), request.slots)
+                except Exception:
+                    # dropped, so it does not block the queue and raise again at every schedule
+                    print('failed to launch %r:' % request)
+                    traceback.print_exc()
+                    self.finished.append((request, LAUNCH_FAILED))
+                    continue
+                for host, n in allocation.items():
+                    self.free[host] -= n
+                self.running[request.id] = (request, allocation, process)
+                launched.append(request)
+        return launched
+
+    def poll(self):
+        """Release the slots of the exited jobs and launch what fits, returns the exited requests"""
+        exited = []
+        with self._lock:
+            for request_id, (request, allocation, process) in list(self.running.items()):
+                if process.poll() is None:
+                    continue
+                for host, n in allocation.items():
+                    if host in self.free:
+                        self.free[host] += n
+                del self.running[request_id]
+                self.finished.append((request, process.poll()))
+                exited.append(request)
+        self.schedule()
+        return exited
+
+    def status(self):
+        with self._lock:
+            return {
+                'free': dict(self.free),
+                'queued': [(r.id, r.name, r.jtype, r.slots, r.priority) for r in
+                           sorted(self.queue, key=lambda r: (-r.priority, r.id))],
+                'running': [(r.id, r.name, r.jtype, format_hosts(allocation)) for r, allocation, _ in
+                            self.running.values()],
+            }
+
+    def find(self, name, jtype=None):
+        """The queued, running or (latest) finished request of job `name`, None if there is none
+
+        Adopted jobs have no jtype, they match any.
+        """
+        with self._lock:
+            requests = self.queue + [r for r, _, _ in self.running.values()] + [r for r, _ in self.finished[::-1]]
+            for request in requests:
+                if request.name == name and (jtype is None or request.jtype in (None, jtype)):
+                    return request
+        return None
+
+    def is_queued(self, name, jtype=None):
+        with self._lock:
+            return any(r.name == name and (jtype is None or r.jtype == jtype) for r in self.queue)
+
+    def start(self):
+        """Poll in a daemon thread every `interval` seconds"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                # keep polling, the queued and running jobs still need it
+                print('scheduler poll failed:')
+                traceback.print_exc()
+
+
+class FakeProcess(object):
+    """Stands in for an mpirun process: exits with `returncode` `duration` seconds after it started"""
+
+    def __init__(self, duration, returncode=0):
+        self.end_time = time.time() + duration
+        self.returncode = None
+        self._exit = returncode
+
+    def poll(self):
+        if self.returncode is None and time.time() >= self.end_time:
+            self.returncode = self._exit
+        return self.returncode
+
+    def kill(self):
+        self.end_time = time.time()
+        self._exit = -9
+
+
+class FakeLauncher(object):
+    """Launcher of a Scheduler that records the launches and returns FakeProcesses
+
+    Args:
+        duration: seconds a job runs, or callable(request) -> seconds
+    """
+
+    def __init__(self, duration=1.):
+        self.duration = duration
+        self.launches = []
+
+    def __call__(self, request, hosts, num_procs):
+        duration = self.duration(request) if callable(self.duration) else self.duration
+        self.launches.append((request, hosts, num_procs, time.time()))
+        return FakeProcess(duration)
@@ -0,0 +1,105 @@
+"""Time the training stall of saving a checkpoint synchronously (as DistributedRunManager.save_model did)
+against AsyncCheckpointWriter, and check what the writer leaves on disk
+
+Usage (from the repository root):
+    python scripts/bench_checkpoint.py --saves 5 --keep-last 3 --output /tmp/ckpt_bench
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import torch
+
+from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
+from ofa.stereo_matching.run_manager.checkpoint import AsyncCheckpointWriter
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--saves', type=int, default=5)
+parser.add_argument('--keep-last', type=int, default=3)
+parser.add_argument('--train-ms', type=float, default=1000, help='time between two saves, spent sleeping')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+parser.add_argument('--output', type=str, default=None, help='directory to write to, temporary if None')
+
+
+def build_checkpoint(device):
+    net = OFAAANet(ks_list=[3, 5, 7], expand_ratio_list=[2, 4, 6, 8], depth_list=[2, 3, 4],
+                   scale_list=[2, 3, 4]).to(device)
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.1, momentum=0.9)
+    for p in net.parameters():
+        p.grad = torch.zeros_like(p)
+    optimizer.step()  # creates the momentum buffers
+    return net, optimizer
+
+
+def main(args):
+    out_dir = args.output or tempfile.mkdtemp(prefix='ckpt_')
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        net, optimizer = build_checkpoint(args.device)
+        nbytes = sum(t.numel() * t.element_size() for t in net.state_dict().values())
+        print('state_dict %.1f MB, with optimizer about %.1f MB' % (nbytes / 1024 ** 2, 2 * nbytes / 1024 ** 2))
+
+        def checkpoint(epoch):
+            return {'epoch': epoch, 'best_epe': 1., 'optimizer': optimizer.state_dict(), 'state_dict': net.state_dict()}
+
+        # as before: the full checkpoint, latest.txt and the best copy, on the training thread
+        sync_times = []
+        for epoch in range(args.saves):
+            start = time.time()
+            model_path = os.path.join(out_dir, 'sync.pth.tar')
+            with open(os.path.join(out_dir, 'latest_sync.txt'), 'w') as fout:
+                fout.write(model_path + '\n')
+            ckpt = checkpoint(epoch)
+            torch.save(ckpt, model_path)
+            torch.save({'state_dict': ckpt['state_dict']}, os.path.join(out_dir, 'sync_best'))
+            sync_times.append(time.time() - start)
+
+        writer = AsyncCheckpointWriter(keep_last=args.keep_last)
+        model_path = os.path.join(out_dir, 'async.pth.tar')
+        best_path = os.path.join(out_dir, 'async_best')
+        async_times = []
+        start_all = time.time()
+        for epoch in range(args.saves):
+            start = time.time()
+            writer.save(checkpoint(epoch), model_path, latest_fname=os.path.join(out_dir, 'latest.txt'),
+                        best_path=best_path, is_best=epoch % 2 == 0)
+            async_times.append(time.time() - start)
+            expected = {k: v.detach().cpu().clone() for k, v in net.state_dict().items()}
+            # training goes on and modifies the weights, the snapshot must not see that
+            with torch.no_grad():
+                for p in net.parameters():
+                    p.add_(1.)
+            time.sleep(args.train_ms / 1000)
+        writer.flush()
+        total_async = time.time() - start_all
+
+        print('%-10s %16s %16s' % ('writer', 'stall/save (ms)', 'max stall (ms)'))
+        print('%-10s %16.1f %16.1f' % ('sync', sum(sync_times) / len(sync_times) * 1000, max(sync_times) * 1000))
+        print('%-10s %16.1f %16.1f' % ('async', sum(async_times) / len(async_times) * 1000, max(async_times) * 1000))
+        print('async total until flushed: %.1f ms for %d saves, %.0f ms apart' % (total_async * 1000, args.saves,
+                                                                                  args.train_ms))
+
+        # the last checkpoint holds the weights at the time of its save, not the updated ones
+        saved = torch.load(model_path, map_location='cpu')
+        max_diff = max((saved['state_dict'][k].double() - v.double()).abs().max().item() for k, v in expected.items())
+        best_epoch = max(e for e in range(args.saves) if e % 2 == 0)
+        best_version = '%s.%d' % (model_path, best_epoch)
+        best_is_link = os.path.exists(best_version) and os.path.samefile(best_path, best_version)
+        with open(os.path.join(out_dir, 'latest.txt'), 'r') as fin:
+            latest = fin.readline().strip()
+        versions = sorted(f for f in os.listdir(out_dir) if f.startswith('async.pth.tar.'))
+        print('last checkpoint epoch %d, max diff to the weights at save time %.3g' % (saved['epoch'], max_diff))
+        print('best copy is a hard link to epoch %d: %s, latest.txt -> %s' % (best_epoch, best_is_link,
+                                                                             os.path.basename(latest)))
+        print('kept versions: %s, leftover temporary files: %d' % (
+            ', '.join(versions), sum('.tmp.' in f for f in os.listdir(out_dir))))
+        writer.close()
+    finally:
+        if args.output is None:
+            shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,121 @@
+"""Compare the tensor colour augmentation of RandomColor against the PIL version, per sample and batched
+
+Both versions draw the same ops and factors under the same seed, the pixel differences come from
+PIL's integer arithmetic.
+
+Usage (from the repository root):
+    python scripts/bench_color_aug.py --resolution 256x512 --batch-size 16 --num-samples 64
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import torch
+
+from ofa.stereo_matching.data_providers.transforms import (RandomColor, BatchRandomColor, sample_color_params,
+                                                           apply_batch_color_params)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolution', type=str, default='256x512', help='crop size as fed to the augmentation')
+parser.add_argument('--batch-size', type=int, default=16)
+parser.add_argument('--num-samples', type=int, default=64)
+parser.add_argument('--repeat', type=int, default=3, help='best of this many passes')
+parser.add_argument('--threads', type=int, default=None)
+parser.add_argument('--device', type=str, default='cpu', help='device of the batched version')
+
+
+def make_samples(n, h, w):
+    rs = np.random.RandomState(0)
+    # smooth images with saturated regions, closer to photos than uniform noise
+    base = rs.rand(n, 1, 1, 3) * 255
+    grad = np.linspace(-80, 80, w)[None, None, :, None]
+    noise = rs.randn(n, h, w, 3) * 20
+    imgs = np.clip(base + grad + noise, 0, 255).round().astype(np.float32)
+    return [{'left': imgs[i], 'right': imgs[(i + 1) % n]} for i in range(n)]
+
+
+def copy_sample(sample):
+    return {key: value.copy() for key, value in sample.items()}
+
+
+def seed(i):
+    np.random.seed(i)
+    random.seed(i)
+
+
+def bench(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    h, w = [int(x) for x in args.resolution.split('x')]
+    samples = make_samples(args.num_samples, h, w)
+    pil_color, tensor_color = RandomColor(backend='pil'), RandomColor(backend='tensor')
+
+    # same seed per sample, so both versions apply the same ops and factors
+    diffs = []
+    for i, sample in enumerate(samples):
+        seed(i)
+        ref = pil_color(copy_sample(sample))
+        seed(i)
+        out = tensor_color(copy_sample(sample))
+        for key in ['left', 'right']:
+            diffs.append(np.abs(ref[key] - out[key]))
+    diffs = np.stack(diffs)
+    print('tensor vs PIL (0-255): mean abs diff %.3f, max %.0f, %.2f%% of the pixels differ by more than 1' % (
+        diffs.mean(), diffs.max(), (diffs > 1).mean() * 100))
+
+    # the batched version on [0, 1] tensors, checked against the per-sample version with the same params
+    device = torch.device(args.device)
+    batch = samples[:args.batch_size]
+    seed(0)
+    params_list = [sample_color_params() for _ in batch]
+    imgs = torch.stack([torch.from_numpy(s['left']).permute(2, 0, 1) for s in batch]).to(device) / 255.
+    batched = apply_batch_color_params(imgs, params_list)
+    single = torch.stack([apply_batch_color_params(imgs[i:i + 1], params_list[i:i + 1])[0]
+                          for i in range(len(batch))])
+    print('batched vs per sample: max diff %.3g' % (batched - single).abs().max().item())
+
+    # every pass is seeded the same, so all versions draw the same ops and factors for each sample
+    def run_single(color):
+        seed(0)
+        for s in samples:
+            color(copy_sample(s))
+
+    n = len(samples)
+    pil_time = bench(lambda: run_single(pil_color), args.repeat) / n
+    tensor_time = bench(lambda: run_single(tensor_color), args.repeat) / n
+
+    batch_color = BatchRandomColor()
+    batches = []
+    for i in range(0, n, args.batch_size):
+        batches.append({key: torch.stack([torch.from_numpy(s[key]).permute(2, 0, 1)
+                                          for s in samples[i:i + args.batch_size]]).to(device) / 255.
+                        for key in ['left', 'right']})
+
+    def run_batch():
+        seed(0)
+        for b in batches:
+            batch_color(dict(b))
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    batch_time = bench(run_batch, args.repeat) / n
+
+    print('%-28s %12s %10s' % ('version', 'ms/sample', 'speedup'))
+    print('%-28s %12.3f %10s' % ('RandomColor pil', pil_time, '-'))
+    print('%-28s %12.3f %9.2fx' % ('RandomColor tensor', tensor_time, pil_time / tensor_time))
+    print('%-28s %12.3f %9.2fx' % ('BatchRandomColor %s, bs %d' % (device.type, args.batch_size), batch_time,
+                                   pil_time / batch_time))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
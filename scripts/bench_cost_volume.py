@@ -0,0 +1,59 @@
+"""Compare the per-disparity loop and the vectorized CostVolume on CPU
+
+Usage (from the repository root):
+    python scripts/bench_cost_volume.py --batch-sizes 1 2 4 --resolutions 576x960 384x768
+"""
+import argparse
+import time
+
+import torch
+
+from ofa.stereo_matching.networks.cost import CostVolume
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--modes', type=str, nargs='+', default=['correlation'])
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4])
+parser.add_argument('--resolutions', type=str, nargs='+', default=['384x768', '576x960'],
+                    help='input image resolutions, features are taken at 1/3 scale')
+parser.add_argument('--channels', type=int, default=24)
+parser.add_argument('--max-disp', type=int, default=192)
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--threads', type=int, default=None)
+
+
+def bench(module, left, right, repeat):
+    with torch.no_grad():
+        module(left, right)  # warm up
+        start = time.time()
+        for _ in range(repeat):
+            module(left, right)
+    return (time.time() - start) / repeat * 1000
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    max_disp = args.max_disp // 3
+
+    print('%-12s %-10s %-3s %10s %10s %8s %10s' % ('mode', 'resolution', 'bs', 'loop(ms)', 'vec(ms)',
+                                                  'speedup', 'max_diff'))
+    for mode in args.modes:
+        loop_module = CostVolume(max_disp, mode, vectorized=False)
+        vec_module = CostVolume(max_disp, mode, vectorized=True)
+        for resolution in args.resolutions:
+            img_h, img_w = [int(x) for x in resolution.split('x')]
+            for bs in args.batch_sizes:
+                left = torch.randn(bs, args.channels, img_h // 3, img_w // 3)
+                right = torch.randn(bs, args.channels, img_h // 3, img_w // 3)
+
+                with torch.no_grad():
+                    max_diff = (loop_module(left, right) - vec_module(left, right)).abs().max().item()
+                loop_time = bench(loop_module, left, right, args.repeat)
+                vec_time = bench(vec_module, left, right, args.repeat)
+                print('%-12s %-10s %-3d %10.2f %10.2f %7.2fx %10.3g' % (mode, resolution, bs, loop_time, vec_time,
+                                                                       loop_time / vec_time, max_diff))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+"""Check the CPU (modulated) deformable convolution against torchvision and measure its throughput
+
+Usage (from the repository root):
+    python scripts/bench_deform_conv.py --batch-sizes 1 2 4 --im2col-steps 1 64
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from ofa.stereo_matching.networks.bk.deform_conv import ModulatedDeformConvPack, modulated_deform_conv
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4])
+parser.add_argument('--resolution', type=str, default='288x576',
+                    help='input image resolution, the aggregation runs at 1/3 scale')
+parser.add_argument('--channels', type=int, default=64, help='cost volume channels, i.e. max_disp / 3')
+parser.add_argument('--deformable-groups', type=int, default=2)
+parser.add_argument('--im2col-steps', type=int, nargs='+', default=[64])
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--threads', type=int, default=None)
+
+
+def check(module, n, h, w):
+    """Compare the output and all gradients against torchvision.ops.deform_conv2d
+
+    The offset gradient of bilinear sampling jumps at integer sample positions, and grid_sample
+    rounds coordinates slightly differently, so a few offset gradients sitting within float32
+    rounding of an integer take the value from the other side. Hence the fraction of mismatching
+    elements is reported next to the relative max error.
+
+    Returns:
+        errors: list of (name, relative max error, fraction of elements not within rtol=atol=1e-3)
+    """
+    from torchvision.ops import deform_conv2d
+
+    k = module.kernel_size[0] * module.kernel_size[1]
+    x = torch.randn(n, module.in_channels, h, w, requires_grad=True)
+    offset = torch.randn(n, module.deformable_groups * 2 * k, h, w).mul_(2).requires_grad_()
+    mask = torch.rand(n, module.deformable_groups * k, h, w, requires_grad=True)
+    inputs = [x, offset, mask, module.weight, module.bias]
+    names = ['output', 'input', 'offset', 'mask', 'weight', 'bias']
+
+    out = modulated_deform_conv(x, offset, mask, module.weight, module.bias, module.stride, module.padding,
+                                module.dilation, module.groups, module.deformable_groups, module.im2col_step)
+    ref = deform_conv2d(x, offset, module.weight, module.bias, stride=module.stride, padding=module.padding,
+                        dilation=module.dilation, mask=mask)
+    grad_output = torch.randn_like(ref)
+    results = [out] + list(torch.autograd.grad(out, inputs, grad_output))
+    refs = [ref] + list(torch.autograd.grad(ref, inputs, grad_output))
+
+    errors = []
+    for name, a, b in zip(names, results, refs):
+        scale = b.abs().max()
+        mismatch = ((a - b).abs() > 1e-3 * (scale + 1)).float().mean()
+        errors.append((name, ((a - b).abs().max() / scale).item(), mismatch.item()))
+    return errors
+
+
+def bench(fn, repeat):
+    fn()  # warm up
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - start) / repeat * 1000
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    img_h, img_w = [int(x) for x in args.resolution.split('x')]
+    h, w = img_h // 3, img_w // 3
+
+    module = ModulatedDeformConvPack(args.channels, args.channels, kernel_size=3, padding=1,
+                                     deformable_groups=args.deformable_groups)
+    # non-zero offsets, the default init samples the regular grid only
+    nn.init.normal_(module.conv_offset.weight, std=0.01)
+    conv = nn.Conv2d(args.channels, args.channels, kernel_size=3, padding=1)
+
+    try:
+        errors = check(module, 2, h, w)
+        print('%-8s %12s %12s' % ('vs tv', 'rel_err', 'mismatch'))
+        for error in errors:
+            print('%-8s %12.3g %11.4f%%' % (error[0], error[1], error[2] * 100))
+    except ImportError:
+        print('torchvision not available, skip the equivalence check')
+
+    print('%-3s %-6s %12s %12s %12s %12s' % ('bs', 'step', 'fwd(ms)', 'fwd+bwd(ms)', 'img/s', 'conv2d(ms)'))
+    for bs in args.batch_sizes:
+        x = torch.randn(bs, args.channels, h, w)
+        x_grad = x.clone().requires_grad_()
+        for step in args.im2col_steps:
+            module.im2col_step = step
+
+            with torch.no_grad():
+                fwd_time = bench(lambda: module(x), args.repeat)
+            train_time = bench(lambda: module(x_grad).sum().backward(), args.repeat)
+            with torch.no_grad():
+                conv_time = bench(lambda: conv(x), args.repeat)
+            print('%-3d %-6d %12.2f %12.2f %12.1f %12.2f' % (bs, step, fwd_time, train_time, bs / fwd_time * 1000,
+                                                             conv_time))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,119 @@
+"""Train a small conv net data-parallel on the CPU with TorchDistributedBackend (Gloo), one process per worker
+started by torchrun, and check it against a single process on the whole global batch: the parameters after
+the last step, and the loss averaged with MetricAccumulator. Ranks start from different initializations,
+so broadcast_parameters and broadcast_optimizer_state are exercised as in DistributedRunManager.broadcast.
+Reports the throughput of every number of workers.
+
+Usage (from the repository root):
+    python scripts/bench_dist_backend.py --workers 1 2 4 --global-batch 64 --steps 30
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from ofa.imagenet_classification.run_manager.dist_backend import build_dist_backend
+from ofa.imagenet_classification.run_manager.metrics import MetricAccumulator
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+parser.add_argument('--global-batch', type=int, default=64)
+parser.add_argument('--steps', type=int, default=30)
+parser.add_argument('--image-size', type=int, default=32)
+parser.add_argument('--threads', type=int, default=1, help='torch threads per worker')
+parser.add_argument('--compression', type=str, default='none', choices=['none', 'fp16'])
+parser.add_argument('--worker', action='store_true', help='internal: run as a torchrun worker')
+parser.add_argument('--out', type=str, default=None, help='internal: result file of rank 0')
+
+
+def build_net(seed):
+    torch.manual_seed(seed)
+    return nn.Sequential(
+        nn.Conv2d(3, 16, 3, padding=1), nn.ReLU(), nn.Conv2d(16, 32, 3, stride=2, padding=1), nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(32, 10),
+    )
+
+
+def batch(step, args):
+    g = torch.Generator().manual_seed(1000 + step)
+    images = torch.randn(args.global_batch, 3, args.image_size, args.image_size, generator=g)
+    labels = torch.randint(0, 10, (args.global_batch,), generator=g)
+    return images, labels
+
+
+def train(args, backend=None):
+    rank, size = (0, 1) if backend is None else (backend.rank(), backend.size())
+    net = build_net(seed=rank)
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.1, momentum=0.9)
+    if backend is not None:
+        optimizer = backend.distributed_optimizer(optimizer, net.named_parameters(), compression=args.compression)
+        # rank 0's parameters and (empty) momentum everywhere, as DistributedRunManager.broadcast
+        backend.broadcast_parameters(net.state_dict(), 0)
+        backend.broadcast_optimizer_state(optimizer, 0)
+    losses = MetricAccumulator(['loss'], allreduce=None if backend is None else backend.allreduce, name='loss')
+    shard = args.global_batch // size
+    start = time.time()
+    for step in range(args.steps):
+        images, labels = batch(step, args)
+        images, labels = images[rank * shard:(rank + 1) * shard], labels[rank * shard:(rank + 1) * shard]
+        loss = F.cross_entropy(net(images), labels)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.update(loss.detach(), images.size(0))
+    loss = losses.values()['loss']
+    return net, loss, time.time() - start
+
+
+def worker(args):
+    torch.set_num_threads(args.threads)
+    backend = build_dist_backend('gloo')
+    net, loss, seconds = train(args, backend)
+    if backend.rank() == 0:
+        torch.save(net.state_dict(), args.out + '.pt')
+        with open(args.out, 'w') as fout:
+            json.dump({'loss': loss, 'seconds': seconds}, fout)
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    ref, ref_loss, ref_seconds = train(args)
+    print('%d steps of a global batch of %d, %s compression' % (args.steps, args.global_batch, args.compression))
+    print('%-16s %12s %12s %14s %12s' % ('run', 'samples/s', 'loss', 'max |dparam|', 'loss match'))
+    print('%-16s %12.0f %12.5f %14s %12s' % ('single process', args.steps * args.global_batch / ref_seconds,
+                                              ref_loss, '-', '-'))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = os.path.join(root, '.bench_dist_backend.json')
+    try:
+        for n in args.workers:
+            cmd = [sys.executable, '-m', 'torch.distributed.run', '--standalone', '--nproc_per_node', str(n),
+                   os.path.abspath(__file__), '--worker', '--out', out, '--global-batch', str(args.global_batch),
+                   '--steps', str(args.steps), '--image-size', str(args.image_size), '--threads', str(args.threads),
+                   '--compression', args.compression]
+            python_path = os.pathsep.join(p for p in [root, os.environ.get('PYTHONPATH')] if p)
+            subprocess.run(cmd, check=True, cwd=root, env=dict(os.environ, PYTHONPATH=python_path))
+            with open(out, 'r') as fin:
+                result = json.load(fin)
+            state = torch.load(out + '.pt')
+            diff = max((state[k] - v).abs().max().item() for k, v in ref.state_dict().items())
+            print('%-16s %12.0f %12.5f %14.2e %12s' % (
+                'torchrun x%d' % n, args.steps * args.global_batch / result['seconds'], result['loss'], diff,
+                abs(result['loss'] - ref_loss) < 1e-4))
+    finally:
+        for path in [out, out + '.pt']:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.worker:
+        worker(args)
+    else:
+        main(args)
@@ -0,0 +1,118 @@
+"""Latency and memory of OFA subnets before and after freeze_for_inference (Conv-BN folding)
+
+BN statistics and affine parameters are randomized so that folding is checked on non-trivial
+values. Activation memory is the bytes written by all leaf modules in one forward pass.
+
+Usage (from the repository root):
+    python scripts/bench_freeze.py --nets aanet mbv3 --resolution 288x576
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from ofa.imagenet_classification.elastic_nn.networks.ofa_mbv3 import OFAMobileNetV3
+from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
+from ofa.stereo_matching.networks.freeze import freeze_for_inference
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--nets', type=str, nargs='+', default=['aanet', 'mbv3'])
+parser.add_argument('--resolution', type=str, default='288x576', help='stereo input resolution')
+parser.add_argument('--batch-size', type=int, default=1)
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--threads', type=int, default=None)
+
+
+def randomize_bn(net):
+    for m in net.modules():
+        if isinstance(m, nn.modules.batchnorm._BatchNorm):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2)
+            if m.affine:
+                m.weight.data.uniform_(0.5, 1.5)
+                m.bias.data.uniform_(-0.5, 0.5)
+
+
+def build(name, args):
+    if name == 'aanet':
+        net = OFAAANet(ks_list=[3, 5, 7], expand_ratio_list=[2, 4, 6, 8], depth_list=[2, 3, 4], scale_list=[2, 3, 4])
+        net.set_active_subnet(ks=7, e=6, d=4, s=3)
+        h, w = [int(x) for x in args.resolution.split('x')]
+        inputs = (torch.randn(args.batch_size, 3, h, w), torch.randn(args.batch_size, 3, h, w))
+    elif name == 'mbv3':
+        net = OFAMobileNetV3(dropout_rate=0.1, width_mult=1.0, ks_list=[3, 5, 7], expand_ratio_list=[3, 4, 6],
+                             depth_list=[2, 3, 4])
+        net.set_active_subnet(ks=7, e=6, d=4)
+        inputs = (torch.randn(args.batch_size, 3, 224, 224),)
+    else:
+        raise ValueError('unrecognized net: %s' % name)
+    subnet = net.get_active_subnet(preserve_weight=True)
+    randomize_bn(subnet)
+    subnet.eval()
+    return subnet, inputs
+
+
+def forward(net, inputs):
+    out = net(*inputs)
+    return out[-1] if isinstance(out, list) else out
+
+
+def bench(fn, repeat):
+    with torch.no_grad():
+        fn()  # warm up
+        start = time.time()
+        for _ in range(repeat):
+            fn()
+    return (time.time() - start) / repeat * 1000
+
+
+def activation_bytes(net, inputs):
+    nbytes = [0]
+
+    def hook(m, x, y):
+        for t in (y if isinstance(y, (list, tuple)) else [y]):
+            if torch.is_tensor(t):
+                nbytes[0] += t.numel() * t.element_size()
+
+    hooks = [m.register_forward_hook(hook) for m in net.modules() if len(list(m.children())) == 0]
+    with torch.no_grad():
+        forward(net, inputs)
+    for h in hooks:
+        h.remove()
+    return nbytes[0]
+
+
+def model_stats(net):
+    n_bn = sum(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in net.modules())
+    n_modules = len(list(net.modules()))
+    nbytes = sum(t.numel() * t.element_size() for t in list(net.parameters()) + list(net.buffers()))
+    return n_modules, n_bn, nbytes
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    print('%-6s %-7s %8s %6s %10s %12s %12s %10s' % ('net', 'version', 'modules', 'bn', 'model(MB)', 'act(MB)',
+                                                     'latency(ms)', 'max_diff'))
+    for name in args.nets:
+        net, inputs = build(name, args)
+        frozen = freeze_for_inference(net)
+
+        with torch.no_grad():
+            ref = forward(net, inputs)
+            out = forward(frozen, inputs)
+        max_diff = ((out - ref).abs().max() / ref.abs().max()).item()
+
+        for version, m in [('eval', net), ('frozen', frozen)]:
+            n_modules, n_bn, nbytes = model_stats(m)
+            latency = bench(lambda: forward(m, inputs), args.repeat)
+            print('%-6s %-7s %8d %6d %10.2f %12.1f %12.1f %10s' % (
+                name, version, n_modules, n_bn, nbytes / 1024 ** 2, activation_bytes(m, inputs) / 1024 ** 2, latency,
+                '%.3g' % max_diff if version == 'frozen' else '-'))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
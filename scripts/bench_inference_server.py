@@ -0,0 +1,124 @@
+"""Latency percentiles and throughput of the micro-batching classification server under concurrent clients
+
+Compares batch size 1 (one request at a time, as `detect_class` used to run) against micro-batching,
+in-process or through the HTTP loopback client, and checks the batched top-5 against single images.
+
+Usage (from the repository root):
+    python scripts/bench_inference_server.py --clients 1 4 16 --max-batch-size 16 --max-wait-ms 5
+"""
+import argparse
+import io
+import threading
+import time
+
+import torch
+from PIL import Image
+
+from inference_server import MicroBatchServer, ServerBusy, serve_http, LoopbackClient, preprocess_image
+from ofa.imagenet_classification.elastic_nn.networks.ofa_mbv3 import OFAMobileNetV3
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--ckpt', type=str, default=None, help='OFA MobileNetV3 checkpoint, random weights if not given')
+parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+parser.add_argument('--requests', type=int, default=32, help='requests per client')
+parser.add_argument('--max-batch-size', type=int, default=16)
+parser.add_argument('--max-wait-ms', type=float, default=5.)
+parser.add_argument('--max-queue', type=int, default=64)
+parser.add_argument('--http', action='store_true', help='send the requests through the loopback HTTP client')
+parser.add_argument('--threads', type=int, default=None)
+
+
+def build_net(ckpt):
+    net = OFAMobileNetV3(dropout_rate=0, width_mult=1.0, ks_list=[3, 5, 7], expand_ratio_list=[3, 4, 6],
+                         depth_list=[2, 3, 4])
+    if ckpt is not None:
+        net.load_state_dict(torch.load(ckpt, map_location='cpu')['state_dict'])
+    net.set_active_subnet(ks=7, e=6, d=4)
+    net = net.get_active_subnet(preserve_weight=True)
+    net.eval()
+    return net
+
+
+def random_jpeg(seed):
+    g = torch.Generator().manual_seed(seed)
+    array = torch.randint(0, 256, (300, 400, 3), dtype=torch.uint8, generator=g).numpy()
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+def run_clients(server, n_clients, n_requests, images, tensors, port=None):
+    """All clients send their requests back to back, returns (seconds, busy rejections)"""
+    rejected = [0]
+    lock = threading.Lock()
+
+    def client(i):
+        conn = LoopbackClient(port) if port is not None else None
+        for j in range(n_requests):
+            k = (i + j) % len(images)
+            while True:
+                try:
+                    if conn is not None:
+                        conn.classify(images[k])
+                    else:
+                        server.submit(tensors[k]).result()
+                    break
+                except ServerBusy:
+                    with lock:
+                        rejected[0] += 1
+                    time.sleep(0.001)
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - start, rejected[0]
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    net = build_net(args.ckpt)
+    images = [random_jpeg(i) for i in range(8)]
+    tensors = [preprocess_image(data) for data in images]
+
+    # batched results must match one image at a time
+    with MicroBatchServer(net, max_batch_size=len(tensors), max_wait_ms=100.) as server:
+        futures = [server.submit(t) for t in tensors]
+        batched = [f.result() for f in futures]
+    with torch.no_grad():
+        single = [torch.softmax(net(t.unsqueeze(0)), dim=1)[0].mul(100).topk(5) for t in tensors]
+    max_diff = max(abs(p - sp) for b, (sp_, si_) in zip(batched, single)
+                   for (i, p), sp, si in zip(b, sp_.tolist(), si_.tolist()))
+    same_top5 = all([i for i, _ in b] == si.tolist() for b, (_, si) in zip(batched, single))
+    print('batched vs single: same top5 %s, max prob diff %.3g%%' % (same_top5, max_diff))
+
+    print('%-8s %-8s %10s %10s %10s %10s %10s %10s' % ('clients', 'mode', 'img/s', 'p50(ms)', 'p95(ms)',
+                                                       'p99(ms)', 'avg_bs', 'busy'))
+    for n_clients in args.clients:
+        for mode, max_batch_size in [('bs1', 1), ('micro', args.max_batch_size)]:
+            server = MicroBatchServer(net, max_batch_size=max_batch_size, max_wait_ms=args.max_wait_ms,
+                                      max_queue=args.max_queue).start()
+            httpd = serve_http(server) if args.http else None
+            port = httpd.server_address[1] if httpd is not None else None
+
+            run_clients(server, 1, 2, images, tensors, port)  # warm up
+            server.reset_stats()
+            elapsed, rejected = run_clients(server, n_clients, args.requests, images, tensors, port)
+            stats = server.stats()
+            print('%-8d %-8s %10.1f %10.1f %10.1f %10.1f %10.2f %10d' % (
+                n_clients, mode, stats['requests'] / elapsed, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['avg_batch_size'], rejected))
+
+            if httpd is not None:
+                httpd.shutdown()
+            server.stop()
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""Time a running-jobs query through `ps -ax` (as trainer.query_running did) against JobRegistry, with a few
+fake `mpirun ... train_ofa_net.py` jobs, and check the registry follows their exits and kills
+
+Usage (from the repository root):
+    python scripts/bench_job_registry.py --jobs 4 --repeat 20
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_registry import JobRegistry  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--jobs', type=int, default=4)
+parser.add_argument('--repeat', type=int, default=20)
+
+
+def ps_query(kw='train_ofa_net.py'):
+    p = subprocess.Popen(['ps', '-ax'], stdout=subprocess.PIPE)
+    stdout = p.communicate()[0]
+    ps = stdout.decode('utf-8').split('\n')
+    ps = [line for line in ps if kw in line]
+    ps = [line for line in ps if 'mpirun' in line]
+    return [[line.split()[0], line.split()[-1]] for line in ps]
+
+
+def bench(fn, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - start) / repeat * 1000
+
+
+def main(args):
+    tmp_dir = tempfile.mkdtemp(prefix='jobs_')
+    procs = []
+    try:
+        registry = JobRegistry(os.path.join(tmp_dir, 'jobs.sqlite'))
+        # stand-ins for the mpirun launchers, with the same command line tail as train_class
+        script = 'import sys, time; time.sleep(float(sys.argv[1]))'
+        for i in range(args.jobs):
+            cmd = [sys.executable, '-c', script, '600', 'mpirun', 'train_ofa_net.py', '--name', 'job%d' % i]
+            p = subprocess.Popen(cmd)
+            procs.append((p, registry.register('job%d' % i, 'class', p.pid, hosts='localhost:2', cmd=cmd)))
+
+        ps_ms = bench(ps_query, args.repeat)
+        reg_ms = bench(lambda: registry.running('class'), args.repeat)
+        found_ps = sorted(name for _, name in ps_query())
+        found_reg = sorted(job['name'] for job in registry.running('class'))
+        print('%-14s %12s %8s' % ('query', 'ms/query', 'jobs'))
+        print('%-14s %12.2f %8d' % ('ps -ax', ps_ms, len(found_ps)))
+        print('%-14s %12.2f %8d' % ('JobRegistry', reg_ms, len(found_reg)))
+        print('same jobs: %s' % (found_ps == found_reg))
+
+        # a killed job and an exited job whose exit is not recorded by its launcher
+        p, job_id = procs[0]
+        p.kill()
+        p.wait()
+        registry.finish(job_id, p.returncode)
+        p, _ = procs[1]
+        p.kill()
+        p.wait()
+        running = [job['name'] for job in registry.running('class')]
+        status = {job['name']: job['exit_status'] for job in registry.jobs('class')}
+        print('running after two exits: %s, exit status: %s' % (', '.join(running), status))
+    finally:
+        for p, _ in procs:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
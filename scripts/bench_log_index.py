@@ -0,0 +1,115 @@
+"""Index a synthetic job log (real tqdm progress output with the postfix of progressive_shrinking, and the
+`Valid [e/n] ...` lines of run_manager.write_log) with LogIndex, check the parsed values, and time a
+dashboard query against re-parsing the text, and an update after the job appended more output
+
+Usage (from the repository root):
+    python scripts/bench_log_index.py --epochs 20 --batches 2000
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_index import LogIndex  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--epochs', type=int, default=20)
+parser.add_argument('--batches', type=int, default=2000)
+parser.add_argument('--repeat', type=int, default=3, help='best of this many queries')
+
+SUBNETS = ['R384-D2-E2-K3-S2-W0', 'R384-D4-E8-K7-S4-W0']
+
+
+def write_job(stdout, valid_console, first_epoch, epochs, batches, seed):
+    rs = random.Random(seed)
+    losses = []
+    with open(stdout, 'a') as fout:
+        for epoch in range(first_epoch, first_epoch + epochs):
+            with tqdm(total=batches, desc='Train Epoch #{}'.format(epoch + 1), file=fout, mininterval=0,
+                      ascii=True) as t:
+                for i in range(batches):
+                    loss = rs.uniform(0.5, 5)
+                    t.set_postfix({
+                        'loss': loss, 'epe': rs.uniform(0.5, 5), 'd1': rs.random(), 'thres1': rs.random(),
+                        'thres2': rs.random(), 'thres3': rs.random(), 'R': 384, 'lr': 1e-3 * rs.random(),
+                        'loss_type': '', 'seed': str(rs.randint(0, 10 ** 6)),
+                        'str': '0: ks_5.0,e_4.0,d_3.0,s_3.0 || 1: ks_3.0,e_2.0,d_2.0,s_2.0 || ',
+                        'data_time': rs.random(),
+                    }, refresh=False)
+                    t.update(1)
+                    losses.append(float('%.3g' % loss))
+            with open(valid_console, 'a') as vout:
+                val_log = 'Valid [{0}/{1}] loss={2:.3f}, epe={3:.3f} ({4:.3f})'.format(
+                    epoch + 1, first_epoch + epochs, rs.random(), rs.random(), rs.random())
+                val_log += ', Train epe {0:.3f}, Train loss {1:.3f}\t'.format(rs.random(), rs.random())
+                val_log += ''.join('%s (%.3f), ' % (name, rs.random()) for name in SUBNETS)
+                vout.write(val_log + '\n')
+    return losses
+
+
+def reparse(path):
+    # what a dashboard does without the index: scan the whole log for the loss
+    text = open(path, 'r', errors='replace').read()
+    return [float(x) for x in re.findall(r'Train Epoch #\d+:.*?loss=([^,\]]+)', text)]
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        out = fn()
+        times.append(time.time() - start)
+    return min(times) * 1000, out
+
+
+def main(args):
+    tmp_dir = tempfile.mkdtemp(prefix='index_')
+    try:
+        stdout = os.path.join(tmp_dir, 'bench_stereo.log')
+        valid_console = os.path.join(tmp_dir, 'valid_console.txt')
+        losses = write_job(stdout, valid_console, 0, args.epochs, args.batches, 0)
+        index = LogIndex(os.path.join(tmp_dir, 'index'))
+
+        start = time.time()
+        rows = index.update('bench_stereo', [stdout, valid_console])
+        index_ms = (time.time() - start) * 1000
+        print('log %.1f MB, %d rows indexed in %.0f ms' % (os.path.getsize(stdout) / 1024 ** 2, rows, index_ms))
+
+        curves = index.query('bench_stereo', columns=['global_step', 'loss'], phase='train')
+        steps_ok = np.array_equal(curves['global_step'], np.arange(1, len(losses) + 1))
+        print('train loss rows match the log: %s, global steps consecutive: %s' % (
+            np.allclose(curves['loss'], losses), steps_ok))
+        epochs = index.query('bench_stereo', 'epochs')
+        subnet = index.query('bench_stereo', 'subnets', subnet=SUBNETS[1])
+        print('validation epochs: %d, entries of subnet %s: %d' % (len(epochs['epoch']), SUBNETS[1],
+                                                                  len(subnet['value'])))
+
+        reparse_ms, _ = best_of(lambda: reparse(stdout), args.repeat)
+        query_ms, _ = best_of(lambda: index.query('bench_stereo', columns=['global_step', 'loss'], phase='train'),
+                              args.repeat)
+        print('%-26s %12s' % ('train loss curve', 'ms'))
+        print('%-26s %12.2f' % ('re-parse the log', reparse_ms))
+        print('%-26s %12.2f' % ('LogIndex.query', query_ms))
+
+        # one more epoch, only the appended bytes are parsed
+        losses += write_job(stdout, valid_console, args.epochs, 1, args.batches, 1)
+        start = time.time()
+        rows = index.update('bench_stereo', [stdout, valid_console])
+        print('update after one more epoch: %d new rows in %.0f ms, loss rows match: %s' % (
+            rows, (time.time() - start) * 1000,
+            np.allclose(index.query('bench_stereo', columns=['loss'], phase='train')['loss'], losses)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,102 @@
+"""Compare how training_manager.py showed the end of a job log (`readlines()[-20:]` of the whole file) against
+tail_lines and LogFollower, and download the log through serve_logs
+
+The synthetic log mixes NCCL_DEBUG=INFO style lines with tqdm progress bars, which rewrite their line with
+'\\r'. Checks that the shown lines match the old ones, also after appending to the log.
+
+Usage (from the repository root):
+    python scripts/bench_log_tail.py --size-mb 200 --repeat 3
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_tail import LogFollower, serve_logs, tail_lines  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size-mb', type=float, default=200)
+parser.add_argument('--lines', type=int, default=20)
+parser.add_argument('--repeat', type=int, default=3, help='best of this many reads')
+
+
+def write_log(path, size, seed=0):
+    rs = random.Random(seed)
+    with open(path, 'a') as f:
+        written = 0
+        while written < size:
+            if rs.random() < 0.2:
+                line = 'Train Epoch #%d: %d%%|###  | %d/5000 [00:%02d<01:00, loss=%.3f]\r' % (
+                    rs.randint(1, 100), rs.randint(0, 100), rs.randint(0, 5000), rs.randint(0, 59), rs.random())
+            else:
+                line = 'host%d:%d:%d [%d] NCCL INFO Channel %02d : %d[%d] -> %d[%d] via P2P/IPC\n' % (
+                    rs.randint(1, 2), rs.randint(1000, 9999), rs.randint(1000, 9999), rs.randint(0, 3),
+                    rs.randint(0, 31), rs.randint(0, 3), rs.randint(0, 7), rs.randint(0, 3), rs.randint(0, 7))
+            f.write(line)
+            written += len(line)
+
+
+def old_tail(path, n):
+    with open(path, 'r') as f:
+        contents = f.readlines()[-n:]
+    return [line.strip() for line in contents]
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        out = fn()
+        times.append(time.time() - start)
+    return min(times) * 1000, out
+
+
+def main(args):
+    tmp_dir = tempfile.mkdtemp(prefix='logs_')
+    try:
+        path = os.path.join(tmp_dir, 'bench_class.log')
+        write_log(path, int(args.size_mb * 1024 ** 2))
+        n = args.lines
+        follower = LogFollower(max_lines=n)
+        follower.tail(path)
+
+        old_ms, old = best_of(lambda: old_tail(path, n), args.repeat)
+        tail_ms, new = best_of(lambda: [line.strip() for line in tail_lines(path, n)], args.repeat)
+        print('log %.1f MB, last %d lines' % (os.path.getsize(path) / 1024 ** 2, n))
+        print('%-26s %12s %8s' % ('read', 'ms', 'match'))
+        print('%-26s %12.2f %8s' % ('readlines()[-n:]', old_ms, '-'))
+        print('%-26s %12.3f %8s' % ('tail_lines', tail_ms, new == old))
+
+        # a refresh after the job appended some lines: only the new bytes are read
+        write_log(path, 4096, seed=1)
+        follow_ms, new = best_of(lambda: [line.strip() for line in follower.tail(path)], 1)
+        print('%-26s %12.3f %8s' % ('LogFollower after append', follow_ms, new == old_tail(path, n)))
+
+        httpd = serve_logs(tmp_dir, host='127.0.0.1')
+        tracemalloc.start()
+        start = time.time()
+        nbytes = 0
+        with urlopen('http://127.0.0.1:%d/%s' % (httpd.server_address[1], os.path.basename(path))) as response:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                nbytes += len(chunk)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        httpd.shutdown()
+        print('download: %d of %d bytes in %.0f ms, peak Python memory %.1f MB (server and client)' % (
+            nbytes, os.path.getsize(path), (time.time() - start) * 1000, peak / 1024 ** 2))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
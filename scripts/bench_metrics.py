@@ -0,0 +1,108 @@
+"""Compare the per-step `.item()` metrics of the run managers (AverageMeter per metric, one read back each)
+against disparity_metrics + MetricAccumulator, which read back every `--print-frequency` steps
+
+The reference computes EPE with F.l1_loss over the masked pixels and D1 / thres1-3 as d1_metric and
+thres_metric of AANet do. Disparities are synthetic, KITTI sized by default.
+
+Usage (from the repository root):
+    python scripts/bench_metrics.py --batch-size 2 --steps 50 --print-frequency 10
+"""
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from ofa.imagenet_classification.run_manager.metrics import MetricAccumulator, sync_step
+from ofa.stereo_matching.run_manager.metrics import DISPARITY_METRICS, disparity_metrics
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch-size', type=int, default=2)
+parser.add_argument('--height', type=int, default=384)
+parser.add_argument('--width', type=int, default=1248)
+parser.add_argument('--steps', type=int, default=50)
+parser.add_argument('--print-frequency', type=int, default=10)
+parser.add_argument('--repeat', type=int, default=3, help='best of this many passes')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+
+
+class AverageMeter(object):
+
+    def __init__(self):
+        self.sum = 0.
+        self.count = 0
+
+    def update(self, val, n=1):
+        self.sum += val * n
+        self.count += n
+
+    @property
+    def avg(self):
+        return self.sum / self.count
+
+
+def reference_metrics(pred_disp, gt_disp, mask):
+    epe = F.l1_loss(gt_disp[mask], pred_disp[mask], reduction='mean')
+    gt, pred = gt_disp[mask], pred_disp[mask]
+    err = (gt - pred).abs()
+    d1 = ((err > 3) & (err / gt > 0.05)).float().mean()
+    thres = [(err > t).float().mean() for t in (1., 2., 3.)]
+    return [epe, d1] + thres
+
+
+def run_reference(samples):
+    meters = {key: AverageMeter() for key in DISPARITY_METRICS}
+    for pred_disp, gt_disp in samples:
+        mask = (gt_disp > 0) & (gt_disp < 192)
+        for key, val in zip(DISPARITY_METRICS, reference_metrics(pred_disp, gt_disp, mask)):
+            meters[key].update(val.item(), pred_disp.size(0))
+    return [meters[key].avg for key in DISPARITY_METRICS]
+
+
+def run_accumulator(samples, print_frequency):
+    acc = MetricAccumulator(DISPARITY_METRICS)
+    for i, (pred_disp, gt_disp) in enumerate(samples):
+        mask = (gt_disp > 0) & (gt_disp < 192)
+        acc.update(disparity_metrics(pred_disp, gt_disp, mask), pred_disp.size(0))
+        acc.values(sync=sync_step(i, len(samples), print_frequency))
+    return acc.values(return_dict=False)
+
+
+def bench(fn, repeat, device):
+    times = []
+    for _ in range(repeat):
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        start = time.time()
+        fn()
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def main(args):
+    torch.manual_seed(0)
+    shape = (args.batch_size, args.height, args.width)
+    samples = []
+    for _ in range(args.steps):
+        gt_disp = torch.rand(shape, device=args.device) * 200
+        gt_disp[torch.rand(shape, device=args.device) < 0.7] = 0  # sparse ground truth, as KITTI
+        pred_disp = (gt_disp + torch.randn(shape, device=args.device) * 3).clamp(min=0)
+        samples.append((pred_disp, gt_disp))
+
+    ref = run_reference(samples)
+    out = run_accumulator(samples, args.print_frequency)
+    print('%-8s %14s %14s %10s' % ('metric', '.item() path', 'accumulator', 'abs diff'))
+    for key, r, o in zip(DISPARITY_METRICS, ref, out):
+        print('%-8s %14.6f %14.6f %10.2g' % (key, r, o, abs(r - o)))
+
+    ref_ms = bench(lambda: run_reference(samples), args.repeat, args.device)
+    acc_ms = bench(lambda: run_accumulator(samples, args.print_frequency), args.repeat, args.device)
+    print('%-24s %12s %14s' % ('path', 'ms/step', 'syncs/step'))
+    print('%-24s %12.3f %14d' % ('.item() per metric', ref_ms / args.steps, len(DISPARITY_METRICS)))
+    print('%-24s %12.3f %14.2f' % ('MetricAccumulator', acc_ms / args.steps, 1. / args.print_frequency))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
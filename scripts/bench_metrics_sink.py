@@ -0,0 +1,93 @@
+"""Time the training loop cost of logging metrics inline (as the loops called wandb.log) against MetricsSink,
+with a backend that sleeps `--latency-ms` per call to stand in for the network, and check what the JSONL
+and CSV backends write and how overflow drops records
+
+Usage (from the repository root):
+    python scripts/bench_metrics_sink.py --records 200 --latency-ms 20
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from ofa.imagenet_classification.run_manager.metrics_sink import MetricsSink, NullBackend, build_metrics_sink
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', type=int, default=200)
+parser.add_argument('--latency-ms', type=float, default=20, help='time per call of the slow backend')
+parser.add_argument('--step-ms', type=float, default=1, help='time between two records, spent sleeping')
+
+
+class SlowBackend(NullBackend):
+    """One network round trip per call, as wandb.log per record"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.records = 0
+
+    def write(self, records):
+        self.calls += 1
+        self.records += len(records)
+        time.sleep(self.latency)
+
+
+def timed_loop(log, n, step):
+    stalls = []
+    for i in range(n):
+        start = time.time()
+        log({'train_loss_iters': 1. / (i + 1)}, step=i)
+        stalls.append(time.time() - start)
+        time.sleep(step)
+    return stalls
+
+
+def main(args):
+    latency, step = args.latency_ms / 1000, args.step_ms / 1000
+
+    inline = SlowBackend(latency)
+    inline_stalls = timed_loop(lambda metrics, step: inline.write([(time.time(), step, metrics)]), args.records,
+                               step)
+
+    slow = SlowBackend(latency)
+    sink = MetricsSink([slow], batch_size=50, flush_interval=0.5)
+    sink_stalls = timed_loop(sink.log, args.records, step)
+    start = time.time()
+    sink.flush()
+    flush_time = time.time() - start
+    sink.close()
+
+    print('%-12s %16s %16s %14s' % ('logging', 'stall/log (ms)', 'max stall (ms)', 'backend calls'))
+    for name, stalls, backend in [('inline', inline_stalls, inline), ('MetricsSink', sink_stalls, slow)]:
+        print('%-12s %16.3f %16.3f %14d' % (name, sum(stalls) / len(stalls) * 1000, max(stalls) * 1000,
+                                            backend.calls))
+    print('MetricsSink: %d records written, flush waited %.1f ms' % (slow.records, flush_time * 1000))
+
+    # a stalled backend: the loop goes on and the oldest records are dropped
+    stalled = SlowBackend(10.)
+    sink = MetricsSink([stalled], capacity=100, batch_size=10, flush_interval=0.)
+    stalls = timed_loop(sink.log, 1000, 0)
+    print('stalled backend: max stall %.3f ms, %d of 1000 records dropped' % (max(stalls) * 1000, sink.dropped))
+    sink.close(timeout=0)  # do not wait for the stalled writes at exit
+
+    out_dir = tempfile.mkdtemp(prefix='metrics_')
+    try:
+        sink = build_metrics_sink('jsonl,csv', log_dir=out_dir)
+        for i in range(args.records):
+            sink.log({'train_loss_iters': 1. / (i + 1), 'val_loss': None}, step=i)
+        sink.close()
+        with open(os.path.join(out_dir, 'metrics.jsonl')) as fin:
+            rows = [json.loads(line) for line in fin]
+        with open(os.path.join(out_dir, 'metrics.csv'), newline='') as fin:
+            csv_rows = list(csv.DictReader(fin))
+        ordered = [row['step'] for row in rows] == list(range(args.records))
+        print('jsonl: %d records, in order: %s; csv: %d rows (2 per record)' % (len(rows), ordered, len(csv_rows)))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
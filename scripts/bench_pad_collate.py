@@ -0,0 +1,115 @@
+"""Compare per-sample KITTI padding in the dataset against PadCollate, which pads while collating
+
+Samples are synthetic KITTI-sized images (375x1242, 370x1226, 376x1241, 374x1238). Checks that the
+batches and the RandomCrop(pad_to=...) crops match the padded pipeline under the same seed, then
+times validation batches (full images) through a DataLoader.
+
+Usage (from the repository root):
+    python scripts/bench_pad_collate.py --batch-size 4 --num-samples 32 --workers 0 2
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from ofa.stereo_matching.data_providers import transforms
+from ofa.stereo_matching.data_providers.collate import PadCollate, crop_padded
+from ofa.stereo_matching.data_providers.dataset import KITTI_PAD_SIZE
+
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+SIZES = [(375, 1242), (370, 1226), (376, 1241), (374, 1238)]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch-size', type=int, default=4)
+parser.add_argument('--num-samples', type=int, default=32)
+parser.add_argument('--workers', type=int, nargs='+', default=[0, 2])
+parser.add_argument('--repeat', type=int, default=3, help='best of this many passes')
+
+
+class SyntheticKITTI(Dataset):
+    """Decoded KITTI samples, padded as StereoDataset does if `pad`"""
+
+    def __init__(self, n, pad, transform):
+        rs = np.random.RandomState(0)
+        self.samples = []
+        for h, w in SIZES:
+            self.samples.append({'left': rs.randint(0, 256, (h, w, 3)).astype(np.float32),
+                                 'right': rs.randint(0, 256, (h, w, 3)).astype(np.float32),
+                                 'disp': rs.rand(h, w).astype(np.float32) * 192})
+        self.n = n
+        self.pad = pad
+        self.transform = transform
+
+    def __getitem__(self, index):
+        sample = {key: value.copy() for key, value in self.samples[index % len(self.samples)].items()}
+        if self.pad:
+            h, w = sample['left'].shape[:2]
+            top_pad, left_pad = KITTI_PAD_SIZE[0] - h, KITTI_PAD_SIZE[1] - w
+            for key in ['left', 'right', 'disp']:
+                pad_width = ((top_pad, 0), (left_pad, 0)) + ((0, 0),) * (sample[key].ndim - 2)
+                sample[key] = np.pad(sample[key], pad_width, mode='constant', constant_values=0)
+        return self.transform(sample)
+
+    def __len__(self):
+        return self.n
+
+
+def bench(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def main(args):
+    to_tensor = transforms.ToNormalizedTensor(MEAN, STD)
+    fill = [-m / s for m, s in zip(MEAN, STD)]
+
+    # full images, as in validation
+    padded = SyntheticKITTI(args.num_samples, True, to_tensor)
+    unpadded = SyntheticKITTI(args.num_samples, False, to_tensor)
+    collate = PadCollate(*KITTI_PAD_SIZE, image_fill=fill)
+    n = args.batch_size
+    ref = torch.utils.data.default_collate([padded[i] for i in range(n)])
+    out = collate([unpadded[i] for i in range(n)])
+    max_diff = max((ref[key] - out[key]).abs().max().item() for key in ['left', 'right', 'disp'])
+    crop_ok = all(torch.equal(c, unpadded[i]['disp']) for i, c in enumerate(crop_padded(out['disp'], out['ori_size'])))
+    print('PadCollate vs padded samples: max diff %.3g, crop_padded restores the samples: %s' % (max_diff, crop_ok))
+
+    # training crops, the crop window is drawn in the padded frame
+    crop_diff = 0.
+    for seed in range(20):
+        sample = {key: value.copy() for key, value in unpadded.samples[seed % len(SIZES)].items()}
+        np.random.seed(seed)
+        virtual = transforms.RandomCrop(336, 960, pad_to=KITTI_PAD_SIZE)(dict(sample))
+        h, w = sample['left'].shape[:2]
+        for key in ['left', 'right', 'disp']:
+            pad_width = ((KITTI_PAD_SIZE[0] - h, 0), (KITTI_PAD_SIZE[1] - w, 0)) + ((0, 0),) * (sample[key].ndim - 2)
+            sample[key] = np.pad(sample[key], pad_width, mode='constant', constant_values=0)
+        np.random.seed(seed)
+        real = transforms.RandomCrop(336, 960)(sample)
+        crop_diff = max(crop_diff, max(np.abs(virtual[key] - real[key]).max() for key in ['left', 'right', 'disp']))
+    print('RandomCrop(pad_to) vs crops of padded samples: max diff %.3g' % crop_diff)
+
+    print('%-24s %8s %14s' % ('pipeline', 'workers', 'ms/batch'))
+    for workers in args.workers:
+        for name, dataset, collate_fn in [('np.pad per sample', padded, None),
+                                          ('PadCollate', unpadded, PadCollate(*KITTI_PAD_SIZE, image_fill=fill))]:
+            loader = DataLoader(dataset, batch_size=n, num_workers=workers, collate_fn=collate_fn,
+                                persistent_workers=workers > 0)
+
+            def run():
+                for batch in loader:
+                    batch['left'].sum()
+
+            run()  # start the workers
+            print('%-24s %8d %14.2f' % (name, workers, bench(run, args.repeat) / len(loader)))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
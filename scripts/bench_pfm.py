@@ -0,0 +1,84 @@
+"""Compare the memory-mapped PFM reader against ofa.utils.file_io.read_disp on a synthetic corpus
+
+Usage (from the repository root):
+    python scripts/bench_pfm.py --num-files 200 --resolution 540x960 --crop 384x768
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from ofa.utils.file_io import read_disp
+from ofa.stereo_matching.data_providers.pfm import read_pfm_disp, read_pfm_batch
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num-files', type=int, default=200)
+parser.add_argument('--resolution', type=str, default='540x960')
+parser.add_argument('--crop', type=str, default='384x768')
+parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+parser.add_argument('--repeat', type=int, default=5, help='best of this many passes over the corpus')
+parser.add_argument('--corpus', type=str, default=None, help='directory to keep the corpus in, temporary if None')
+
+
+def write_pfm(filename, data, little_endian=True):
+    with open(filename, 'wb') as fp:
+        fp.write(b'Pf\n%d %d\n%s\n' % (data.shape[1], data.shape[0], b'-1.0' if little_endian else b'1.0'))
+        np.flipud(data).astype('<f4' if little_endian else '>f4').tofile(fp)
+
+
+def bench(fn, n, repeat):
+    """Best ms per file of `repeat` calls of fn(), which reads n files"""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append((time.time() - start) / n * 1000)
+    return min(times)
+
+
+def main(args):
+    h, w = [int(x) for x in args.resolution.split('x')]
+    ch, cw = [int(x) for x in args.crop.split('x')]
+    corpus = args.corpus or tempfile.mkdtemp(prefix='pfm_')
+    os.makedirs(corpus, exist_ok=True)
+    rs = np.random.RandomState(0)
+    try:
+        filenames = []
+        for i in range(args.num_files):
+            filenames.append(os.path.join(corpus, '%04d.pfm' % i))
+            # every 4th file big endian, as written by some tools
+            write_pfm(filenames[-1], rs.rand(h, w).astype(np.float32) * 300, little_endian=i % 4 != 0)
+        crops = [(rs.randint(h - ch + 1), rs.randint(w - cw + 1), ch, cw) for _ in filenames]
+
+        max_diff = 0.
+        for f, (top, left, _, _) in zip(filenames[:8], crops):
+            ref = read_disp(f)
+            for subset in [False, True]:
+                ref_s = -ref if subset else ref
+                max_diff = max(max_diff, np.abs(read_pfm_disp(f, subset=subset) - ref_s).max(),
+                               np.abs(read_pfm_disp(f, subset=subset, crop=(top, left, ch, cw)) -
+                                      ref_s[top:top + ch, left:left + cw]).max())
+        print('max diff vs read_disp (full, crop, subset): %g' % max_diff)
+
+        # the corpus is in the page cache after writing, so this compares parsing and copying
+        n = len(filenames)
+        ref_time = bench(lambda: [read_disp(f) for f in filenames], n, args.repeat)
+        full_time = bench(lambda: [read_pfm_disp(f) for f in filenames], n, args.repeat)
+        crop_time = bench(lambda: [read_pfm_disp(f, crop=c) for f, c in zip(filenames, crops)], n, args.repeat)
+        print('%-24s %12s %10s' % ('reader', 'ms/file', 'speedup'))
+        print('%-24s %12.3f %10s' % ('read_disp', ref_time, '-'))
+        print('%-24s %12.3f %9.2fx' % ('read_pfm_disp', full_time, ref_time / full_time))
+        print('%-24s %12.3f %9.2fx' % ('read_pfm_disp crop', crop_time, ref_time / crop_time))
+        for threads in args.threads:
+            batch_time = bench(lambda: read_pfm_batch(filenames, crops=crops, num_threads=threads), n, args.repeat)
+            print('%-24s %12.3f %9.2fx' % ('batch crop, %d threads' % threads, batch_time, ref_time / batch_time))
+    finally:
+        if args.corpus is None:
+            shutil.rmtree(corpus)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
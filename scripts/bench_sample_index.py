@@ -0,0 +1,116 @@
+"""Memory of the StereoDataset sample index in forked DataLoader workers, packed vs a list of dicts
+
+Each worker walks the whole index as a training epoch would (no images are read) and reports how
+much of its memory became private, i.e. was copied from the parent on write, and its RSS. The list
+of dicts is the former `StereoDataset.samples`, rebuilt from the packed index.
+
+Usage (from the repository root, the filename lists are read from filenames/):
+    python scripts/bench_sample_index.py --dataset SceneFlow --mode test --workers 4 --replicate 20
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from ofa.stereo_matching.data_providers.dataset import StereoDataset
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data-dir', type=str, default='/mnt/SceneFlow')
+parser.add_argument('--dataset', type=str, default='SceneFlow')
+parser.add_argument('--mode', type=str, default='test')
+parser.add_argument('--workers', type=int, default=4)
+parser.add_argument('--replicate', type=int, default=20,
+                    help='repeat the filename list this many times, to emulate larger lists')
+
+
+def memory_kb():
+    """(rss, private) in kB of the current process from /proc/self/smaps_rollup"""
+    fields = {}
+    with open('/proc/self/smaps_rollup', 'r') as fp:
+        for line in fp:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Rss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+class IndexProbe(Dataset):
+    """Touches the paths of every sample like StereoDataset.__getitem__, returns the worker memory"""
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __getitem__(self, index):
+        sample_path = self.samples[index]
+        n = len(sample_path['left']) + len(sample_path['right'])
+        rss, private = 0, 0
+        if index % 500 == 0:
+            # the collector traverses every tracked object, as it does during training
+            gc.collect()
+            rss, private = memory_kb()
+        return torch.utils.data.get_worker_info().id, rss, private, n
+
+    def __len__(self):
+        return len(self.samples)
+
+
+def worker_memory(samples, workers):
+    # shuffled, so that every worker touches samples all over the index
+    loader = DataLoader(IndexProbe(samples), batch_size=256, num_workers=workers, shuffle=True)
+    peak = {}
+    for ids, rss, private, _ in loader:
+        for i, r, p in zip(ids.tolist(), rss.tolist(), private.tolist()):
+            peak[i] = (max(peak.get(i, (0, 0))[0], r), max(peak.get(i, (0, 0))[1], p))
+    return [peak[i] for i in sorted(peak)]
+
+
+def main(args):
+    # replicate the filename list into a temporary filenames/ directory
+    workdir = tempfile.mkdtemp(prefix='sample_index_')
+    try:
+        shutil.copytree('filenames', os.path.join(workdir, 'filenames'))
+        probe = StereoDataset(args.data_dir, dataset_name=args.dataset, mode=args.mode)
+        for root, _, files in os.walk(os.path.join(workdir, 'filenames')):
+            for f in files:
+                with open(os.path.join(root, f), 'r') as fp:
+                    lines = fp.read().splitlines()
+                with open(os.path.join(root, f), 'w') as fp:
+                    fp.write('\n'.join(lines * args.replicate) + '\n')
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            dataset = StereoDataset(args.data_dir, dataset_name=args.dataset, mode=args.mode)
+        finally:
+            os.chdir(cwd)
+        assert len(dataset) == len(probe) * args.replicate
+
+        legacy = [dataset.samples[i] for i in range(len(dataset))]
+        assert legacy[-1] == probe.samples[len(probe) - 1]
+        legacy_bytes = sys.getsizeof(legacy) + sum(sys.getsizeof(s) + sum(sys.getsizeof(v) for v in s.values())
+                                                   for s in legacy)
+        print('%d samples: packed index %.2f MB, list of dicts %.2f MB' % (
+            len(dataset), dataset.samples.nbytes / 1024 ** 2, legacy_bytes / 1024 ** 2))
+
+        results = {}
+        # the parent holds both versions, the workers of each run only touch their own
+        for name, samples in [('packed', dataset.samples), ('list of dicts', legacy)]:
+            results[name] = worker_memory(samples, args.workers)
+
+        print('%-16s %8s %12s %16s' % ('index', 'worker', 'RSS (MB)', 'private (MB)'))
+        for name, peaks in results.items():
+            for i, (rss, private) in enumerate(peaks):
+                print('%-16s %8d %12.1f %16.1f' % (name, i, rss / 1024, private / 1024))
+            print('%-16s %8s %12.1f %16.1f' % (name, 'mean', np.mean([p[0] for p in peaks]) / 1024,
+                                               np.mean([p[1] for p in peaks]) / 1024))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
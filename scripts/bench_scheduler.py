@@ -0,0 +1,116 @@
+"""Replay a random stream of training job requests on the GPU nodes of net_utils.settings with a FakeLauncher
+in place of mpirun, launched immediately as trainer.train_class did and through the Scheduler (strict
+priority, and with backfill), and report oversubscribed slots, makespan, utilization and waiting times
+
+Usage (from the repository root):
+    python scripts/bench_scheduler.py --jobs 40 --nodes host1:2,host2:2,host3:4 --time-scale 0.01
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import FakeLauncher, Scheduler, format_hosts, parse_hosts  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--jobs', type=int, default=40)
+parser.add_argument('--nodes', type=str, default=None, help='e.g. host1:2,host2:2, GPU_NODES of the settings by default')
+parser.add_argument('--time-scale', type=float, default=0.01, help='seconds per simulated minute')
+parser.add_argument('--seed', type=int, default=0)
+
+
+def make_requests(nodes, n, seed):
+    rs = random.Random(seed)
+    sizes = sorted(set([1, 2] + list(nodes.values()) + [sum(nodes.values())]))
+    requests = []
+    arrival = 0.
+    for i in range(n):
+        arrival += rs.expovariate(1. / 10)
+        requests.append({'name': 'job%d' % i, 'jtype': rs.choice(['class', 'stereo']), 'slots': rs.choice(sizes),
+                         'priority': rs.choice([0, 0, 0, 1]), 'arrival': arrival,
+                         'duration': rs.uniform(10, 60)})
+    return requests
+
+
+def replay_naive(nodes, requests):
+    # every request is fired at once on the first nodes, like the checkboxes of training_manager.py
+    used = dict.fromkeys(nodes, 0)
+    running = []
+    worst = 0
+    for req in requests:
+        now = req['arrival']
+        for end, allocation in list(running):
+            if end <= now:
+                running.remove((end, allocation))
+                for host, n in allocation.items():
+                    used[host] -= n
+        allocation, remaining = {}, req['slots']
+        for host in nodes:
+            if remaining <= 0:
+                break
+            allocation[host] = min(nodes[host], remaining)
+            remaining -= allocation[host]
+        for host, n in allocation.items():
+            used[host] += n
+        running.append((now + req['duration'], allocation))
+        worst = max(worst, max(used[h] - nodes[h] for h in nodes))
+    return worst
+
+
+def replay(nodes, requests, scale, backfill):
+    durations = {req['name']: req['duration'] * scale for req in requests}
+    launcher = FakeLauncher(duration=lambda r: durations[r.name])
+    scheduler = Scheduler(nodes, launcher, backfill=backfill)
+    start = time.time()
+    pending = list(requests)
+    submitted = {}
+    busy_time = 0.
+    worst = 0
+    last = start
+    while pending or scheduler.queue or scheduler.running:
+        now = time.time()
+        while pending and pending[0]['arrival'] * scale <= now - start:
+            req = pending.pop(0)
+            scheduler.submit(req['name'], req['jtype'], req['slots'], priority=req['priority'])
+            submitted[req['name']] = now
+        scheduler.poll()
+        used = {h: nodes[h] - scheduler.free[h] for h in nodes}
+        worst = max(worst, max(used[h] - nodes[h] for h in nodes))
+        busy_time += sum(used.values()) * (now - last)
+        last = now
+        time.sleep(scale / 20)
+    makespan = time.time() - start
+    waits = [(t - submitted[r.name]) / scale for r, hosts, num_procs, t in launcher.launches]
+    # every launch got the slots it asked for, on known hosts
+    ok = all(sum(parse_hosts(hosts).values()) == num_procs == r.slots and set(parse_hosts(hosts)) <= set(nodes)
+             for r, hosts, num_procs, t in launcher.launches)
+    ok = ok and len(launcher.launches) == len(requests) and scheduler.free == nodes
+    return {'makespan': makespan / scale, 'utilization': busy_time / (makespan * sum(nodes.values())),
+            'mean_wait': sum(waits) / len(waits), 'max_wait': max(waits), 'oversubscribed': worst, 'ok': ok}
+
+
+def main(args):
+    if args.nodes is None:
+        from net_utils.settings import GPU_NODES
+        nodes = dict(GPU_NODES)
+    else:
+        nodes = parse_hosts(args.nodes)
+    requests = make_requests(nodes, args.jobs, args.seed)
+    print('nodes %s, %d jobs of %s slots' % (format_hosts(nodes), len(requests),
+                                            sorted(set(r['slots'] for r in requests))))
+    print('%-22s %14s %12s %10s %10s %8s %8s' % ('launch', 'oversubscribed', 'makespan', 'util', 'mean wait',
+                                                 'max wait', 'ok'))
+    print('%-22s %14d %12s %10s %10s %8s %8s' % ('immediately (before)', replay_naive(nodes, requests), '-', '-', '-',
+                                                 '-', '-'))
+    for name, backfill in [('Scheduler', False), ('Scheduler backfill', True)]:
+        r = replay(nodes, requests, args.time_scale, backfill)
+        print('%-22s %14d %12.1f %10.2f %10.1f %8.1f %8s' % (name, r['oversubscribed'], r['makespan'],
+                                                             r['utilization'], r['mean_wait'], r['max_wait'], r['ok']))
+    print('(times in simulated minutes; oversubscribed: most MPI processes beyond the GPUs of a node)')
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
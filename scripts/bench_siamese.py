@@ -0,0 +1,70 @@
+"""Latency of OFAAANet with separate and siamese batched left/right feature extraction on CPU
+
+Usage (from the repository root):
+    python scripts/bench_siamese.py --batch-sizes 1 2 4 --resolution 288x576
+"""
+import argparse
+import time
+
+import torch
+
+from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4])
+parser.add_argument('--resolution', type=str, default='288x576')
+parser.add_argument('--ks', type=int, default=7)
+parser.add_argument('--e', type=int, default=6)
+parser.add_argument('--d', type=int, default=4)
+parser.add_argument('--s', type=int, default=4)
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--threads', type=int, default=None)
+
+
+def bench(fn, repeat):
+    with torch.no_grad():
+        fn()  # warm up
+        start = time.time()
+        for _ in range(repeat):
+            fn()
+    return (time.time() - start) / repeat * 1000
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    img_h, img_w = [int(x) for x in args.resolution.split('x')]
+
+    net = OFAAANet(ks_list=[3, 5, 7], expand_ratio_list=[2, 4, 6, 8], depth_list=[2, 3, 4], scale_list=[2, 3, 4])
+    net.set_active_subnet(ks=args.ks, e=args.e, d=args.d, s=args.s)
+    net.eval()
+
+    def features(left, right):
+        return net.siamese_feature_extraction(left, right)
+
+    print('%-3s %14s %14s %8s %14s %14s %8s %10s' % ('bs', 'feat sep(ms)', 'feat sia(ms)', 'speedup',
+                                                    'full sep(ms)', 'full sia(ms)', 'speedup', 'max_diff'))
+    for bs in args.batch_sizes:
+        left = torch.randn(bs, 3, img_h, img_w)
+        right = torch.randn(bs, 3, img_h, img_w)
+
+        with torch.no_grad():
+            net.siamese_batching = False
+            ref = net(left, right)
+            net.siamese_batching = True
+            out = net(left, right)
+        max_diff = max((a - b).abs().max().item() for a, b in zip(out, ref))
+
+        times = []
+        for siamese in [False, True]:
+            net.siamese_batching = siamese
+            times.append((bench(lambda: features(left, right), args.repeat),
+                          bench(lambda: net(left, right), args.repeat)))
+        (feat_sep, full_sep), (feat_sia, full_sia) = times
+        print('%-3d %14.2f %14.2f %7.2fx %14.2f %14.2f %7.2fx %10.3g' % (
+            bs, feat_sep, feat_sia, feat_sep / feat_sia, full_sep, full_sia, full_sep / full_sia, max_diff))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
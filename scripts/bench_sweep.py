@@ -0,0 +1,115 @@
+"""Run an lr/bs sweep of stereo trials with a FakeLauncher in place of mpirun: every fake trial writes tqdm
+`Validate Epoch` bars with a synthetic EPE curve into its job log, which Sweep reads back through LogIndex.
+Compares running the trials one at a time, packed on the GPU slots, and packed with successive halving,
+by makespan, GPU time and whether the best config is found
+
+Usage (from the repository root):
+    python scripts/bench_sweep.py --nodes host1:2,host2:2 --epochs 9 --time-scale 0.1
+"""
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import FakeLauncher, Scheduler, parse_hosts  # noqa: E402
+from sweep import Sweep, grid_configs, halving_rungs  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--nodes', type=str, default='host1:2,host2:2')
+parser.add_argument('--epochs', type=int, default=9)
+parser.add_argument('--time-scale', type=float, default=0.1, help='seconds per simulated epoch')
+parser.add_argument('--eta', type=int, default=3)
+
+SPACE = {'lr': [0.0005, 0.001, 0.002, 0.004, 0.008, 0.016], 'bs': [1, 2, 4]}
+
+
+def final_epe(config):
+    # best around lr=0.002, bs=2
+    return 1. + 0.3 * math.log2(config['lr'] / 0.002) ** 2 + 0.2 * abs(math.log2(config['bs'] / 2.))
+
+
+def epe_curve(config, epoch):
+    return final_epe(config) + 2. / epoch
+
+
+class LoggingLauncher(FakeLauncher):
+    # a fake trial: one validation per epoch written to logs/<trial>_stereo.log while its process runs
+    def __init__(self, log_root, epochs, scale):
+        super(LoggingLauncher, self).__init__(duration=epochs * scale)
+        self.log_root = log_root
+        self.scale = scale
+        self.epochs = epochs
+        self.trials = []
+
+    def __call__(self, request, hosts, num_procs):
+        process = super(LoggingLauncher, self).__call__(request, hosts, num_procs)
+        self.trials.append((request, process, process.end_time - self.duration, [0]))
+        return process
+
+    def write_logs(self):
+        now = time.time()
+        for request, process, start, written in self.trials:
+            end = now if process.returncode is None else min(now, process.end_time)
+            epochs = min(self.epochs, int((end - start) / self.scale + 1e-6))
+            with open(os.path.join(self.log_root, '%s_stereo.log' % request.name), 'a') as fout:
+                for epoch in range(written[0] + 1, epochs + 1):
+                    with tqdm(total=4, desc='Validate Epoch #{} {}'.format(epoch, ''), file=fout, mininterval=0,
+                              ascii=True) as t:
+                        for _ in range(4):
+                            t.set_postfix({'loss': 1., 'epe': epe_curve(request.kwargs, epoch), 'img_size': 384})
+                            t.update(1)
+            written[0] = max(written[0], epochs)
+
+
+def run(nodes, configs, args, tmp_dir, name, rungs, max_concurrent=None):
+    launcher = LoggingLauncher(tmp_dir, args.epochs, args.time_scale)
+    scheduler = Scheduler(nodes, launcher, backfill=True)
+    sweep = Sweep(name, 'stereo', configs, scheduler, slots=1, rungs=rungs, eta=args.eta,
+                  max_concurrent=max_concurrent, log_root=tmp_dir, ledger_dir=os.path.join(tmp_dir, 'sweeps'))
+    start = time.time()
+    while True:
+        scheduler.poll()
+        launcher.write_logs()
+        if sweep.step():
+            break
+        time.sleep(args.time_scale / 10)
+    makespan = (time.time() - start) / args.time_scale
+    gpu_epochs = sum(max(t['metrics']) if t['metrics'] else 0 for t in sweep.trials.values())
+    results = sweep.results()
+    # the ledger alone gives the same trials
+    ledger_ok = {n: (t['state'], t['metrics']) for n, t in sweep.ledger.trials().items()} == \
+        {n: (t['state'], t['metrics']) for n, t in sweep.trials.items()}
+    return makespan, gpu_epochs, results, ledger_ok
+
+
+def main(args):
+    nodes = parse_hosts(args.nodes)
+    configs = grid_configs(SPACE)
+    best = min(configs, key=final_epe)
+    print('%d configs of %s on %d GPUs, %d epochs per trial, best config %s' % (
+        len(configs), sorted(SPACE), sum(nodes.values()), args.epochs, best))
+    rungs = halving_rungs(1, args.eta, args.epochs)
+    print('%-26s %10s %10s %10s %8s %8s' % ('sweep', 'makespan', 'GPU epochs', 'stopped', 'best ok', 'ledger'))
+    tmp_dir = tempfile.mkdtemp(prefix='sweep_')
+    try:
+        for name, label, rungs_, concurrent in [('seq', 'one trial at a time', [], 1),
+                                                ('packed', 'packed', [], None),
+                                                ('halving', 'packed, halving %s' % rungs, rungs, None)]:
+            makespan, gpu_epochs, results, ledger_ok = run(nodes, configs, args, tmp_dir, name, rungs_, concurrent)
+            stopped = sum(1 for r in results if r[2] == 'stopped')
+            print('%-26s %10.1f %10d %10d %8s %8s' % (label, makespan, gpu_epochs, stopped, results[0][1] == best,
+                                                      ledger_ok))
+    finally:
+        shutil.rmtree(tmp_dir)
+    print('(makespan in epochs)')
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+"""Compare ToTensor + Normalize against the fused ToNormalizedTensor and against uint8 batches normalized
+after collation, per sample and through a DataLoader with worker processes
+
+Usage (from the repository root):
+    python scripts/bench_to_tensor.py --resolution 384x768 --batch-size 8 --workers 2
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from ofa.stereo_matching.data_providers import transforms
+
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolution', type=str, default='384x768', help='crop size as fed to the conversion')
+parser.add_argument('--batch-size', type=int, default=8)
+parser.add_argument('--num-samples', type=int, default=64)
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--repeat', type=int, default=3, help='best of this many passes')
+
+
+class RandomStereo(Dataset):
+    """Float32 [H, W, 3] images holding 0-255 integers, as after RandomCrop and RandomColor"""
+
+    def __init__(self, n, h, w, transform):
+        rs = np.random.RandomState(0)
+        self.imgs = rs.randint(0, 256, (4, h, w, 3)).astype(np.float32)
+        self.disp = rs.rand(h, w).astype(np.float32) * 192
+        self.n = n
+        self.transform = transform
+
+    def __getitem__(self, index):
+        sample = {'left': self.imgs[index % 4].copy(), 'right': self.imgs[(index + 1) % 4].copy(),
+                  'disp': self.disp.copy()}
+        return sample if self.transform is None else self.transform(sample)
+
+    def __len__(self):
+        return self.n
+
+
+def bench(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def main(args):
+    h, w = [int(x) for x in args.resolution.split('x')]
+    pipelines = [
+        ('ToTensor + Normalize', transforms.Compose([transforms.ToTensor(), transforms.Normalize(MEAN, STD)])),
+        ('ToNormalizedTensor', transforms.ToNormalizedTensor(MEAN, STD)),
+        ('ToUint8Tensor', transforms.ToUint8Tensor()),
+    ]
+
+    dataset = RandomStereo(args.num_samples, h, w, None)
+    ref = pipelines[0][1](dataset[0])
+    for name, transform in pipelines[1:]:
+        out = transform(dataset[0])
+        max_diff = max((transforms.normalize_batch(out[key][None], MEAN, STD)[0] - ref[key]).abs().max().item()
+                       for key in ['left', 'right'])
+        print('%s vs ToTensor + Normalize: max diff %.3g' % (name, max_diff))
+
+    samples = [dataset[i] for i in range(args.num_samples)]
+    print('%-22s %14s %16s %14s' % ('pipeline', 'ms/sample', 'loader ms/batch', 'MB/batch'))
+    for name, transform in pipelines:
+        # the copy of the sample is part of both versions
+        sample_time = bench(lambda: [transform({k: v.copy() for k, v in s.items()}) for s in samples],
+                            args.repeat) / len(samples)
+
+        dataset.transform = transform
+        loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers,
+                            persistent_workers=args.workers > 0)
+        nbytes = []
+
+        def run_loader():
+            for batch in loader:
+                left = transforms.normalize_batch(batch['left'], MEAN, STD)
+                right = transforms.normalize_batch(batch['right'], MEAN, STD)
+                nbytes.append(sum(batch[k].numel() * batch[k].element_size() for k in ['left', 'right', 'disp']))
+
+        run_loader()  # start the workers
+        loader_time = bench(run_loader, args.repeat) / len(loader)
+        print('%-22s %14.3f %16.2f %14.2f' % (name, sample_time, loader_time, np.mean(nbytes) / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+"""Build the OFAAANet latency lookup table of this host and check it against measured subnets
+
+Usage (from the repository root):
+    python scripts/build_latency_table.py --resolutions 288x576 384x1248 --output latency/cpu_bs1.json
+"""
+import argparse
+import random
+import time
+
+import torch
+
+from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
+from ofa.stereo_matching.nas.efficiency_predictor import (AANetLatencyTable, build_aanet_latency_table,
+                                                          measure_latency)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolutions', type=str, nargs='+', default=['288x576'])
+parser.add_argument('--batch-size', type=int, default=1)
+parser.add_argument('--warmup', type=int, default=2)
+parser.add_argument('--repeat', type=int, default=10)
+parser.add_argument('--threads', type=int, default=None)
+parser.add_argument('--output', type=str, default='latency_table.json')
+parser.add_argument('--verify', type=int, default=5, help='number of random subnets to check the predictor on')
+
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    resolutions = [tuple(int(x) for x in r.split('x')) for r in args.resolutions]
+
+    net = OFAAANet(ks_list=[3, 5, 7], expand_ratio_list=[2, 4, 6, 8], depth_list=[2, 3, 4], scale_list=[2, 3, 4])
+    net.eval()
+
+    start = time.time()
+    lut = build_aanet_latency_table(net, resolutions, args.batch_size, args.warmup, args.repeat, logger=print)
+    table = AANetLatencyTable(lut=lut)
+    table.save(args.output)
+    print('saved %d entries to %s in %.1fs' % (len(lut['latency']), args.output, time.time() - start))
+
+    print('%-10s %-40s %12s %12s %8s %14s' % ('resolution', 'subnet', 'measured', 'predicted', 'error',
+                                             'predict(us)'))
+    for h, w in resolutions:
+        left = torch.randn(args.batch_size, 3, h, w)
+        right = torch.randn(args.batch_size, 3, h, w)
+        for _ in range(args.verify):
+            subnet = net.sample_active_subnet()
+            net.aggregation.set_active_scale(subnet['s'])
+            measured = measure_latency(lambda: net(left, right), args.warmup, args.repeat)
+
+            start = time.time()
+            for _ in range(1000):
+                predicted = table.predict_latency(h=h, w=w, **subnet)
+            predict_time = (time.time() - start) * 1000
+
+            desc = 'ks%s e%s d%s s%d' % (''.join(map(str, subnet['ks'][:4])), ''.join(map(str, subnet['e'][:4])),
+                                         ''.join(map(str, subnet['d'])), subnet['s'])
+            print('%-10s %-40s %10.1fms %10.1fms %7.1f%% %14.1f' % (
+                '%dx%d' % (h, w), desc, measured, predicted, (predicted - measured) / measured * 100, predict_time))
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    main(parser.parse_args())
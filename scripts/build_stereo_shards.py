@@ -0,0 +1,71 @@
+"""Pack the samples of a stereo dataset into memory-mappable shards read by ShardedStereoDataset
+
+Usage (from the repository root, the filename lists are read from filenames/):
+    python scripts/build_stereo_shards.py --data-dir /mnt/SceneFlow --dataset SceneFlow --modes train test \
+        --output /mnt/shards
+    # then train with StereoDataProvider(..., shard_path='/mnt/shards')
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ofa.stereo_matching.data_providers.dataset import StereoDataset
+from ofa.stereo_matching.data_providers.shards import ShardedStereoDataset, shard_dir, write_stereo_shards
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data-dir', type=str, required=True)
+parser.add_argument('--dataset', type=str, default='SceneFlow')
+parser.add_argument('--modes', type=str, nargs='+', default=['train', 'test'])
+parser.add_argument('--output', type=str, required=True, help='shard root, one directory per dataset and mode')
+parser.add_argument('--disp-dtype', type=str, default='float32', choices=['float32', 'float16'])
+parser.add_argument('--shard-gb', type=float, default=1.)
+parser.add_argument('--threads', type=int, default=8, help='decoding threads')
+parser.add_argument('--load-pseudo-gt', action='store_true')
+parser.add_argument('--verify', type=int, default=20, help='compare and time this many samples against the files')
+
+
+def verify(dataset, sharded, n):
+    """Max difference per key and mean load time (ms) of StereoDataset and ShardedStereoDataset"""
+    indices = np.random.RandomState(0).choice(len(dataset), min(n, len(dataset)), replace=False)
+    max_diff = {}
+    times = [0., 0.]
+    for i in indices:
+        start = time.time()
+        ref = dataset[i]
+        times[0] += time.time() - start
+        start = time.time()
+        out = sharded[i]
+        # the files are read lazily, include touching the mapped pages
+        for key in ['left', 'right', 'disp']:
+            if key in out:
+                out[key].sum()
+        times[1] += time.time() - start
+        for key in ['left', 'right', 'disp', 'pseudo_disp']:
+            if key in ref:
+                diff = np.abs(ref[key].astype(np.float64) - out[key].astype(np.float64)).max()
+                max_diff[key] = max(max_diff.get(key, 0.), diff)
+    return max_diff, [t / len(indices) * 1000 for t in times]
+
+
+def main(args):
+    for mode in args.modes:
+        dataset = StereoDataset(args.data_dir, dataset_name=args.dataset, mode=mode,
+                                load_pseudo_gt=args.load_pseudo_gt)
+        out_dir = shard_dir(args.output, args.dataset, mode)
+
+        start = time.time()
+        write_stereo_shards(dataset, out_dir, shard_bytes=int(args.shard_gb * 1024 ** 3),
+                            disp_dtype=np.dtype(args.disp_dtype), num_threads=args.threads, logger=print)
+        print('%s %s: %d samples packed into %s in %.1fs' % (args.dataset, mode, len(dataset), out_dir,
+                                                             time.time() - start))
+
+        if args.verify > 0 and len(dataset) > 0:
+            sharded = ShardedStereoDataset(out_dir, load_pseudo_gt=args.load_pseudo_gt)
+            max_diff, (file_time, shard_time) = verify(dataset, sharded, args.verify)
+            print('max diff %s, load %.2fms from files, %.2fms from shards' % (
+                ', '.join('%s %.3g' % kv for kv in sorted(max_diff.items())), file_time, shard_time))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
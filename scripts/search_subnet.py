@@ -0,0 +1,134 @@
+"""Search OFAAANet subnets with the lowest EPE under latency or FLOPs constraints
+
+The EPE of each candidate is measured on a validation subset after re-estimating its BN
+statistics. The Pareto front of all evaluated subnets is written to --output, together with the
+fastest subnet within --max-epe if given.
+
+Usage (from the repository root):
+    python scripts/search_subnet.py --checkpoint exp/ofa_aanet/checkpoint/model_best.pth.tar \
+        --dataset-path data/SceneFlow --latency-table latency/cpu_bs1.json --constraints 300 500 800 \
+        --workers 4 --output search.json
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+import numpy as np
+import torch
+
+from ofa.stereo_matching.data_providers.stereo import StereoDataProvider
+from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
+from ofa.stereo_matching.nas.efficiency_predictor import AANetLatencyModel, AANetFLOPsModel
+from ofa.stereo_matching.nas.search_algorithm import (AANetArchManager, SubnetEPEEvaluator, ParallelEvaluator,
+                                                      StereoEvolutionFinder)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--dataset-path', type=str, default=None)
+parser.add_argument('--dataset', type=str, default='SceneFlow')
+parser.add_argument('--latency-table', type=str, default=None, help='constrain latency (ms), else FLOPs (M)')
+parser.add_argument('--resolution', type=str, default='576x960', help='image size the efficiency is computed at')
+parser.add_argument('--constraints', type=float, nargs='+', required=True)
+parser.add_argument('--max-epe', type=float, default=None, help='also report the fastest subnet within this EPE')
+parser.add_argument('--calib-images', type=int, default=100, help='training images to re-estimate BN on')
+parser.add_argument('--calib-batch-size', type=int, default=4)
+parser.add_argument('--valid-batches', type=int, default=10)
+parser.add_argument('--valid-batch-size', type=int, default=2)
+parser.add_argument('--population-size', type=int, default=16)
+parser.add_argument('--generations', type=int, default=10)
+parser.add_argument('--workers', type=int, default=0, help='evaluation processes, 0 to evaluate in place')
+parser.add_argument('--devices', type=str, nargs='+', default=None, help='e.g. cuda:0 cuda:1, per worker')
+parser.add_argument('--threads', type=int, default=1, help='torch threads per worker')
+parser.add_argument('--output', type=str, default='search.json')
+parser.add_argument('--seed', type=int, default=0)
+
+
+def finite_or_none(value):
+    # inf EPE (no valid disparity) is written as null, json.dump would write the non-standard Infinity
+    return value if math.isfinite(value) else None
+
+
+def record_to_dict(record):
+    epe, sample, efficiency = record
+    return {'epe': finite_or_none(epe), 'efficiency': efficiency, 'arch': sample}
+
+
+def main(args):
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    img_h, img_w = [int(x) for x in args.resolution.split('x')]
+
+    net = OFAAANet(ks_list=[3, 5, 7], expand_ratio_list=[2, 4, 6, 8], depth_list=[2, 3, 4], scale_list=[2, 3, 4])
+    init = torch.load(args.checkpoint, map_location='cpu')
+    net.load_state_dict(init['state_dict'] if 'state_dict' in init else init)
+    net.eval()
+
+    if args.latency_table is not None:
+        efficiency_predictor = AANetLatencyModel(args.latency_table, (img_h, img_w))
+        unit = 'ms'
+    else:
+        efficiency_predictor = AANetFLOPsModel(net, (img_h, img_w))
+        unit = 'MFLOPs'
+
+    data_provider = StereoDataProvider(save_path=args.dataset_path, dataset_name=args.dataset,
+                                       train_batch_size=args.calib_batch_size,
+                                       test_batch_size=args.valid_batch_size, n_worker=4)
+    calib_data = data_provider.build_sub_train_loader(args.calib_images, args.calib_batch_size)
+    valid_data = []
+    for sample in data_provider.valid:
+        valid_data.append(sample)
+        if len(valid_data) >= args.valid_batches:
+            break
+
+    device = args.devices[0] if args.devices is not None and args.workers == 0 else 'cpu'
+    evaluator = ParallelEvaluator(SubnetEPEEvaluator(net, calib_data, valid_data, device=device),
+                                  n_workers=args.workers, devices=args.devices, num_threads=args.threads)
+    finder = StereoEvolutionFinder(efficiency_predictor, evaluator, AANetArchManager(net),
+                                   population_size=args.population_size, max_time_budget=args.generations)
+
+    results = []
+    try:
+        for constraint in args.constraints:
+            start = time.time()
+            best_valids, best_info, front = finder.run_evolution_search(constraint, verbose=True)
+            print('constraint %.1f%s: epe %.3f at %.1f%s, %d subnets evaluated so far, %.0fs' % (
+                constraint, unit, best_info[0], best_info[2], unit, len(finder.history), time.time() - start))
+            results.append({
+                'constraint': constraint,
+                'best': record_to_dict(best_info),
+                'best_valids': [finite_or_none(epe) for epe in best_valids[1:]],
+                'pareto_front': [record_to_dict(record) for record in front],
+            })
+    finally:
+        evaluator.close()
+
+    front = finder.pareto_front()
+    print('%12s %8s   arch' % (unit, 'epe'))
+    for epe, sample, efficiency in front:
+        print('%12.1f %8.3f   %s' % (efficiency, epe, json.dumps(sample)))
+
+    output = {
+        'unit': unit,
+        'resolution': [img_h, img_w],
+        'searches': results,
+        'pareto_front': [record_to_dict(record) for record in front],
+    }
+    if args.max_epe is not None:
+        within = [record for record in front if record[0] <= args.max_epe]
+        output['fastest_within_max_epe'] = record_to_dict(within[0]) if len(within) > 0 else None
+        if len(within) > 0:
+            print('fastest subnet within epe %.3f: %.1f%s, epe %.3f' % (args.max_epe, within[0][2], unit,
+                                                                        within[0][0]))
+        else:
+            print('no evaluated subnet within epe %.3f' % args.max_epe)
+
+    with open(args.output, 'w') as fp:
+        json.dump(output, fp, indent=4, allow_nan=False)
+    print('saved to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
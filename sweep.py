@@ -0,0 +1,311 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from log_index import LogIndex
+
+# validation metric of the tqdm `Validate Epoch` lines per job type, and whether lower is better
+SWEEP_METRICS = {'stereo': ('epe', 'min'), 'class': ('top1', 'max')}
+# trial states; the last three are final
+TRIAL_STATES = ['pending', 'queued', 'done', 'failed', 'stopped']
+
+
+def grid_configs(space):
+    """Every combination of the values of `space`, {param: [values]}"""
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*[space[n] for n in names])]
+
+
+def random_configs(space, n, seed=0):
+    """`n` random configs of `space`
+
+    Args:
+        space: {param: values}, a list to choose from, (low, high) for a uniform float or
+            (low, high, 'log') for a log-uniform one, e.g. {'lr': (1e-4, 1e-2, 'log'), 'bs': [1, 2]}
+    """
+    rs = random.Random(seed)
+    configs = []
+    for _ in range(n):
+        config = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values, tuple):
+                low, high = values[:2]
+                if len(values) > 2 and values[2] == 'log':
+                    config[name] = math.exp(rs.uniform(math.log(low), math.log(high)))
+                else:
+                    config[name] = rs.uniform(low, high)
+            else:
+                config[name] = rs.choice(values)
+        configs.append(config)
+    return configs
+
+
+def halving_rungs(min_epochs, eta=3, max_epochs=None):
+    """Epochs at which successive halving keeps the best 1/eta of the trials: min_epochs * eta**k < max_epochs"""
+    rungs = [min_epochs]
+    while max_epochs is not None and rungs[-1] * eta < max_epochs:
+        rungs.append(rungs[-1] * eta)
+    return rungs if max_epochs is None or min_epochs < max_epochs else []
+
+
+def epoch_metrics(index, job, metric):
+    """{epoch: validation `metric`} of a job log in `index`, averaged over the validated subnets
+
+    A tqdm `Validate Epoch` bar shows the running average, its last step is the value of the epoch.
+    """
+    rows = index.query(job, columns=['epoch', 'subnet', 'step', 'total', metric], phase='valid')
+    last = (rows['step'] == rows['total']) & ~np.isnan(rows[metric])
+    values = {}
+    for epoch, value in zip(rows['epoch'][last], rows[metric][last]):
+        values.setdefault(int(epoch), []).append(float(value))
+    return {epoch: sum(v) / len(v) for epoch, v in values.items()}
+
+
+class SweepLedger(object):
+    """Append-only JSON-lines record of a sweep: its configs, the trial launches, metrics, exits and reruns
+
+    Each line is an event {'time', 'event', ...}; `trials` folds them into the state of every trial,
+    so a sweep can be summarized (or resumed) from the file alone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def append(self, event, **fields):
+        record = dict(time=time.time(), event=event, **fields)
+        with self._lock, open(self.path, 'a') as fout:
+            fout.write(json.dumps(record) + '\n')
+
+    def events(self):
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, 'r') as fin:
+            return [json.loads(line) for line in fin if line.strip()]
+
+    def trials(self):
+        """{trial name: {'config', 'state', 'metrics' {epoch: value}, 'exit_status', 'reason'}}"""
+        trials = {}
+        for e in self.events():
+            if e['event'] == 'trial':
+                trials[e['trial']] = {'config': e['config'], 'state': 'pending', 'metrics': {},
+                                      'exit_status': None, 'reason': None}
+            elif e['event'] == 'submit':
+                trials[e['trial']]['state'] = 'queued'
+            elif e['event'] == 'metric':
+                trials[e['trial']]['metrics'][e['epoch']] = e['value']
+            elif e['event'] == 'stop':
+                trials[e['trial']]['reason'] = e['reason']
+            elif e['event'] == 'exit':
+                trials[e['trial']].update(state=e['state'], exit_status=e['exit_status'])
+            elif e['event'] == 'reset':
+                trials[e['trial']].update(state='pending', metrics={}, exit_status=None, reason=None)
+        return trials
+
+
+class Sweep(object):
+    """Runs the trials of a hyperparameter sweep as training jobs of a Scheduler
+
+    Every config becomes a job `<name>-t<k>` of `slots` processes, queued with the config as its launch
+    arguments (bs, lr for trainer.launch_train), so the scheduler packs as many trials as fit on the free
+    slots (use a scheduler with backfill to mix trial sizes). `step` reads the validation metric of the
+    running trials from their logs through a LogIndex and applies successive halving: a trial that
+    reaches a rung epoch is stopped if it is not in the best 1/eta of the trials that reached the rung
+    (asynchronous, so trials are never paused waiting for the others). Everything is recorded in a
+    SweepLedger at `<ledger_dir>/<name>.jsonl`; trials the ledger already has as finished are not run again.
+    The ones it has as queued are followed if the scheduler still has their job (e.g. adopted after a
+    restart), otherwise run again from scratch (their old log is kept as `<log>.<time>`).
+
+    Args:
+        configs: list of {param: value}, see grid_configs and random_configs
+        rungs: epochs for successive halving, see halving_rungs; empty to run every trial to the end
+        max_concurrent: at most this many trials queued or running, None for all of them
+        single_node: place all the processes of a trial on one node, as trainer.submit_train does for
+            torch.distributed backends
+    """
+
+    def __init__(self, name, jtype, configs, scheduler, slots=1, rungs=(), eta=3, max_concurrent=None,
+                 priority=0, log_root='logs', ledger_dir='logs/sweeps', index=None, single_node=False):
+        self.name = name
+        self.jtype = jtype
+        self.scheduler = scheduler
+        self.slots = slots
+        self.single_node = single_node
+        self.rungs = sorted(rungs)
+        self.eta = eta
+        self.max_concurrent = max_concurrent
+        self.priority = priority
+        self.log_root = log_root
+        self.metric, self.mode = SWEEP_METRICS[jtype]
+        self.index = LogIndex(os.path.join(ledger_dir, 'index')) if index is None else index
+        self.ledger = SweepLedger(os.path.join(ledger_dir, '%s.jsonl' % name))
+
+        self.trials = self.ledger.trials()
+        # trial name -> scheduler request
+        self.requests = {}
+        if not self.trials:
+            self.ledger.append('sweep', name=name, jtype=jtype, slots=slots, rungs=self.rungs, eta=eta,
+                               metric=self.metric, mode=self.mode)
+        for k, config in enumerate(configs):
+            trial = '%s-t%d' % (name, k)
+            if trial not in self.trials:
+                self.ledger.append('trial', trial=trial, config=config)
+                self.trials[trial] = {'config': config, 'state': 'pending', 'metrics': {}, 'exit_status': None,
+                                      'reason': None}
+            elif self.trials[trial]['state'] == 'queued':
+                request = self.scheduler.find(trial, jtype)
+                if request is not None:
+                    # the scheduler has its job, e.g. adopted after a restart: follow it, its exit is recorded by step
+                    self.requests[trial] = request
+                else:
+                    # submitted by an earlier process that did not see it exit, run it again
+                    self._reset(trial)
+
+    def _job(self, trial):
+        return '%s_%s' % (trial, self.jtype)
+
+    def _log_file(self, trial):
+        return os.path.join(self.log_root, '%s.log' % self._job(trial))
+
+    def _reset(self, trial):
+        # back to pending with no metrics and a fresh log, the epochs of the earlier run are not mixed in
+        self.trials[trial].update(state='pending', metrics={}, exit_status=None, reason=None)
+        self.ledger.append('reset', trial=trial)
+        log_file = self._log_file(trial)
+        if os.path.isfile(log_file):
+            os.replace(log_file, '%s.%d' % (log_file, int(time.time())))
+        self.index.drop(self._job(trial))
+
+    def _better(self, a, b):
+        return a < b if self.mode == 'min' else a > b
+
+    def done(self):
+        return all(t['state'] in TRIAL_STATES[2:] for t in self.trials.values())
+
+    def step(self):
+        """Submit the pending trials, read the new metrics, stop the losing trials and record the exits"""
+        active = [n for n, t in self.trials.items() if t['state'] == 'queued']
+        for trial, t in self.trials.items():
+            if t['state'] != 'pending':
+                continue
+            if self.max_concurrent is not None and len(active) >= self.max_concurrent:
+                break
+            self.requests[trial] = self.scheduler.submit(trial, self.jtype, self.slots, priority=self.priority,
+                                                         single_node=self.single_node, **t['config'])
+            t['state'] = 'queued'
+            active.append(trial)
+            self.ledger.append('submit', trial=trial, request=self.requests[trial].id)
+
+        exited = dict((r.id, status) for r, status in self.scheduler.finished)
+        for trial in active:
+            t = self.trials[trial]
+            log_file = self._log_file(trial)
+            if os.path.isfile(log_file):
+                self.index.update(self._job(trial), [log_file])
+                for epoch, value in sorted(epoch_metrics(self.index, self._job(trial), self.metric).items()):
+                    if epoch not in t['metrics']:
+                        t['metrics'][epoch] = value
+                        self.ledger.append('metric', trial=trial, epoch=epoch, value=value)
+            request_id = self.requests[trial].id
+            if request_id in exited:
+                status = exited[request_id]
+                t['exit_status'] = status
+                t['state'] = 'stopped' if t['reason'] is not None else 'done' if status == 0 else 'failed'
+                self.ledger.append('exit', trial=trial, state=t['state'], exit_status=status)
+            elif t['reason'] is None:
+                reason = self._halving(trial)
+                if reason is not None:
+                    t['reason'] = reason
+                    self.ledger.append('stop', trial=trial, reason=reason)
+                    if self.scheduler.cancel(request_id):
+                        # never launched, so it will not show up in scheduler.finished
+                        t['state'] = 'stopped'
+                        self.ledger.append('exit', trial=trial, state=t['state'], exit_status=None)
+                    else:
+                        self.scheduler.kill(request_id)
+        return self.done()
+
+    def _halving(self, trial):
+        metrics = self.trials[trial]['metrics']
+        for rung in self.rungs:
+            if rung not in metrics:
+                break
+            values = sorted((t['metrics'][rung] for t in self.trials.values() if rung in t['metrics']),
+                            reverse=self.mode == 'max')
+            if len(values) < self.eta:
+                continue
+            keep = int(math.ceil(len(values) / float(self.eta)))
+            if self._better(values[keep - 1], metrics[rung]):
+                return '%s %.4g at epoch %d, not in the best %d of %d' % (self.metric, metrics[rung], rung, keep,
+                                                                        len(values))
+        return None
+
+    def run(self, interval=10.):
+        """Step every `interval` seconds until every trial finished, returns `results`"""
+        while not self.step():
+            time.sleep(interval)
+        return self.results()
+
+    def results(self):
+        """(trial, config, state, best metric, last epoch) of every trial, best first"""
+        rows = []
+        for trial, t in self.trials.items():
+            values = list(t['metrics'].values())
+            best = (min(values) if self.mode == 'min' else max(values)) if values else None
+            rows.append((trial, t['config'], t['state'], best, max(t['metrics']) if t['metrics'] else 0))
+        worst = float('inf') if self.mode == 'min' else -float('inf')
+        return sorted(rows, key=lambda r: (r[3] if r[3] is not None else worst) * (1 if self.mode == 'min' else -1))
+
+
+def parse_space(items):
+    # ['lr=0.001,0.002', 'bs=1,2'] -> {'lr': [0.001, 0.002], 'bs': [1, 2]}, 'lr=1e-4:1e-2:log' -> (1e-4, 1e-2, 'log')
+    space = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        if ':' in values:
+            parts = values.split(':')
+            space[name] = tuple([float(parts[0]), float(parts[1])] + parts[2:])
+        else:
+            space[name] = [json.loads(v) for v in values.split(',')]
+    return space
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('name')
+    parser.add_argument('--jtype', type=str, default='stereo', choices=['class', 'stereo'])
+    parser.add_argument('--space', type=str, nargs='+', default=['lr=0.001,0.002', 'bs=1,2'],
+                        help='param=v1,v2 (choices) or param=low:high[:log]')
+    parser.add_argument('--search', type=str, default='grid', choices=['grid', 'random', 'halving'])
+    parser.add_argument('--trials', type=int, default=9, help='configs of a random or halving search')
+    parser.add_argument('--slots', type=int, default=1, help='GPUs of a trial')
+    parser.add_argument('--min-epochs', type=int, default=1, help='first rung of halving')
+    parser.add_argument('--max-epochs', type=int, default=None)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from trainer import DIST_BACKEND, LOG_ROOT, get_scheduler
+
+    space = parse_space(args.space)
+    if args.search == 'grid':
+        configs = grid_configs(space)
+    else:
+        configs = random_configs(space, args.trials, args.seed)
+    rungs = halving_rungs(args.min_epochs, args.eta, args.max_epochs) if args.search == 'halving' else []
+    scheduler = get_scheduler()
+    scheduler.backfill = True
+    sweep = Sweep(args.name, args.jtype, configs, scheduler, slots=args.slots, rungs=rungs, eta=args.eta,
+                  log_root=LOG_ROOT, ledger_dir=os.path.join(LOG_ROOT, 'sweeps'),
+                  single_node=DIST_BACKEND != 'horovod')
+    for trial, config, state, best, epoch in sweep.run():
+        print(trial, config, state, best, epoch)
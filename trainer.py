@@ -19,17 +19,24 @@ from utils import set_running_statistics
 from ofa.stereo_matching.elastic_nn.networks.ofa_aanet import OFAAANet
 from translator import translate, get_word_result
 from net_utils.settings import *
+from job_registry import JobRegistry
+from scheduler import Scheduler, parse_hosts
 import threading
 
 LOG_ROOT = 'logs'
+JOB_REGISTRY = JobRegistry(os.path.join(LOG_ROOT, 'jobs.sqlite'))
+SCHEDULER = None
 
 class JobThread(threading.Thread):
-    def __init__(self, process):
+    def __init__(self, process, job_id=None):
         super().__init__()
         self.process = process
+        self.job_id = job_id
 
     def run(self):
         self.process.communicate()
+        if self.job_id is not None:
+            JOB_REGISTRY.finish(self.job_id, self.process.returncode)
 
 def list_jobs(jtype='class'):
 
@@ -54,41 +61,36 @@ def query_all(jtype='class'):
 
     rjs = query_running(jtype)
     rjs = [rj[1] for rj in rjs]
+    jtype = 'class' if jtype == 'class' else 'stereo'
+    qjs = [] if SCHEDULER is None else [q[1] for q in SCHEDULER.status()['queued'] if q[2] == jtype]
+    qjs = [job for job in qjs if not job in rjs]
     jobs = list_jobs(jtype)
     sjs = ["_".join(job.split("_")[:-1]) for job in jobs]
-    sjs = [job for job in sjs if not job in rjs]
-    jobs = rjs + sjs
+    sjs = [job for job in sjs if not job in rjs and not job in qjs]
+    jobs = rjs + qjs + sjs
 
     j_status = ["(running)" for job in rjs]
+    j_status.extend(["(queued)" for job in qjs])
     j_status.extend(["(stopped)" for job in sjs])
     return jobs, j_status
 
 def stop_job(jn, jtype='class'):
-    rjs = query_running(jtype)
-    jns = [rj[1] for rj in rjs]
-    if jn in jns:
-        jid = jns.index(jn)
-        pid = rjs[jid][0]
-        print(pid)
-        os.kill(int(pid), 9)
+    jtype = 'class' if jtype == 'class' else 'stereo'
+    if SCHEDULER is not None:
+        for q in SCHEDULER.status()['queued']:
+            if q[1] == jn and q[2] == jtype:
+                SCHEDULER.cancel(q[0])
+    for job in JOB_REGISTRY.running(jtype):
+        if job['name'] == jn:
+            print(job['pid'])
+            os.kill(job['pid'], 9)
+            JOB_REGISTRY.finish(job['id'], -9)
 
 def query_running(jtype='class'):
 
-    if jtype == 'class':
-        kw = 'train_ofa_net.py'
-    else:
-        kw = 'train_ofa_stereo.py'
-
-    user = os.getenv('USER')
-    cmd = ['ps', '-ax'] 
-    #print(cmd)
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    stdout = p.communicate()[0]
-    ps = stdout.decode("utf-8").split('\n')
-    ps = [line for line in ps if kw in line]
-    ps = [line for line in ps if 'mpirun' in line]
-    ps = [[line.split()[0], line.split()[-1]] for line in ps]
-    return ps
+    # [pid, name] of the running jobs launched by train_class / train_stereo, from the job registry
+    jtype = 'class' if jtype == 'class' else 'stereo'
+    return [[str(job['pid']), job['name']] for job in JOB_REGISTRY.running(jtype)]
 
 def check_job_name(name=None, jtype='class'):
     if name == None:
@@ -99,69 +101,115 @@ def check_job_name(name=None, jtype='class'):
     jobs, j_status = query_all(jtype)
     if name in jobs:
         jid = jobs.index(name)
-        if "running" in j_status[jid]:
-            return 1 # running
+        if "running" in j_status[jid] or "queued" in j_status[jid]:
+            return 1 # running or waiting for slots
         else:
             return 2 # stop
     else:
         return 3 # new
 
-def train_class(model='ofa', name='test', num_nodes=2, hosts='host1:2,host2:2', bs=16, lr=0.04):
+TRAIN_SCRIPTS = {'class': 'train_ofa_net.py', 'stereo': 'train_ofa_stereo.py'}
 
-    print(model, hosts, bs, name)
+def build_train_cmd(jtype, name, num_procs, hosts, bs, lr, backend=None):
 
-    cmd = deepcopy(MPI_PREFIX)
-    cmd.append('-np')
-    cmd.append(str(num_nodes*2))
-    cmd.append('-H')
-    cmd.append(hosts)
-    cmd.append(PYTHON_HOME)
-    cmd.append('-W ignore')
-    cmd.append('train_ofa_net.py')
+    backend = DIST_BACKEND if backend is None else backend
+    if backend == 'horovod':
+        cmd = deepcopy(MPI_PREFIX)
+        cmd.append('-np')
+        cmd.append(str(num_procs))
+        cmd.append('-H')
+        cmd.append(hosts)
+        cmd.append(PYTHON_HOME)
+        cmd.append('-W ignore')
+    else:
+        # torch.distributed: a single mpirun process starts torchrun on the allocated node, which starts
+        # the num_procs workers there
+        allocation = parse_hosts(hosts)
+        if len(allocation) > 1:
+            raise ValueError('%s jobs run on a single node, got %s' % (backend, hosts))
+        cmd = deepcopy(MPI_PREFIX)
+        cmd.extend(['-np', '1', '-H', '%s:1' % list(allocation)[0], '-x', 'MANTA_DIST_BACKEND'])
+        cmd.extend([PYTHON_HOME, '-W ignore', '-m', 'torch.distributed.run', '--standalone',
+                    '--nproc_per_node', str(num_procs)])
+    cmd.append(TRAIN_SCRIPTS[jtype])
     cmd.append('--lr')
     cmd.append(str(lr))
     cmd.append('--bs')
     cmd.append(str(bs))
     cmd.append('--name')
     cmd.append(name)
+    return cmd
+
+def launch_train(jtype, name, num_procs, hosts, bs, lr, num_nodes=None):
+
+    cmd = build_train_cmd(jtype, name, num_procs, hosts, bs, lr)
     print(cmd)
 
-    logF = 'logs/%s_class.log' % name
+    logF = 'logs/%s_%s.log' % (name, jtype)
+    # read by build_dist_backend of the run managers
+    env = dict(os.environ, MANTA_DIST_BACKEND=DIST_BACKEND)
     with open(logF, 'a') as f:
-        p = subprocess.Popen(cmd, stdout=f, stderr=f)
+        p = subprocess.Popen(cmd, stdout=f, stderr=f, env=env)
+    if num_nodes is None:
+        num_nodes = len(parse_hosts(hosts))
+    job_id = JOB_REGISTRY.register(name, jtype, p.pid, hosts=hosts, num_nodes=num_nodes, cmd=cmd, log_file=logF)
     print('launching cmd: ', cmd)
     print('cmd launched, waiting until it is finished...')
-    JobThread(p).start()
+    JobThread(p, job_id).start()
     return p
 
-def train_stereo(model='ofa', name='test', num_nodes=2, hosts='host1:2,host2:2', bs=1, lr=0.001):
+def train_class(model='ofa', name='test', num_nodes=2, hosts='host1:2,host2:2', bs=16, lr=0.04):
 
     print(model, hosts, bs, name)
+    return launch_train('class', name, num_nodes*2, hosts, bs, lr, num_nodes)
 
-    cmd = deepcopy(MPI_PREFIX)
-    cmd.append('-np')
-    cmd.append(str(num_nodes*2))
-    cmd.append('-H')
-    cmd.append(hosts)
-    cmd.append(PYTHON_HOME)
-    cmd.append('-W ignore')
-    cmd.append('train_ofa_stereo.py')
-    cmd.append('--lr')
-    cmd.append(str(lr))
-    cmd.append('--bs')
-    cmd.append(str(bs))
-    cmd.append('--name')
-    cmd.append(name)
-    print(cmd)
-
-    logF = 'logs/%s_stereo.log' % name
-    with open(logF, 'a') as f:
-        p = subprocess.Popen(cmd, stdout=f, stderr=f)
-    print('launching cmd: ', cmd)
-    print('cmd launched, waiting until it is finished...')
-    JobThread(p).start()
-    return p
+def train_stereo(model='ofa', name='test', num_nodes=2, hosts='host1:2,host2:2', bs=1, lr=0.001):
 
+    print(model, hosts, bs, name)
+    return launch_train('stereo', name, num_nodes*2, hosts, bs, lr, num_nodes)
+
+# Scheduler exit status of an adopted job that exited without one in the registry (its JobThread was gone)
+UNKNOWN_EXIT_STATUS = -1
+
+class RegisteredProcess(object):
+    # poll() and kill() of a job launched by an earlier server process, from the job registry
+    def __init__(self, job):
+        self.job = job
+
+    def poll(self):
+        if JOB_REGISTRY.is_alive(self.job):
+            return None
+        # the row read when the job was adopted has no exit status yet, read the current one
+        job = JOB_REGISTRY.get(self.job['id'])
+        if job is None or job['exit_status'] is None:
+            return UNKNOWN_EXIT_STATUS
+        return job['exit_status']
+
+    def kill(self):
+        if JOB_REGISTRY.is_alive(self.job):
+            os.kill(self.job['pid'], 9)
+        JOB_REGISTRY.finish(self.job['id'], -9)
+
+def _launch_request(request, hosts, num_procs):
+    return launch_train(request.jtype, request.name, num_procs, hosts, request.kwargs['bs'], request.kwargs['lr'])
+
+def get_scheduler():
+
+    # the scheduler of this server process, which accounts for the jobs still running from the registry
+    global SCHEDULER
+    if SCHEDULER is None:
+        SCHEDULER = Scheduler(GPU_NODES, _launch_request)
+        for job in JOB_REGISTRY.running():
+            SCHEDULER.adopt(job['name'], parse_hosts(job['hosts']), RegisteredProcess(job))
+        SCHEDULER.start()
+    return SCHEDULER
+
+def submit_train(jtype, name, num_procs, bs, lr, hosts=None, priority=0):
+
+    # queue a training job of num_procs processes on free slots of hosts (any GPU node if None);
+    # torchrun starts the processes of a torch.distributed job on a single node
+    return get_scheduler().submit(name, jtype, num_procs, priority=priority, hosts=hosts,
+                                  single_node=DIST_BACKEND != 'horovod', bs=bs, lr=lr)
 
 if __name__ == '__main__':
     filename = 'data/cat.jpeg'
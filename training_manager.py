@@ -1,9 +1,15 @@
+import os
 import streamlit as st
 from PIL import Image
 import time
+import threading
 from detector import detect_class, detect_stereo
 import net_utils.settings as settings
 from trainer import train_class, train_stereo, query_running, query_stopped, query_all, stop_job, check_job_name
+from trainer import LOG_ROOT, submit_train, get_scheduler
+from log_tail import LogFollower, serve_logs
+from log_index import LogIndex
+from sweep import Sweep, grid_configs, halving_rungs
 
 st.set_option('deprecation.showfileUploaderEncoding', False)
 
@@ -20,7 +26,116 @@ CLASS_DATASETS = ['ImageNet']
 class_checkpoints = ['checkpoints/ofa_mbv3_d234_e346_k357_w1.0']
 DEPTH_MODELS = ['OFA_AANet']
 DEPTH_DATASETS = ['FlyingThings3D', 'Monkaa']
-node_list = ['host%d' % (i+1) for i in range(2)]
+node_list = list(settings.GPU_NODES)
+# lines of the log shown, and seconds between two refreshes when following it
+LOG_LINES = 20
+LOG_FOLLOW_INTERVAL = 1.0
+# larger logs are not loaded into st.download_button but streamed by the log server
+LOG_DOWNLOAD_INLINE_BYTES = 16 * 1024 ** 2
+LOG_SERVER_PORT = 8502
+# seconds between two steps of a running sweep
+SWEEP_INTERVAL = 10.0
+
+
+@st.cache_resource
+def get_log_follower():
+    # shared by the sessions and kept across reruns, so a refresh only reads the appended bytes
+    return LogFollower(max_lines=LOG_LINES)
+
+
+@st.cache_resource
+def get_log_server():
+    # the interface of the Streamlit server, localhost unless it is configured to listen elsewhere
+    return serve_logs(LOG_ROOT, host=st.get_option('server.address') or '127.0.0.1', port=LOG_SERVER_PORT)
+
+
+@st.cache_resource
+def get_log_index():
+    return LogIndex(os.path.join(LOG_ROOT, 'index'))
+
+
+def show_curves(log_file):
+    # parses only what the job wrote since the last render
+    index = get_log_index()
+    job = os.path.basename(log_file)[:-len('.log')]
+    index.update(job, [log_file])
+    curves = index.query(job, columns=['global_step', 'loss'], phase='train')
+    if len(curves['loss']) > 0:
+        st.line_chart({'step': curves['global_step'], 'train loss': curves['loss']}, x='step')
+
+
+@st.cache_resource
+def get_sweeps():
+    # name -> Sweep, each run by a daemon thread of the server
+    return {}
+
+
+def start_sweep(name, jtype, bs_list, lr_list, search, min_epochs):
+    configs = grid_configs({'bs': bs_list, 'lr': lr_list})
+    rungs = halving_rungs(min_epochs) if search == 'Successive halving' else []
+    sweep = Sweep(name, jtype, configs, get_scheduler(), rungs=rungs, log_root=LOG_ROOT,
+                  ledger_dir=os.path.join(LOG_ROOT, 'sweeps'), index=get_log_index(),
+                  single_node=settings.DIST_BACKEND != 'horovod')
+    get_sweeps()[name] = sweep
+    threading.Thread(target=sweep.run, args=(SWEEP_INTERVAL,), name='sweep-%s' % name, daemon=True).start()
+
+
+def show_sweeps(jtype, bs_options, lr_options, sweep_name):
+    st.sidebar.title("Sweep")
+    bs_list = st.sidebar.multiselect("Batch sizes", bs_options, bs_options)
+    lr_list = st.sidebar.multiselect("Learning rates", lr_options, lr_options)
+    search = st.sidebar.selectbox("Search", ['Grid', 'Successive halving'])
+    min_epochs = st.sidebar.number_input("First halving epoch", min_value=1, value=1)
+    if st.sidebar.button('Sweep!'):
+        # one GPU per trial, packed on the free slots of all the nodes
+        if sweep_name.strip() == "" or "_" in sweep_name or sweep_name.strip() in get_sweeps():
+            st.warning('You have input an invalid sweep name (it is the job name, without "_"). Try another.')
+        elif not bs_list or not lr_list:
+            st.warning('Please choose at least one batch size and learning rate.')
+        else:
+            start_sweep(sweep_name.strip(), jtype, bs_list, lr_list, search, min_epochs)
+
+    for name, sweep in get_sweeps().items():
+        if sweep.jtype != jtype:
+            continue
+        st.write("Sweep %s (%s)" % (name, "finished" if sweep.done() else "running"))
+        st.table([{'trial': trial, 'bs': config['bs'], 'lr': config['lr'], 'state': state, sweep.metric: best,
+                   'epochs': epoch} for trial, config, state, best, epoch in sweep.results()])
+
+
+def show_log(log_file, running):
+    if not os.path.isfile(log_file):
+        # queued, not launched yet
+        st.info('Waiting for free GPUs.')
+        return
+    show_curves(log_file)
+    log_area = st.container()
+    if os.path.getsize(log_file) <= LOG_DOWNLOAD_INLINE_BYTES:
+        with open(log_file, "r") as f:
+            st.download_button(label="Download the complete log file", data=f)
+    else:
+        # linked at the address the log server listens on, the browser address if it listens everywhere
+        host, port = get_log_server().server_address[:2]
+        if host in ('0.0.0.0', '::', ''):
+            host = st.get_option('browser.serverAddress')
+        st.markdown('[Download the complete log file](http://%s:%d/%s)' % (host, port, os.path.basename(log_file)))
+        if host in ('127.0.0.1', '::1', 'localhost'):
+            st.caption('The log server only listens on localhost, this link works on the server itself. '
+                       'Set server.address to serve the logs to the network.')
+
+    follow = running and st.checkbox('Follow the log')
+    with log_area:
+        show_log_tail(log_file, LOG_FOLLOW_INTERVAL if follow else None)
+
+
+def show_log_tail(log_file, interval):
+    # a fragment reruns alone every `interval` seconds, the rest of the page (e.g. the sweeps) is not blocked
+    @st.fragment(run_every=interval)
+    def tail():
+        contents = [line.strip() for line in get_log_follower().tail(log_file)]
+        st.text('\n'.join(contents))
+    tail()
+
 
 #st.sidebar.write(" ------ ")
 
@@ -36,6 +151,8 @@ if app_mode == SIDEBAR_OPTION_IMAGE_CLASSIFICATION or app_mode == SIDEBAR_OPTION
     node_sts = []
     for node in node_list:
         node_sts.append(st.sidebar.checkbox(node))
+    free = get_scheduler().status()['free']
+    st.sidebar.caption('Free GPUs: ' + ', '.join('%s %d/%d' % (n, free[n], settings.GPU_NODES[n]) for n in node_list))
 
     st.sidebar.title("Job Name")
     job_name = st.sidebar.text_input('Please type in the following', '')
@@ -81,11 +198,17 @@ if app_mode == SIDEBAR_OPTION_IMAGE_CLASSIFICATION:
             if len(node_chosen) == 0:
                 st.warning('Please choose at least one node for training.')
             else:
-                st.warning('Please wait for the magic to happen! This may take up to a minute.')
-                node_str = [n+":2" for n in node_chosen]
-                node_str = ",".join(node_str)
-                print(node_str)
-                train_class(name=job_name, bs=bs_set, num_nodes=len(node_chosen), hosts=node_str, lr=lr_set)
+                # queued until the chosen nodes have enough free GPUs, then launched on the free ones;
+                # a torch.distributed job runs on one of them (torchrun starts its processes on one node)
+                if settings.DIST_BACKEND == 'horovod':
+                    num_procs = sum(settings.GPU_NODES[n] for n in node_chosen)
+                else:
+                    num_procs = max(settings.GPU_NODES[n] for n in node_chosen)
+                request = submit_train('class', job_name, num_procs, bs_set, lr_set, hosts=node_chosen)
+                if request.id in [r[0] for r in get_scheduler().status()['running']]:
+                    st.warning('Please wait for the magic to happen! This may take up to a minute.')
+                else:
+                    st.warning('The chosen nodes are busy, the job is queued until %d GPUs are free.' % num_procs)
 
     if job != None:
         j, js = job.split()
@@ -93,14 +216,9 @@ if app_mode == SIDEBAR_OPTION_IMAGE_CLASSIFICATION:
         if pressed:
             stop_job(j)
 
-        logArea = st.empty()
-        with open("logs/%s_class.log" % j, "r") as f:
-            st.download_button(label="Download the complete log file", data=f)
+        show_log(os.path.join(LOG_ROOT, "%s_class.log" % j), "running" in js)
 
-        with open("logs/%s_class.log" % j, "r") as f:
-            contents = f.readlines()[-20:]
-            contents = [line.strip() for line in contents]
-            logArea.text('\n'.join(contents))
+    show_sweeps('class', [2, 4, 8, 16], [0.01, 0.02, 0.04, 0.08], job_name)
 
 elif app_mode == SIDEBAR_OPTION_STEREO_MATCHING:
 
@@ -143,11 +261,17 @@ elif app_mode == SIDEBAR_OPTION_STEREO_MATCHING:
             if len(node_chosen) == 0:
                 st.warning('Please choose at least one node for training.')
             else:
-                st.warning('Please wait for the magic to happen! This may take up to a minute.')
-                node_str = [n+":2" for n in node_chosen]
-                node_str = ",".join(node_str)
-                print(node_str)
-                train_stereo(name=job_name, bs=bs_set, num_nodes=len(node_chosen), hosts=node_str, lr=lr_set)
+                # queued until the chosen nodes have enough free GPUs, then launched on the free ones;
+                # a torch.distributed job runs on one of them (torchrun starts its processes on one node)
+                if settings.DIST_BACKEND == 'horovod':
+                    num_procs = sum(settings.GPU_NODES[n] for n in node_chosen)
+                else:
+                    num_procs = max(settings.GPU_NODES[n] for n in node_chosen)
+                request = submit_train('stereo', job_name, num_procs, bs_set, lr_set, hosts=node_chosen)
+                if request.id in [r[0] for r in get_scheduler().status()['running']]:
+                    st.warning('Please wait for the magic to happen! This may take up to a minute.')
+                else:
+                    st.warning('The chosen nodes are busy, the job is queued until %d GPUs are free.' % num_procs)
 
     if job != None:
         j, js = job.split()
@@ -155,12 +279,7 @@ elif app_mode == SIDEBAR_OPTION_STEREO_MATCHING:
         if pressed:
             stop_job(j, 'stereo')
 
-        logArea = st.empty()
-        with open("logs/%s_stereo.log" % j, "r") as f:
-            st.download_button(label="Download the complete log file", data=f)
+        show_log(os.path.join(LOG_ROOT, "%s_stereo.log" % j), "running" in js)
 
-        with open("logs/%s_stereo.log" % j, "r") as f:
-            contents = f.readlines()[-20:]
-            contents = [line.strip() for line in contents]
-            logArea.text('\n'.join(contents))
+    show_sweeps('stereo', [1, 2], [0.001, 0.002], job_name)
 